@@ -1,17 +1,11 @@
-import sqlite3
+import asyncio
 
+from storage import SQLiteStorage
+
+# Схема всіх таблиць тепер описана в storage.py, скрипт лише застосовує її
 def add_rooms_table():
-    conn = sqlite3.connect("bot.db")
-    c = conn.cursor()
-    c.execute("""CREATE TABLE IF NOT EXISTS rooms (
-        token TEXT PRIMARY KEY,
-        creator_id INTEGER,
-        created_at REAL,
-        FOREIGN KEY (creator_id) REFERENCES users (user_id)
-    )""")
-    conn.commit()
-    conn.close()
+    asyncio.run(SQLiteStorage("bot.db").init_schema(cleanup=False))
     print("Table 'rooms' created successfully.")
 
 if __name__ == "__main__":
-    add_rooms_table()
\ No newline at end of file
+    add_rooms_table()
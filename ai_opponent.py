@@ -0,0 +1,123 @@
+# Бот-суперник для спарингу, коли черга пошуку порожня.
+# Політика - передрахована таблиця (дистанція, відро здоров’я, відро енергії) -> дії,
+# отримана однокроковим expectimax поверх правил fight_engine.resolve_round:
+# для кожної дії бота усереднюється результат проти всіх доступних дій суперника.
+# Під час бою вибір дії - це один пошук у словнику.
+
+import random
+import threading
+
+import rules
+from fight_engine import MatchTable, legal_actions, resolve_round
+
+# Службові акаунти ботів (від’ємні id не перетинаються з Telegram user_id)
+AI_FIGHTERS = {
+    "swarmer": (-1, "Bot_Swarmer"),
+    "out_boxer": (-2, "Bot_Outboxer"),
+    "counter_puncher": (-3, "Bot_Counter"),
+}
+
+HEALTH_BUCKETS = 5
+STAMINA_BUCKETS = 5
+# Дистанція з точки зору бота
+DISTANCES = ("far", "close", "cornered_me", "cornered_opp")
+SAMPLES = 8
+# Ймовірність зіграти другу за якістю дію, щоб бот не був передбачуваним
+SECOND_CHOICE_CHANCE = 0.2
+
+# (тип бота, тип суперника) -> політика. Словник не змінюється після
+# побудови: build_all_policies підміняє його цілком
+policies = {}
+_build_lock = threading.Lock()
+
+
+def is_ai_player(user_id):
+    return user_id is not None and user_id < 0
+
+
+def _bucket(value, maximum, buckets):
+    if maximum <= 0:
+        return 0
+    return min(buckets - 1, max(0, int(value / maximum * buckets)))
+
+
+# Дистанція матчу з точки зору бота (player_num - 1 або 2)
+def ai_distance(distance, player_num):
+    if distance.startswith("cornered_"):
+        return "cornered_me" if distance == f"cornered_p{player_num}" else "cornered_opp"
+    return distance
+
+
+def _score(before_health, before_stamina, result):
+    # Різниця урону плюс невеликий бонус за запас енергії та позицію
+    dealt = before_health[1] - result.health[1]
+    taken = before_health[0] - result.health[0]
+    score = dealt - taken + 0.1 * (result.stamina[0] - before_stamina[0])
+    if result.distance == "cornered_p2":
+        score += 5
+    elif result.distance == "cornered_p1":
+        score -= 5
+    return score
+
+
+# Побудова політики: бот завжди грає за гравця 1 в симуляції
+def build_policy(ai_type, opponent_type, samples=SAMPLES, seed=0, ruleset=None):
+    ruleset = ruleset or rules.current
+    fighters = ruleset.fighters
+    ai_stats = dict(fighters[ai_type].stats(), fighter_type=ai_type)
+    opponent_stats = dict(fighters[opponent_type].stats(), fighter_type=opponent_type)
+    table = MatchTable("ai", ai_stats, "opponent", opponent_stats, ruleset)
+    rng = random.Random(seed).random
+    sim_distance = {"far": "far", "close": "close", "cornered_me": "cornered_p1", "cornered_opp": "cornered_p2"}
+    opponent_health = 0.6 * opponent_stats["health"]
+
+    policy = {}
+    for distance in DISTANCES:
+        distance_value = sim_distance[distance]
+        my_actions = legal_actions(distance_value, 1)
+        their_actions = legal_actions(distance_value, 2)
+        for health_bucket in range(HEALTH_BUCKETS):
+            health = (health_bucket + 0.5) / HEALTH_BUCKETS * ai_stats["health"]
+            for stamina_bucket in range(STAMINA_BUCKETS):
+                stamina = (stamina_bucket + 0.5) / STAMINA_BUCKETS * 100
+                before_health, before_stamina = (health, opponent_health), (stamina, 50)
+                values = []
+                for action in my_actions:
+                    total = 0
+                    for response in their_actions:
+                        for _ in range(samples):
+                            result = resolve_round(table, distance_value, before_health, before_stamina, (action, response), rng)
+                            total += _score(before_health, before_stamina, result)
+                    values.append((total / (samples * len(their_actions)), action))
+                values.sort(reverse=True)
+                policy[(distance, health_bucket, stamina_bucket)] = (values[0][1], values[1][1])
+    return policy
+
+
+# Повільно (частки секунди на пару типів): лише в окремому потоці. Нові
+# політики будуються для поточних правил окремо від старих, тож до заміни
+# бот грає за старими (зокрема після rules.reload_rules)
+def build_all_policies():
+    global policies
+    with _build_lock:
+        current = rules.current
+        policies = {
+            (ai_type, opponent_type): build_policy(ai_type, opponent_type, ruleset=current)
+            for ai_type in AI_FIGHTERS if ai_type in current.fighters
+            for opponent_type in current.fighters
+        }
+
+
+# None, якщо політику ще не побудовано
+def get_policy(ai_type, opponent_type):
+    return policies.get((ai_type, opponent_type))
+
+
+def choose_action(policy, distance, player_num, health, max_health, stamina, rng=random.random):
+    if policy is None:
+        # Поки політики будуються - випадкова доступна дія
+        actions = legal_actions(distance, player_num)
+        return actions[int(rng() * len(actions))]
+    key = (ai_distance(distance, player_num), _bucket(health, max_health, HEALTH_BUCKETS), _bucket(stamina, 100, STAMINA_BUCKETS))
+    best, second = policy[key]
+    return second if rng() < SECOND_CHOICE_CHANCE else best
@@ -0,0 +1,65 @@
+# Резервні копії бази без зупинки гри (лише SQLite, див. Storage.backup).
+# Копія пишеться в тимчасовий файл онлайн-бекапом SQLite порціями сторінок,
+# за потреби стискається gzip і атомарно перейменовується, тож у BACKUP_DIR
+# ніколи не лежить напівзаписаний бекап. Зберігаються BACKUP_KEEP
+# найновіших копій. Розклад і /backup_now - у main.py.
+
+import asyncio
+import glob
+import gzip
+import logging
+import os
+import shutil
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", 7))
+BACKUP_COMPRESS = os.getenv("BACKUP_COMPRESS", "1") == "1"
+BACKUP_PREFIX = "bot_"
+
+
+def compress_file(path):
+    with open(path, "rb") as source, gzip.open(f"{path}.gz", "wb", compresslevel=6) as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+    os.remove(path)
+    return f"{path}.gz"
+
+
+def apply_retention(directory=BACKUP_DIR, keep=BACKUP_KEEP):
+    # Імена містять час, тож сортування за іменем - від старих до нових
+    backups = sorted(glob.glob(os.path.join(directory, f"{BACKUP_PREFIX}*.db*")))
+    removed = backups[:-keep] if keep > 0 else []
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+async def create_backup(db, directory=BACKUP_DIR, compress=BACKUP_COMPRESS, keep=BACKUP_KEEP):
+    os.makedirs(directory, exist_ok=True)
+    started = time.perf_counter()
+    name = f"{BACKUP_PREFIX}{time.strftime('%Y%m%d_%H%M%S')}.db"
+    tmp_path = os.path.join(directory, f".{name}.tmp")
+    try:
+        await db.backup(tmp_path)
+        if compress:
+            tmp_path = await asyncio.to_thread(compress_file, tmp_path)
+            name += ".gz"
+        path = os.path.join(directory, name)
+        os.replace(tmp_path, path)
+    finally:
+        for leftover in (tmp_path, f"{tmp_path}.gz"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+    removed = await asyncio.to_thread(apply_retention, directory, keep)
+    size = os.path.getsize(path)
+    logger.info(
+        f"Backup {path} written in {time.perf_counter() - started:.1f}s ({size / 1024 / 1024:.1f} MB), "
+        f"removed {len(removed)} old backups"
+    )
+    return path, size
@@ -0,0 +1,94 @@
+# Порівняння HTTP-сесій бота на локальному фейковому Bot API:
+#   python bench_http.py --requests 2000 --concurrency 50 --delay 0.02
+# Сервер відповідає на sendMessage із заданою затримкою і рахує TCP-з’єднання,
+# тож видно і затримку запитів, і скільки сокетів відкриває кожна сесія.
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+from http_session import create_http_session
+
+TOKEN = "123456:bench"
+
+
+def build_fake_api(delay, connections):
+    async def handle_method(request):
+        # Транспорт - одне TCP-з’єднання, тож різні транспорти = різні сокети
+        connections.add(id(request.transport))
+        data = await request.post()
+        await asyncio.sleep(delay)
+        return web.json_response({
+            "ok": True,
+            "result": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": int(data.get("chat_id", 1)), "type": "private"},
+                "text": data.get("text", ""),
+            },
+        })
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", handle_method)
+    return app
+
+
+async def run_session(name, session, total, concurrency):
+    bot = Bot(token=TOKEN, session=session)
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(i):
+        async with semaphore:
+            started = time.perf_counter()
+            await bot.send_message(chat_id=i % 1000 + 1, text=f"Раунд {i}")
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    await bot.session.close()
+    latencies.sort()
+    return {
+        "name": name,
+        "rps": total / elapsed,
+        "p50": statistics.median(latencies) * 1000,
+        "p95": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+async def main(args):
+    connections = set()
+    runner = web.AppRunner(build_fake_api(args.delay, connections))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", args.port)
+    await site.start()
+    api = TelegramAPIServer.from_base(f"http://127.0.0.1:{args.port}")
+    try:
+        for name, make_session in (
+            ("default", lambda: AiohttpSession(api=api)),
+            ("tuned", lambda: create_http_session(api=api)),
+        ):
+            connections.clear()
+            result = await run_session(name, make_session(), args.requests, args.concurrency)
+            print(
+                f"{result['name']:>8}: {result['rps']:8.1f} req/s, p50 {result['p50']:6.1f} ms, "
+                f"p95 {result['p95']:6.1f} ms, connections {len(connections)}"
+            )
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Bot API client sessions against a local fake server")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.02, help="затримка відповіді сервера, секунд")
+    parser.add_argument("--port", type=int, default=8099)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,140 @@
+# Трансляція боїв для глядачів (/watch).
+# process_round рендерить текст раунду один раз і викликає publish(), який лише
+# кладе його в буфери підписників і нічого не чекає. Кожен глядач має власне
+# завдання-відправник: воно шле не частіше за SEND_INTERVAL, а все, що
+# накопичилось за цей час, склеює в одне повідомлення. Повільний чи
+# заблокований глядач гальмує лише себе, а не бійців.
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Telegram дозволяє приблизно одне повідомлення на секунду в один чат
+SEND_INTERVAL = 1.0
+# Скільки непрочитаних раундів тримати на глядача (старіші відкидаються)
+MAX_PENDING = 5
+MAX_MESSAGE_LENGTH = 4096
+# Після стількох помилок поспіль глядача відписуємо
+MAX_FAILURES = 3
+MAX_WATCHERS_PER_MATCH = 500
+
+# match_id -> {chat_id: Subscriber}
+watchers = {}
+# chat_id -> match_id (один бій на глядача)
+watching = {}
+
+
+class Subscriber:
+    __slots__ = ("chat_id", "match_id", "pending", "wakeup", "closing", "failures", "task")
+
+    def __init__(self, chat_id, match_id):
+        self.chat_id = chat_id
+        self.match_id = match_id
+        self.pending = []
+        self.wakeup = asyncio.Event()
+        self.closing = False
+        self.failures = 0
+        self.task = None
+
+    def push(self, text):
+        self.pending.append(text)
+        if len(self.pending) > MAX_PENDING:
+            del self.pending[0]
+        self.wakeup.set()
+
+    def take(self):
+        pending = self.pending
+        self.pending = []
+        self.wakeup.clear()
+        text = "\n\n".join(pending)
+        if len(text) > MAX_MESSAGE_LENGTH:
+            # Найсвіжіше важливіше, тому обрізаємо початок
+            text = "…" + text[-(MAX_MESSAGE_LENGTH - 1):]
+        return text
+
+
+async def _sender(subscriber, send):
+    last_sent = 0.0
+    try:
+        while True:
+            await subscriber.wakeup.wait()
+            delay = last_sent + SEND_INTERVAL - time.monotonic()
+            if delay > 0:
+                # За цей час можуть надійти нові раунди - вони підуть одним повідомленням
+                await asyncio.sleep(delay)
+            text = subscriber.take()
+            if text:
+                try:
+                    await send(subscriber.chat_id, text)
+                    subscriber.failures = 0
+                except Exception as e:
+                    subscriber.failures += 1
+                    logger.debug(f"Failed to send broadcast to {subscriber.chat_id}: {e}")
+                    if subscriber.failures >= MAX_FAILURES:
+                        logger.info(f"Dropping spectator {subscriber.chat_id} of match {subscriber.match_id}")
+                        break
+                last_sent = time.monotonic()
+            if subscriber.closing and not subscriber.pending:
+                break
+    finally:
+        _forget(subscriber)
+
+
+def _forget(subscriber):
+    match_watchers = watchers.get(subscriber.match_id)
+    if match_watchers and match_watchers.get(subscriber.chat_id) is subscriber:
+        del match_watchers[subscriber.chat_id]
+        if not match_watchers:
+            del watchers[subscriber.match_id]
+    if watching.get(subscriber.chat_id) == subscriber.match_id:
+        del watching[subscriber.chat_id]
+
+
+# send - корутина send(chat_id, text). Повертає False, якщо глядачів забагато
+def subscribe(match_id, chat_id, send):
+    unsubscribe(chat_id)
+    match_watchers = watchers.setdefault(match_id, {})
+    if len(match_watchers) >= MAX_WATCHERS_PER_MATCH:
+        return False
+    subscriber = Subscriber(chat_id, match_id)
+    match_watchers[chat_id] = subscriber
+    watching[chat_id] = match_id
+    subscriber.task = asyncio.create_task(_sender(subscriber, send))
+    return True
+
+
+# Повертає match_id, від якого відписано, або None
+def unsubscribe(chat_id):
+    match_id = watching.pop(chat_id, None)
+    if match_id is None:
+        return None
+    subscriber = watchers.get(match_id, {}).pop(chat_id, None)
+    if not watchers.get(match_id):
+        watchers.pop(match_id, None)
+    if subscriber and subscriber.task:
+        subscriber.task.cancel()
+    return match_id
+
+
+def publish(match_id, text):
+    match_watchers = watchers.get(match_id)
+    if not match_watchers:
+        return
+    for subscriber in match_watchers.values():
+        subscriber.push(text)
+
+
+# Останнє повідомлення бою; відправники завершаться, щойно його доставлять
+def finish(match_id, text):
+    match_watchers = watchers.get(match_id)
+    if not match_watchers:
+        return
+    for subscriber in match_watchers.values():
+        subscriber.closing = True
+        subscriber.push(text)
+
+
+def watcher_count(match_id):
+    return len(watchers.get(match_id, ()))
@@ -0,0 +1,118 @@
+# Вивантаження історії боїв для аналітики через HTTP-сервер фронту (sharding.py):
+#   GET /export/matches?format=ndjson|csv&after=<finish_seq>
+#   GET /export/round_events?format=ndjson|csv&after=<event_id>
+# Доступ - заголовок "Authorization: Bearer <EXPORT_TOKEN>"; без EXPORT_TOKEN
+# маршрути не реєструються. Рядки читаються з бази пачками (Storage.export_rows)
+# і одразу пишуться у відповідь з chunked-кодуванням, тож пам’ять не росте з
+# розміром історії. Перша колонка - ключ курсора: обірване вивантаження
+# продовжується з ?after=<останній отриманий ключ>.
+
+import csv
+import hmac
+import io
+import json
+import logging
+import os
+
+from aiohttp import web
+from dotenv import load_dotenv
+
+from storage import EXPORT_COLUMNS, StorageError, create_storage
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EXPORT_TOKEN = os.getenv("EXPORT_TOKEN")
+EXPORT_PATH = os.getenv("EXPORT_PATH", "/export")
+EXPORT_BATCH_SIZE = 1000
+
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def is_authorized(request):
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    # compare_digest не видає токен за часом порівняння
+    return scheme.lower() == "bearer" and hmac.compare_digest(token.encode(), EXPORT_TOKEN.encode())
+
+
+def encode_ndjson(columns, rows):
+    return "".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows).encode()
+
+
+def encode_csv(columns, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+
+ENCODERS = {
+    "ndjson": encode_ndjson,
+    "csv": encode_csv,
+}
+
+
+async def handle_export(request):
+    if not is_authorized(request):
+        return web.Response(status=401, headers={"WWW-Authenticate": "Bearer"})
+    kind = request.match_info["kind"]
+    if kind not in EXPORT_COLUMNS:
+        return web.Response(status=404)
+    export_format = request.query.get("format", "ndjson")
+    if export_format not in ENCODERS:
+        return web.Response(status=400, text=f"format must be one of: {', '.join(ENCODERS)}")
+    try:
+        after = int(request.query.get("after", 0))
+    except ValueError:
+        return web.Response(status=400, text="after must be an integer")
+
+    columns = EXPORT_COLUMNS[kind]
+    encode = ENCODERS[export_format]
+    response = web.StreamResponse(headers={"Content-Type": f"{CONTENT_TYPES[export_format]}; charset=utf-8"})
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+    if export_format == "csv":
+        await response.write(encode_csv(None, [columns]))
+
+    exported = 0
+    try:
+        async for rows in request.app["export_db"].export_rows(kind, after, EXPORT_BATCH_SIZE):
+            # write() чекає, поки клієнт забере попередні дані
+            await response.write(encode(columns, rows))
+            exported += len(rows)
+    except ConnectionResetError:
+        logger.info(f"Export of {kind} aborted by client after {exported} rows")
+        return response
+    except StorageError as e:
+        # Заголовки вже відправлено: рвемо з’єднання без завершального chunk,
+        # щоб клієнт не прийняв обрізаний файл за повний
+        logger.error(f"Database error exporting {kind} after {exported} rows: {e}")
+        request.transport.close()
+        return response
+    await response.write_eof()
+    logger.info(f"Exported {exported} {kind} rows after {after} as {export_format}")
+    return response
+
+
+async def open_export_db(app):
+    await app["export_db"].connect()
+
+
+async def close_export_db(app):
+    await app["export_db"].close()
+
+
+# Реєструє маршрути вивантаження у веб-застосунку фронту
+def setup_export(app):
+    if not EXPORT_TOKEN:
+        logger.info("EXPORT_TOKEN is not set, export API is disabled")
+        return
+    # Окреме підключення: фронт не імпортує main.py
+    app["export_db"] = create_storage()
+    app.on_startup.append(open_export_db)
+    app.on_cleanup.append(close_export_db)
+    app.router.add_get(EXPORT_PATH.rstrip("/") + "/{kind}", handle_export)
+    logger.info(f"Export API is available at {EXPORT_PATH}")
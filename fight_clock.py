@@ -0,0 +1,83 @@
+# Єдиний таймер для всіх боїв.
+# Дедлайни дій, кінці раундів і перерв лежать в одній купі (heapq), а одне
+# фонове завдання спить до найближчого з них. Перепланування чи скасування
+# не шукає запис у купі: актуальний термін для (match_id, kind) зберігається
+# в словнику, а застарілі записи просто пропускаються, коли доходить черга.
+# Тож тисячі боїв не потребують ні окремих задач, ні опитування бази.
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Види подій
+ACTION = "action"
+ROUND_END = "round_end"
+REST_END = "rest_end"
+
+
+class FightClock:
+    def __init__(self, handler):
+        # handler(match_id, kind) - корутина, запускається окремою задачею
+        self.handler = handler
+        self.heap = []
+        self.deadlines = {}
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.tasks = set()
+
+    def schedule(self, match_id, kind, when):
+        key = (match_id, kind)
+        entry = (when, next(self.counter), match_id, kind)
+        self.deadlines[key] = entry
+        heapq.heappush(self.heap, entry)
+        if self.heap[0] is entry:
+            self.wakeup.set()
+
+    def cancel(self, match_id, kind=None):
+        kinds = (kind,) if kind else (ACTION, ROUND_END, REST_END)
+        for item in kinds:
+            self.deadlines.pop((match_id, item), None)
+
+    def deadline(self, match_id, kind):
+        entry = self.deadlines.get((match_id, kind))
+        return entry[0] if entry else None
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def _pop_due(self, now):
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            entry = heapq.heappop(self.heap)
+            key = (entry[2], entry[3])
+            if self.deadlines.get(key) is entry:
+                del self.deadlines[key]
+                due.append(key)
+        # Купа чиститься від застарілих записів, коли їх стає забагато
+        if len(self.heap) > 2 * len(self.deadlines) + 1024:
+            self.heap = list(self.deadlines.values())
+            heapq.heapify(self.heap)
+        return due
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            for match_id, kind in self._pop_due(time.time()):
+                task = asyncio.create_task(self._fire(match_id, kind))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+            timeout = self.heap[0][0] - time.time() if self.heap else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, match_id, kind):
+        try:
+            await self.handler(match_id, kind)
+        except Exception as e:
+            logger.error(f"Fight clock handler failed for match {match_id} ({kind}): {e}")
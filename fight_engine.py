@@ -0,0 +1,199 @@
+# Правила розрахунку раунду.
+# Характеристики бійців не змінюються протягом матчу, тому всі ймовірності
+# та множники урону рахуються один раз на матч (MatchTable), а сам раунд
+# зводиться до пошуку в таблиці та кількох залежних від здоров’я членів.
+# Параметри ударів і бонуси беруться з rules.py на момент старту матчу.
+
+import random
+
+import rules as game_rules
+
+# Дії, доступні на кожній дистанції (як перевіряє handle_fight_action)
+FAR_ACTIONS = ("jab", "dodge", "block", "move_closer", "rest")
+CLOSE_ACTIONS = ("jab", "uppercut", "hook", "dodge", "block", "move_away", "rest")
+
+
+def legal_actions(distance, player_num):
+    if distance == "close":
+        return CLOSE_ACTIONS
+    if distance == f"cornered_p{player_num}":
+        return FAR_ACTIONS + ("escape_corner",)
+    return FAR_ACTIONS
+
+
+# Передраховані значення одного бійця (як атакуючого і як захисника)
+class FighterTable:
+    __slots__ = (
+        "name", "fighter_type", "max_health", "will",
+        "hit_chance", "stamina_cost", "clean_damage", "rest_damage",
+        "dodge_fail_damage", "block_success_damage", "block_fail_damage",
+        "dodge_chance", "block_coef", "move_chance", "escape_coef", "rest_gain",
+    )
+
+    def __init__(self, name, stats, rules):
+        strength, reaction, punch_speed = stats["strength"], stats["reaction"], stats["punch_speed"]
+        self.name = name
+        self.fighter_type = stats["fighter_type"]
+        self.max_health = stats["health"]
+        self.will = stats["will"]
+
+        self.hit_chance = {}
+        self.stamina_cost = {}
+        self.clean_damage = {}
+        self.rest_damage = {}
+        self.dodge_fail_damage = {}
+        self.block_success_damage = {}
+        self.block_fail_damage = {}
+        for attack in rules.attacks:
+            action, base = attack.name, attack.base_damage
+            self.stamina_cost[action] = attack.stamina_cost
+            if action == "jab":
+                self.hit_chance[action] = min(0.95, (0.75 * reaction * punch_speed) / 1.7)
+                self.clean_damage[action] = base * punch_speed
+                self.dodge_fail_damage[action] = base * punch_speed
+            else:  # hook або uppercut
+                self.hit_chance[action] = min(0.95, (attack.base_hit_chance * punch_speed * strength) / 1.7)
+                self.clean_damage[action] = base * strength
+                self.dodge_fail_damage[action] = base * strength * (2 if action == "uppercut" else 1)
+            # Аперкот по суперникові, що відпочиває, б’є вдвічі сильніше
+            self.rest_damage[action] = self.clean_damage[action] * (2 if action == "uppercut" else 1)
+            # Хук сильніший проти блоку
+            block_multiplier = 1.5 if action == "hook" else 1
+            self.block_success_damage[action] = 0.05 * base * strength * block_multiplier
+            self.block_fail_damage[action] = 0.5 * base * strength * block_multiplier * (2 if action == "uppercut" else 1)
+
+        self.dodge_chance = min(0.8, 0.4 * reaction * punch_speed)
+        # Шанс блоку = min(0.8, block_coef * health / max_health)
+        self.block_coef = 0.4 * strength
+        self.move_chance = 0.4 * stats["footwork"]
+        # Шанс вийти з кута = escape_coef * health / max_health
+        self.escape_coef = stats["footwork"] / 3
+        self.rest_gain = 30 * stats["stamina"]
+
+
+class MatchTable:
+    __slots__ = ("fighters", "rules")
+
+    def __init__(self, p1_name, p1_stats, p2_name, p2_stats, rules=None):
+        self.rules = rules or game_rules.current
+        self.fighters = (FighterTable(p1_name, p1_stats, self.rules), FighterTable(p2_name, p2_stats, self.rules))
+
+
+class RoundResult:
+    __slots__ = ("health", "stamina", "distance", "text", "action_results")
+
+    def __init__(self, health, stamina, distance, text, action_results):
+        self.health = health
+        self.stamina = stamina
+        self.distance = distance
+        self.text = text
+        self.action_results = action_results
+
+
+# Розрахунок одного раунду. health/stamina/actions - пари (гравець 1, гравець 2).
+def resolve_round(table, distance, health, stamina, actions, rng=random.random):
+    fighters = table.fighters
+    attack_names = table.rules.attack_names
+    hit_bonus, damage_bonus = table.rules.cornered_hit_bonus, table.rules.cornered_damage_bonus
+    health = list(health)
+    stamina = list(stamina)
+    results = ["", ""]
+    text = []
+    new_distance = distance
+
+    # Обробка дій руху
+    for i in (0, 1):
+        me, opponent = fighters[i], fighters[1 - i]
+        action = actions[i]
+        if action == "move_closer" and rng() < me.move_chance:
+            new_distance = "close"
+            text.append(f"{me.name} наближається до {opponent.name}!")
+            results[i] = "Ти наблизився!"
+            stamina[i] -= 5
+        elif action == "move_away":
+            if rng() < 0.1:
+                new_distance = f"cornered_p{i + 1}"
+                text.append(f"{me.name} відступає, але потрапляє в кут!")
+                results[i] = "Ти потрапив у кут!"
+            elif rng() < me.move_chance:
+                new_distance = "far"
+                text.append(f"{me.name} відступає від {opponent.name}!")
+                results[i] = "Ти відступив!"
+            else:
+                text.append(f"{me.name} не вдалося відступити!")
+                results[i] = "Відступ не вдався!"
+            stamina[i] -= 5
+        elif action == "escape_corner" and distance == f"cornered_p{i + 1}":
+            if rng() < health[i] / me.max_health * me.escape_coef:
+                new_distance = "far"
+                text.append(f"{me.name} виходить із кута!")
+                results[i] = "Ти вийшов із кута!"
+            else:
+                text.append(f"{me.name} не зміг вийти з кута!")
+                results[i] = "Не вдалося вийти з кута!"
+            stamina[i] -= 10
+
+    # Обробка атак і захисту
+    for i in (0, 1):
+        j = 1 - i
+        me, opponent = fighters[i], fighters[j]
+        action, response = actions[i], actions[j]
+        if action in attack_names:
+            cornered = new_distance == f"cornered_p{j + 1}"
+            hit_chance = me.hit_chance[action] * (hit_bonus if cornered else 1)
+            stamina[i] -= me.stamina_cost[action]
+            if response not in ("dodge", "block") and rng() < hit_chance:
+                damage = me.rest_damage[action] if response == "rest" else me.clean_damage[action]
+                if cornered:
+                    damage *= damage_bonus
+                if response == "move_away":
+                    damage /= 4
+                    text.append(f"{me.name} завдає {action} по {opponent.name}, але той відступає! Урон: {damage:.1f}")
+                else:
+                    text.append(f"{me.name} завдає {action} по {opponent.name}! Урон: {damage:.1f}")
+                health[j] -= damage
+                stamina[j] -= damage / 10
+                results[i] = "Ти влучив!"
+            elif response == "block":
+                block_success_chance = min(0.8, opponent.block_coef * (health[j] / opponent.max_health))
+                stamina[j] -= 5
+                if rng() < block_success_chance:
+                    damage = me.block_success_damage[action]
+                    text.append(f"{me.name} завдає {action}, але {opponent.name} успішно блокує! Урон: {damage:.1f}")
+                    results[i] = "Ти влучив, але суперник успішно заблокував!"
+                    results[j] = "Ти успішно заблокував!"
+                else:
+                    damage = me.block_fail_damage[action] * (damage_bonus if cornered else 1)
+                    text.append(f"{me.name} завдає {action}, але {opponent.name} невдало блокує! Урон: {damage:.1f}")
+                    results[i] = "Ти влучив, суперник невдало заблокував!"
+                    results[j] = "Твій блок провалився!"
+                health[j] -= damage
+                stamina[j] -= damage / 10
+            elif response == "dodge":
+                stamina[j] -= 10
+                if rng() < opponent.dodge_chance:
+                    text.append(f"{me.name} завдає {action}, але {opponent.name} ухилився!")
+                    results[i] = "Ти промахнувся!"
+                    results[j] = "Ти ухилився!"
+                else:
+                    damage = me.dodge_fail_damage[action] * (damage_bonus if cornered else 1)
+                    health[j] -= damage
+                    stamina[j] -= damage / 10
+                    text.append(f"{me.name} завдає {action} по {opponent.name}! Ухилення не вдалося. Урон: {damage:.1f}")
+                    results[i] = "Ти влучив!"
+                    results[j] = "Ухилення не вдалося!"
+        elif action == "dodge":
+            stamina[i] -= 10
+            text.append(f"{me.name} намагається ухилитися.")
+            results[i] = results[i] or "Ти намагався ухилитися."
+        elif action == "block":
+            stamina[i] -= 5
+            text.append(f"{me.name} блокує.")
+            results[i] = results[i] or "Ти блокуєш."
+        elif action == "rest":
+            stamina[i] = min(stamina[i] + me.rest_gain, 100)
+            text.append(f"{me.name} відпочиває.")
+            results[i] = "Ти відпочиваєш."
+
+    stamina = [max(0, value) for value in stamina]
+    return RoundResult(tuple(health), tuple(stamina), new_distance, text, tuple(results))
@@ -0,0 +1,118 @@
+# Сховище FSM у пам’яті з обмеженим часом життя записів.
+# MemoryStorage тримає стан і дані кожного, хто почав /create_account чи
+# створення кімнати й кинув діалог, доки процес живий. Тут:
+# - запис - об’єкт зі __slots__: номер стану замість рядка, дані лише
+#   якщо вони не порожні, час останнього звернення;
+# - запис без стану і даних одразу видаляється;
+# - фонове завдання (sweep_loop) прибирає записи, яких не чіпали довше ttl.
+#   Записи лежать в OrderedDict за часом звернення, тож прибирання
+#   переглядає лише прострочені.
+
+import asyncio
+import logging
+import sys
+import time
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+logger = logging.getLogger(__name__)
+
+FSM_TTL = 3600
+SWEEP_INTERVAL = 60
+
+
+class FSMRecord:
+    __slots__ = ("state_id", "data", "touched")
+
+    def __init__(self):
+        self.state_id = 0
+        self.data = None
+        self.touched = time.monotonic()
+
+
+class CompactMemoryStorage(BaseStorage):
+    def __init__(self, ttl=FSM_TTL, sweep_interval=SWEEP_INTERVAL):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.records = OrderedDict()
+        # Назви станів зберігаються один раз; 0 - без стану
+        self.state_names = [None]
+        self.state_ids = {None: 0}
+        self.evicted = 0
+
+    def _state_id(self, state):
+        name = state.state if isinstance(state, State) else state
+        state_id = self.state_ids.get(name)
+        if state_id is None:
+            state_id = self.state_ids[name] = len(self.state_names)
+            self.state_names.append(name)
+        return state_id
+
+    def _get(self, key):
+        record = self.records.get(key)
+        if record is not None:
+            record.touched = time.monotonic()
+            self.records.move_to_end(key)
+        return record
+
+    def _touch(self, key):
+        record = self._get(key)
+        if record is None:
+            record = self.records[key] = FSMRecord()
+        return record
+
+    def _drop_if_empty(self, key, record):
+        if not record.state_id and not record.data:
+            del self.records[key]
+
+    async def set_state(self, key, state=None):
+        record = self._touch(key)
+        record.state_id = self._state_id(state)
+        self._drop_if_empty(key, record)
+
+    async def get_state(self, key):
+        record = self._get(key)
+        return self.state_names[record.state_id] if record else None
+
+    async def set_data(self, key, data):
+        record = self._touch(key)
+        record.data = dict(data) if data else None
+        self._drop_if_empty(key, record)
+
+    async def get_data(self, key):
+        record = self._get(key)
+        return dict(record.data) if record and record.data else {}
+
+    async def close(self):
+        self.records.clear()
+
+    def sweep(self):
+        cutoff = time.monotonic() - self.ttl
+        evicted = 0
+        while self.records:
+            key, record = next(iter(self.records.items()))
+            if record.touched >= cutoff:
+                break
+            del self.records[key]
+            evicted += 1
+        self.evicted += evicted
+        return evicted
+
+    async def sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            evicted = self.sweep()
+            if evicted:
+                logger.info(f"Evicted {evicted} idle FSM records, {len(self.records)} left")
+
+    # Приблизний розмір у байтах: словник записів, записи та їхні дані
+    # (без спільних об’єктів - ключів і назв станів)
+    def footprint(self):
+        size = sys.getsizeof(self.records)
+        for record in self.records.values():
+            size += sys.getsizeof(record)
+            if record.data:
+                size += sys.getsizeof(record.data) + sum(sys.getsizeof(value) for value in record.data.values())
+        return size
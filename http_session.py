@@ -0,0 +1,70 @@
+# HTTP-клієнт бота до Telegram Bot API.
+# Усі bot.send_message у бою йдуть через одну сесію aiohttp, тож її
+# налаштування прямо впливають на затримку раунду:
+# - пул keep-alive з’єднань (BOT_HTTP_POOL, BOT_HTTP_KEEPALIVE): з’єднання
+#   не відкриваються заново на кожен запит;
+# - кеш DNS (BOT_HTTP_DNS_TTL);
+# - таймаути за методом API: повідомлення в бою не чекають так довго, як
+#   завантаження файлів (METHOD_TIMEOUTS, загальний - BOT_HTTP_TIMEOUT);
+# - TELEGRAM_API_URL - власний Bot API сервер (або фейковий для bench_http.py).
+# Порівняння з сесією за замовчуванням: python bench_http.py
+
+import logging
+import os
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = 100
+KEEPALIVE_TIMEOUT = 60
+DNS_TTL = 3600
+DEFAULT_TIMEOUT = 30
+
+# Таймаути окремих методів, секунд
+METHOD_TIMEOUTS = {
+    "sendMessage": 10,
+    "editMessageText": 10,
+    "answerCallbackQuery": 5,
+    "sendDocument": 120,
+}
+
+
+class TunedAiohttpSession(AiohttpSession):
+    def __init__(self, pool_size=POOL_SIZE, keepalive_timeout=KEEPALIVE_TIMEOUT, dns_ttl=DNS_TTL,
+                 timeout=DEFAULT_TIMEOUT, method_timeouts=None, **kwargs):
+        super().__init__(timeout=timeout, **kwargs)
+        # Усі запити йдуть на один хост, тож ліміт на хост дорівнює розміру пулу
+        self._connector_init.update(
+            limit=pool_size,
+            limit_per_host=pool_size,
+            ttl_dns_cache=dns_ttl,
+            keepalive_timeout=keepalive_timeout,
+        )
+        self.method_timeouts = METHOD_TIMEOUTS if method_timeouts is None else method_timeouts
+
+    async def make_request(self, bot, method, timeout=None):
+        if timeout is None:
+            timeout = self.method_timeouts.get(method.__api_method__)
+        return await super().make_request(bot, method, timeout)
+
+
+def api_server():
+    url = os.getenv("TELEGRAM_API_URL")
+    return TelegramAPIServer.from_base(url) if url else PRODUCTION
+
+
+def create_http_session(api=None):
+    session = TunedAiohttpSession(
+        pool_size=int(os.getenv("BOT_HTTP_POOL", POOL_SIZE)),
+        keepalive_timeout=float(os.getenv("BOT_HTTP_KEEPALIVE", KEEPALIVE_TIMEOUT)),
+        dns_ttl=int(os.getenv("BOT_HTTP_DNS_TTL", DNS_TTL)),
+        timeout=float(os.getenv("BOT_HTTP_TIMEOUT", DEFAULT_TIMEOUT)),
+        api=api or api_server(),
+    )
+    logger.info(f"Bot API session: pool {session._connector_init['limit']}, keep-alive {session._connector_init['keepalive_timeout']}s")
+    return session
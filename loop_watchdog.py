@@ -0,0 +1,90 @@
+# Сторож циклу подій.
+# - Фонова корутина прокидається кожні INTERVAL секунд і записує, наскільки
+#   пізніше запланованого вона прокинулась (затримка циклу). З останніх
+#   SAMPLES замірів рахуються перцентилі для адмін-панелі.
+# - Окремий потік стежить за "пульсом" корутини. Якщо цикл не відповідає
+#   довше за поріг (LOOP_LAG_THRESHOLD, мс), потік знімає стек головного
+#   потоку: видно, який хендлер (process_round, start_match, ...) і який
+#   рядок - наприклад, синхронний запит до SQLite - тримає цикл.
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+INTERVAL = 0.1
+SAMPLES = 3000
+THRESHOLD = 0.2
+# Файли, у яких шукаємо винний хендлер (перший кадр зсередини бота)
+APP_FILES = ("main.py", "storage.py", "fight_engine.py", "ai_opponent.py", "tournament.py", "broadcast.py")
+
+
+class LoopWatchdog:
+    def __init__(self, threshold=THRESHOLD, interval=INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.samples = deque(maxlen=SAMPLES)
+        self.heartbeat = time.monotonic()
+        self.loop_thread_id = None
+        self.stalls = 0
+        self.last_stall = None
+        self.thread = None
+
+    async def run(self):
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self.thread.start()
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.samples.append(max(0.0, now - expected))
+            self.heartbeat = now
+
+    def _watch(self):
+        reported = None
+        while True:
+            time.sleep(self.threshold / 2)
+            heartbeat = self.heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            # Одне зависання - один звіт, навіть якщо воно триває довго
+            if stalled > self.threshold and reported != heartbeat:
+                reported = heartbeat
+                self._report(stalled)
+
+    def _report(self, stalled):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        # Кадри самого asyncio (run_forever, _run_once, ...) нічого не кажуть
+        asyncio_frames = [i for i, entry in enumerate(stack) if f"{os.sep}asyncio{os.sep}" in entry.filename]
+        if asyncio_frames:
+            stack = stack[asyncio_frames[-1] + 1:]
+        handler = next(
+            (entry.name for entry in stack if entry.filename.endswith(APP_FILES)),
+            stack[-1].name if stack else "?"
+        )
+        self.stalls += 1
+        self.last_stall = (time.time(), handler, stalled)
+        logger.warning(
+            f"Event loop blocked for {stalled * 1000:.0f}+ ms in {handler}:\n"
+            + "".join(traceback.format_list(stack[-20:]))
+        )
+
+    # Перцентилі затримки в мілісекундах
+    def percentiles(self, points=(50, 95, 99)):
+        if not self.samples:
+            return {point: 0.0 for point in points}
+        ordered = sorted(self.samples)
+        return {point: ordered[min(len(ordered) - 1, len(ordered) * point // 100)] * 1000 for point in points}
+
+    def max_lag(self):
+        return max(self.samples, default=0.0) * 1000
@@ -11,23 +11,44 @@
 #    У файлі settings.json (Ctrl+Shift+P -> Preferences: Open Settings (JSON)) додайте:
 #    "python.analysis.extraPaths": ["./venv/lib/python3.x/site-packages"]
 
+import json
+import signal
 import logging
 import os
 import random
-import sqlite3
 import time
 import asyncio
-import re
 import string
-from aiohttp import web
+import threading
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
-from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, BotCommand, BotCommandScopeDefault, BotCommandScopeChat
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, BotCommand, BotCommandScopeDefault, BotCommandScopeChat, BufferedInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.exceptions import TelegramBadRequest
 from dotenv import load_dotenv
+from fsm_storage import CompactMemoryStorage
+from http_session import create_http_session
+from storage import create_storage, StorageError, IntegrityError
+import rules
+from rules import RulesError
+from fight_engine import MatchTable, resolve_round
+import tournament
+from tournament import MAX_PARTICIPANTS, MIN_PARTICIPANTS, Bracket, active_brackets, close_bracket, find_user_bracket
+import backup
+import broadcast
+import nicknames
+from fight_clock import ACTION, REST_END, ROUND_END, FightClock
+import metrics
+import profiler
+import progression
+from loop_watchdog import LoopWatchdog
+from middlewares import ThrottlingMiddleware
+from scheduler import UpdateScheduler
+from ai_opponent import AI_FIGHTERS, build_all_policies, choose_action, get_policy, is_ai_player
+
+# Відлік часу старту (див. log_startup_time і log_first_update)
+startup_started = time.perf_counter()
 
 # Завантаження змінних із .env
 load_dotenv()
@@ -35,6 +56,7 @@ load_dotenv()
 # Налаштування логування
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
+metrics.install_error_counter()
 
 # Локальні налаштування
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
@@ -49,14 +71,47 @@ if not TELEGRAM_TOKEN:
     logger.error("TELEGRAM_TOKEN is not set")
     raise ValueError("TELEGRAM_TOKEN is required")
 
+# Номер процесу-воркера у багатопроцесному режимі (див. sharding.py)
+SHARD_ID = int(os.getenv("SHARD_ID", 0))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 1))
+# Процес-фронт sharding.py (0 - бот запущено без нього)
+FRONT_PID = int(os.getenv("FRONT_PID", 0))
+
+# Раунди, таймери й кінець матчу веде лише шард-власник: туди ж фронт
+# надсилає кнопки бою. Матч може створити інший шард (пошук, кімната)
+def owns_match(match_id):
+    return match_id % SHARD_COUNT == SHARD_ID
+
 # Список адмінів
 ADMIN_IDS = [id for id in [Vadym_ID, Nazar_ID] if id != 0]
 logger.info(f"ADMIN_IDS: {ADMIN_IDS}")
 
 # Ініціалізація бота
-bot = Bot(token=TELEGRAM_TOKEN)
-storage = MemoryStorage()
+bot = Bot(token=TELEGRAM_TOKEN, session=create_http_session())
+# Незавершені діалоги (створення акаунта, кімнати) забуваються через FSM_TTL секунд
+storage = CompactMemoryStorage(ttl=int(os.getenv("FSM_TTL", 3600)))
 dp = Dispatcher(storage=storage)
+db = create_storage()
+# Дублікати та флуд відсікаються до хендлерів і бази (адміни без обмежень)
+throttling = ThrottlingMiddleware(exempt_ids=ADMIN_IDS)
+dp.update.outer_middleware(throttling)
+
+# Час до першого обробленого оновлення - головний показник швидкого рестарту
+first_update_logged = False
+
+async def log_first_update(handler, event, data):
+    global first_update_logged
+    if not first_update_logged:
+        first_update_logged = True
+        logger.info(f"First update received {time.perf_counter() - startup_started:.3f}s after start")
+    return await handler(event, data)
+
+dp.update.outer_middleware(log_first_update)
+
+# Під перевантаженням кнопки бою обробляються раніше за меню й пошук,
+# а надлишок малопріоритетних оновлень відкидається (див. scheduler.py)
+scheduler = UpdateScheduler(exempt_ids=ADMIN_IDS)
+dp.update.outer_middleware(scheduler)
 
 # Список користувачів, які шукають матч
 searching_users = []
@@ -70,80 +125,193 @@ class CharacterCreation(StatesGroup):
 class RoomCreation(StatesGroup):
     awaiting_room_token = State()
 
-# Ініціалізація бази даних SQLite
-def init_db():
+# Ініціалізація бази даних (SQLite або PostgreSQL, див. storage.py)
+async def init_db():
+    started = time.perf_counter()
     try:
-        conn = sqlite3.connect("bot.db")
-        c = conn.cursor()
-        c.execute("""CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            character_name TEXT UNIQUE,
-            fighter_type TEXT
-        )""")
-        c.execute("""CREATE TABLE IF NOT EXISTS fighter_stats (
-            user_id INTEGER PRIMARY KEY,
-            fighter_type TEXT,
-            stamina REAL,
-            strength REAL,
-            reaction REAL,
-            health REAL,
-            punch_speed REAL,
-            will REAL,
-            footwork REAL,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )""")
-        c.execute("""CREATE TABLE IF NOT EXISTS matches (
-            match_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            player1_id INTEGER,
-            player2_id INTEGER,
-            status TEXT,
-            start_time REAL,
-            current_round INTEGER,
-            player1_action TEXT,
-            player2_action TEXT,
-            player1_health REAL,
-            player1_stamina REAL,
-            player2_health REAL,
-            player2_stamina REAL,
-            action_deadline REAL,
-            distance TEXT,
-            FOREIGN KEY (player1_id) REFERENCES users (user_id),
-            FOREIGN KEY (player2_id) REFERENCES users (user_id)
-        )""")
-        c.execute("""CREATE TABLE IF NOT EXISTS knockdowns (
-            match_id INTEGER,
-            player_id INTEGER,
-            deadline REAL,
-            FOREIGN KEY (match_id) REFERENCES matches (match_id),
-            FOREIGN KEY (player_id) REFERENCES users (user_id)
-        )""")
-        c.execute("""CREATE TABLE IF NOT EXISTS rooms (
-            token TEXT PRIMARY KEY,
-            creator_id INTEGER,
-            opponent_id INTEGER,
-            created_at REAL,
-            status TEXT,
-            votes_for INTEGER DEFAULT 0,
-            FOREIGN KEY (creator_id) REFERENCES users (user_id),
-            FOREIGN KEY (opponent_id) REFERENCES users (user_id)
-        )""")
-        # Очищення активних матчів, нокдаунів і старих кімнат
-        c.execute("DELETE FROM matches WHERE status = 'active'")
-        c.execute("DELETE FROM knockdowns")
-        c.execute("DELETE FROM rooms WHERE created_at < ?", (time.time() - 300,))
-        conn.commit()
-    except sqlite3.Error as e:
+        await db.connect()
+        # Перезапущений воркер не повинен знищувати матчі інших шардів.
+        # DDL виконується лише при зміні версії схеми (storage.SCHEMA_VERSION)
+        await db.init_schema(cleanup=os.getenv("DB_CLEANUP", "1") == "1")
+    except StorageError as e:
         logger.error(f"Database initialization error: {e}")
-    finally:
-        conn.close()
+    logger.info(f"Database ready in {time.perf_counter() - started:.3f}s")
+
+dp.startup.register(init_db)
+
+# Індекс ніків у пам’яті (див. nicknames.py)
+async def load_nicknames():
+    started = time.perf_counter()
+    try:
+        nicknames.load(await db.get_character_names())
+    except StorageError as e:
+        logger.error(f"Database error loading nicknames: {e}")
+        return
+    logger.info(f"Loaded {len(nicknames.taken)} nicknames in {time.perf_counter() - started:.3f}s")
+
+dp.startup.register(load_nicknames)
+
+# Фонові задачі (посилання тримаються, щоб задачі не зібрав GC)
+background_tasks = set()
+
+def run_in_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+# Архівація завершених матчів: таблиця matches містить лише живі бої
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", 600))
+ARCHIVE_BATCH_SIZE = 500
+
+async def archive_matches_loop():
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+        archived = 0
+        try:
+            while True:
+                moved = await db.archive_finished_matches(ARCHIVE_BATCH_SIZE)
+                archived += moved
+                if moved < ARCHIVE_BATCH_SIZE:
+                    break
+                # Між порціями віддаємо цикл подій живим боям
+                await asyncio.sleep(0.05)
+            if archived:
+                await db.compact()
+                logger.info(f"Archived {archived} finished matches")
+        except StorageError as e:
+            logger.error(f"Database error archiving finished matches: {e}")
+
+async def start_archiver():
+    # В багатопроцесному режимі архівує лише шард 0
+    if SHARD_ID == 0:
+        run_in_background(archive_matches_loop())
+
+dp.startup.register(start_archiver)
+
+# Затримка циклу подій і стеки хендлерів, що його блокують (див. loop_watchdog.py)
+loop_watchdog = LoopWatchdog(threshold=float(os.getenv("LOOP_LAG_THRESHOLD", 200)) / 1000)
+
+async def start_loop_watchdog():
+    run_in_background(loop_watchdog.run())
+
+dp.startup.register(start_loop_watchdog)
+
+# Резервні копії бази (див. backup.py). Час останньої копії в bot_meta, тож
+# часті перезапуски не запускають бекап щоразу
+BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", 6 * 3600))
+BACKUP_RETRY_DELAY = 600
+BACKUP_META_KEY = "last_backup"
+backup_lock = asyncio.Lock()
+
+async def run_backup():
+    async with backup_lock:
+        path, size = await backup.create_backup(db)
+        await db.set_meta(BACKUP_META_KEY, str(time.time()))
+        return path, size
+
+async def backup_loop():
+    while True:
+        try:
+            last_backup = float(await db.get_meta(BACKUP_META_KEY) or 0)
+        except StorageError as e:
+            logger.error(f"Database error reading last backup time: {e}")
+            last_backup = 0
+        await asyncio.sleep(max(0, last_backup + BACKUP_INTERVAL - time.time()))
+        try:
+            await run_backup()
+        except (StorageError, OSError) as e:
+            logger.error(f"Backup failed: {e}")
+            await asyncio.sleep(BACKUP_RETRY_DELAY)
+
+async def start_backups():
+    # Бекапить лише шард 0
+    if SHARD_ID == 0 and BACKUP_INTERVAL > 0 and db.supports_backup:
+        run_in_background(backup_loop())
 
-init_db()
+dp.startup.register(start_backups)
+
+# Прибирання покинутих діалогів FSM (див. fsm_storage.py)
+async def start_fsm_sweeper():
+    run_in_background(storage.sweep_loop())
+
+dp.startup.register(start_fsm_sweeper)
+
+# Події раундів для вивантаження (export_api.py) пишуться пачками раз на
+# ROUND_EVENTS_FLUSH_INTERVAL секунд, а не окремим INSERT на кожен обмін
+ROUND_EVENTS_FLUSH_INTERVAL = 1.0
+round_events = []
+
+async def flush_round_events():
+    global round_events
+    if not round_events:
+        return
+    pending, round_events = round_events, []
+    try:
+        await db.add_round_events(pending)
+    except StorageError as e:
+        logger.error(f"Database error saving {len(pending)} round events: {e}")
+
+async def round_events_loop():
+    while True:
+        await asyncio.sleep(ROUND_EVENTS_FLUSH_INTERVAL)
+        await flush_round_events()
+
+async def start_round_events_writer():
+    run_in_background(round_events_loop())
+
+dp.startup.register(start_round_events_writer)
+
+# Досвід бійців зберігається пачками; учасники поточних боїв чекають кінця
+# бою, щоб їхні характеристики в базі не змінювались посеред матчу
+PROGRESS_FLUSH_INTERVAL = 5
+
+async def flush_progress():
+    awards = progression.take_ready(active_players)
+    if not awards:
+        return
+    try:
+        rows = await db.get_progress(list(awards))
+        updates, level_ups = [], {}
+        for user_id, xp, level in rows:
+            new_xp = xp + awards[user_id]
+            new_level = max(level, progression.level_for_xp(new_xp, rules.current))
+            factors = progression.growth_factors(new_level - level, rules.current)
+            updates.append((new_xp, new_level, *factors, user_id, xp))
+            if new_level > level:
+                level_ups[user_id] = new_level
+        stale = await db.save_progress(updates)
+    except StorageError as e:
+        logger.error(f"Database error saving progress for {len(awards)} fighters: {e}")
+        progression.restore(awards)
+        return
+    # Рядки, змінені іншим шардом, перераховуються наступного разу
+    progression.restore({user_id: awards[user_id] for user_id in stale})
+    logger.debug(f"Saved progress for {len(updates) - len(stale)} fighters, {len(stale)} deferred")
+    for user_id, level in level_ups.items():
+        if user_id not in stale:
+            await send_to_player(user_id, f"Новий рівень: {level}! Характеристики бійця зросли. Подробиці: /fighter")
+
+async def progress_loop():
+    while True:
+        await asyncio.sleep(PROGRESS_FLUSH_INTERVAL)
+        await flush_progress()
+
+async def start_progress_writer():
+    run_in_background(progress_loop())
+
+dp.startup.register(start_progress_writer)
 
 # Перевірка maintenance mode
 maintenance_mode = False
+# Зупинка бота: нові бої не починаються навіть для адмінів (див. drain)
+draining = False
 
 async def check_maintenance(message: types.Message):
+    if draining:
+        await message.reply("Бот перезапускається. Спробуй за кілька хвилин.")
+        logger.debug(f"Drain blocked user {message.from_user.id}")
+        return False
     if maintenance_mode and message.from_user.id not in ADMIN_IDS:
         await message.reply("Бот на технічних роботах. Спробуй пізніше.")
         logger.debug(f"Maintenance mode blocked user {message.from_user.id}")
@@ -162,36 +330,60 @@ def generate_room_token():
     characters = string.ascii_uppercase + string.digits
     return ''.join(random.choice(characters) for _ in range(6))
 
-# Налаштування меню команд
+# Меню команд
+USER_COMMANDS = [
+    BotCommand(command="/start", description="Почати роботу з ботом"),
+    BotCommand(command="/create_account", description="Створити акаунт"),
+    BotCommand(command="/delete_account", description="Видалити акаунт"),
+    BotCommand(command="/start_match", description="Почати матч"),
+    BotCommand(command="/fighter", description="Рівень і характеристики бійця"),
+    BotCommand(command="/create_room", description="Створити кімнату"),
+    BotCommand(command="/join_room", description="Приєднатися до кімнати"),
+    BotCommand(command="/start_fight", description="Почати бій (тільки для творця кімнати)"),
+    BotCommand(command="/create_tournament", description="Створити турнір"),
+    BotCommand(command="/join_tournament", description="Приєднатися до турніру"),
+    BotCommand(command="/start_tournament", description="Почати турнір (тільки для творця)"),
+    BotCommand(command="/watch", description="Дивитися бій як глядач"),
+    BotCommand(command="/unwatch", description="Припинити перегляд бою"),
+    BotCommand(command="/refresh_commands", description="Оновити меню команд")
+]
+
+ADMIN_COMMANDS = USER_COMMANDS + [
+    BotCommand(command="/admin_setting", description="Адмін-панель"),
+    BotCommand(command="/profile", description="Профіль навантаження за N секунд"),
+    BotCommand(command="/maintenance_on", description="Увімкнути технічні роботи"),
+    BotCommand(command="/maintenance_off", description="Вимкнути технічні роботи"),
+    BotCommand(command="/drain", description="Зупинити бота без втрати боїв"),
+    BotCommand(command="/reload_rules", description="Перечитати правила гри"),
+    BotCommand(command="/purge_inactive", description="Видалити неактивні акаунти"),
+    BotCommand(command="/backup_now", description="Зробити резервну копію бази")
+]
+
+# Налаштування меню команд: set_my_commands перезаписує попередній список,
+# тому delete не потрібен, а всі області реєструються паралельно
 async def setup_bot_commands():
-    user_commands = [
-        BotCommand(command="/start", description="Почати роботу з ботом"),
-        BotCommand(command="/create_account", description="Створити акаунт"),
-        BotCommand(command="/delete_account", description="Видалити акаунт"),
-        BotCommand(command="/start_match", description="Почати матч"),
-        BotCommand(command="/create_room", description="Створити кімнату"),
-        BotCommand(command="/join_room", description="Приєднатися до кімнати"),
-        BotCommand(command="/start_fight", description="Почати бій (тільки для творця кімнати)"),
-        BotCommand(command="/refresh_commands", description="Оновити меню команд")
-    ]
-    
-    admin_commands = user_commands + [
-        BotCommand(command="/admin_setting", description="Адмін-панель"),
-        BotCommand(command="/maintenance_on", description="Увімкнути технічні роботи"),
-        BotCommand(command="/maintenance_off", description="Вимкнути технічні роботи")
-    ]
-    
-    try:
-        await bot.delete_my_commands(scope=BotCommandScopeDefault())
-        await bot.set_my_commands(commands=user_commands, scope=BotCommandScopeDefault())
-        logger.info("Set default commands for all users")
-        
-        for admin_id in ADMIN_IDS:
-            await bot.delete_my_commands(scope=BotCommandScopeChat(chat_id=admin_id))
-            await bot.set_my_commands(commands=admin_commands, scope=BotCommandScopeChat(chat_id=admin_id))
-            logger.info(f"Set admin commands for user {admin_id}")
-    except TelegramBadRequest as e:
-        logger.error(f"Failed to set commands: {e}")
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        bot.set_my_commands(commands=USER_COMMANDS, scope=BotCommandScopeDefault()),
+        *(
+            bot.set_my_commands(commands=ADMIN_COMMANDS, scope=BotCommandScopeChat(chat_id=admin_id))
+            for admin_id in ADMIN_IDS
+        ),
+        return_exceptions=True
+    )
+    errors = [result for result in results if isinstance(result, Exception)]
+    for error in errors:
+        logger.error(f"Failed to set commands: {error}")
+    logger.info(f"Set commands for all users and {len(ADMIN_IDS)} admins in {time.perf_counter() - started:.3f}s")
+    if errors:
+        raise errors[0]
+
+# Меню реєструється у фоні, щоб не затримувати першу обробку оновлень
+async def schedule_bot_commands():
+    if SHARD_ID == 0:
+        run_in_background(setup_bot_commands())
+
+dp.startup.register(schedule_bot_commands)
 
 # Команда /refresh_commands
 @dp.message(Command("refresh_commands"))
@@ -200,13 +392,19 @@ async def refresh_commands(message: types.Message, state: FSMContext):
     await reset_state(message, state)
     if not await check_maintenance(message):
         return
+    user_id = message.from_user.id
     try:
-        await setup_bot_commands()
+        if user_id in ADMIN_IDS:
+            await setup_bot_commands()
+        else:
+            # Звичайному гравцеві досить прибрати застаріле меню його чату,
+            # тоді Telegram покаже загальне меню за замовчуванням
+            await bot.delete_my_commands(scope=BotCommandScopeChat(chat_id=message.chat.id))
         await message.reply("Меню команд оновлено! Відкрий меню команд (📋).")
-        logger.debug(f"Refreshed commands for user {message.from_user.id}")
+        logger.debug(f"Refreshed commands for user {user_id}")
     except Exception as e:
         await message.reply("Помилка при оновленні команд. Спробуй ще раз.")
-        logger.error(f"Error refreshing commands for user {message.from_user.id}: {e}")
+        logger.error(f"Error refreshing commands for user {user_id}: {e}")
 
 # Команда /start
 @dp.message(Command("start"))
@@ -228,22 +426,17 @@ async def create_account(message: types.Message, state: FSMContext):
     if not await check_maintenance(message):
         return
     user_id = message.from_user.id
-    conn = sqlite3.connect("bot.db")
     try:
-        c = conn.cursor()
-        c.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-        if c.fetchone():
+        if await db.get_user(user_id):
             await message.reply("Ти вже маєш акаунт! Використай /delete_account, щоб видалити його.")
             logger.debug(f"User {user_id} already has an account")
             return
         await message.reply("Введи ім'я персонажа (нік у грі, тільки літери, цифри, до 20 символів):")
         await state.set_state(CharacterCreation.awaiting_character_name)
         logger.debug(f"Prompted user {user_id} for character name")
-    except sqlite3.Error as e:
+    except StorageError as e:
         await message.reply("Помилка бази даних. Спробуй ще раз.")
         logger.error(f"Database error for create_account user {user_id}: {e}")
-    finally:
-        conn.close()
 
 # Обробка імені персонажа
 @dp.message(CharacterCreation.awaiting_character_name)
@@ -259,111 +452,65 @@ async def handle_character_name(message: types.Message, state: FSMContext):
         logger.debug(f"User {user_id} entered command {character_name} instead of nickname")
         return
 
-    if not re.match(r'^[a-zA-Z0-9_]{1,20}$', character_name):
-        await message.reply("Нік може містити тільки літери, цифри, символ '_', до 20 символів. Спробуй ще раз.")
+    if not nicknames.is_valid(character_name):
+        await message.reply(f"Нік може містити тільки літери, цифри, символ '_', до {nicknames.MAX_LENGTH} символів. Спробуй ще раз.")
         logger.debug(f"Invalid character name {character_name} from user {user_id}")
         return
 
-    conn = sqlite3.connect("bot.db")
     try:
-        c = conn.cursor()
-        c.execute("SELECT character_name FROM users WHERE character_name = ?", (character_name,))
-        if c.fetchone():
-            await message.reply("Цей нік уже зайнятий. Вибери інший.")
+        # Нік міг звільнитись в іншому шарді, тому "зайнято" з індексу перевіряється в базі
+        if not nicknames.is_available(character_name) and not await db.character_name_exists(character_name):
+            nicknames.discard(character_name)
+        reserved = nicknames.is_available(character_name) and await db.reserve_character_name(
+            user_id, message.from_user.username, character_name
+        )
+        nicknames.add(character_name)
+        if not reserved:
+            suggestions = nicknames.suggest(character_name)
+            await message.reply(
+                "Цей нік уже зайнятий. "
+                + (f"Вільні варіанти: {', '.join(suggestions)}. " if suggestions else "")
+                + "Вибери інший."
+            )
             logger.debug(f"Character name {character_name} already taken")
             return
-        c.execute(
-            "INSERT INTO users (user_id, username, character_name) VALUES (?, ?, ?)",
-            (user_id, message.from_user.username, character_name),
-        )
-        conn.commit()
         await state.update_data(character_name=character_name)
-        fighter_descriptions = (
-            "Вибери тип бійця (змінити вибір потім неможливо):\n\n"
-            "🔥 *Swarmer*: Агресивний боєць. Висока сила (1.5), воля (1.5), швидкість удару (1.35), робота ніг (1.2). Здоров’я: 195, виносливість: 1.15.\n"
-            "🥊 *Out-boxer*: Витривалий і тактичний. Висока виносливість (1.5), здоров’я: 300, робота ніг (1.4). Сила: 1.15, воля: 1.3.\n"
-            "⚡ *Counter-puncher*: Майстер контратаки. Висока реакція (1.5), швидкість удару (1.5), робота ніг (1.5). Сила: 1.25, здоров’я: 150, воля: 1."
+        fighters = rules.current.fighters.values()
+        fighter_descriptions = "Вибери тип бійця (змінити вибір потім неможливо):\n\n" + "\n".join(
+            fighter.description for fighter in fighters
         )
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Swarmer", callback_data="swarmer")],
-            [InlineKeyboardButton(text="Out-boxer", callback_data="out_boxer")],
-            [InlineKeyboardButton(text="Counter-puncher", callback_data="counter_puncher")],
+            [InlineKeyboardButton(text=fighter.title, callback_data=fighter.fighter_type)] for fighter in fighters
         ])
         await message.reply(fighter_descriptions, reply_markup=keyboard, parse_mode="Markdown")
         await state.set_state(CharacterCreation.awaiting_fighter_type)
         logger.debug(f"Sent fighter type selection to user {user_id}")
-    except sqlite3.IntegrityError as e:
+    except IntegrityError as e:
         await message.reply("Помилка: цей нік уже зайнятий або сталася помилка. Спробуй інший.")
         logger.error(f"Integrity error for character name {character_name}: {e}")
     except Exception as e:
         await message.reply("Сталася помилка при створенні акаунта. Спробуй ще раз.")
         logger.error(f"Error creating account for user {user_id}: {e}")
-    finally:
-        conn.close()
 
 # Обробка вибору типу бійця
-@dp.callback_query(CharacterCreation.awaiting_fighter_type, lambda c: c.data in ["swarmer", "out_boxer", "counter_puncher"])
+@dp.callback_query(CharacterCreation.awaiting_fighter_type, lambda c: c.data in rules.current.fighters)
 async def handle_fighter_type(callback: types.CallbackQuery, state: FSMContext):
     logger.debug(f"Received fighter type selection from user {callback.from_user.id}: {callback.data}")
     user_id = callback.from_user.id
     fighter_type = callback.data
     user_data = await state.get_data()
     character_name = user_data.get("character_name")
-    
-    fighter_stats = {
-        "swarmer": {
-            "stamina": 1.15,
-            "strength": 1.5,
-            "reaction": 1.1,
-            "health": 195,
-            "punch_speed": 1.35,
-            "will": 1.5,
-            "footwork": 1.2
-        },
-        "out_boxer": {
-            "stamina": 1.5,
-            "strength": 1.15,
-            "reaction": 1.1,
-            "health": 300,
-            "punch_speed": 1.15,
-            "will": 1.3,
-            "footwork": 1.4
-        },
-        "counter_puncher": {
-            "stamina": 1.1,
-            "strength": 1.25,
-            "reaction": 1.5,
-            "health": 150,
-            "punch_speed": 1.5,
-            "will": 1,
-            "footwork": 1.5
-        }
-    }
-    
-    conn = sqlite3.connect("bot.db")
+
     try:
-        c = conn.cursor()
-        c.execute(
-            "UPDATE users SET fighter_type = ? WHERE user_id = ?",
-            (fighter_type, user_id)
-        )
-        stats = fighter_stats[fighter_type]
-        c.execute(
-            """INSERT INTO fighter_stats (user_id, fighter_type, stamina, strength, reaction, health, punch_speed, will, footwork)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (user_id, fighter_type, stats["stamina"], stats["strength"], stats["reaction"],
-             stats["health"], stats["punch_speed"], stats["will"], stats["footwork"])
-        )
-        conn.commit()
+        await db.set_fighter(user_id, fighter_type, rules.current.fighters[fighter_type].stats())
         await callback.message.reply(f"Акаунт створено! Персонаж: {character_name}, Тип: {fighter_type.capitalize()}")
         await callback.answer()
         logger.debug(f"Created account for user {user_id}: {character_name}, {fighter_type}")
-    except sqlite3.Error as e:
+    except StorageError as e:
         await callback.message.reply("Помилка при збереженні бійця. Спробуй ще раз.")
         logger.error(f"Database error for fighter type {fighter_type} for user {user_id}: {e}")
         await callback.answer()
     finally:
-        conn.close()
         await state.clear()
 
 # Команда /delete_account
@@ -374,27 +521,458 @@ async def delete_account(message: types.Message, state: FSMContext):
     if not await check_maintenance(message):
         return
     user_id = message.from_user.id
-    conn = sqlite3.connect("bot.db")
     try:
-        c = conn.cursor()
-        c.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-        if not c.fetchone():
+        user = await db.get_user(user_id)
+        if not user or not await db.delete_user(user_id):
             await message.reply("У тебе немає акаунта!")
             logger.debug(f"No account found for user {user_id}")
             return
-        c.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
-        c.execute("DELETE FROM fighter_stats WHERE user_id = ?", (user_id,))
-        c.execute("DELETE FROM matches WHERE player1_id = ? OR player2_id = ?", (user_id, user_id))
-        c.execute("DELETE FROM knockdowns WHERE player_id = ?", (user_id,))
-        c.execute("DELETE FROM rooms WHERE creator_id = ? OR opponent_id = ?", (user_id, user_id))
-        conn.commit()
+        nicknames.discard(user["character_name"])
         await message.reply("Акаунт видалено! Можеш створити новий за допомогою /create_account.")
         logger.debug(f"Deleted account for user {user_id}")
-    except sqlite3.Error as e:
+    except StorageError as e:
         await message.reply("Помилка при видаленні акаунта. Спробуй ще раз.")
         logger.error(f"Database error deleting account for user {user_id}: {e}")
-    finally:
-        conn.close()
+
+# Масове видалення неактивних акаунтів невеликими порціями.
+# Позиція зберігається в bot_meta, тому після перезапуску чистка продовжується.
+PURGE_META_KEY = "purge_inactive"
+PURGE_CHUNK_SIZE = 200
+purge_task = None
+
+async def purge_inactive_accounts(cutoff, after_user_id=0, notify_id=None):
+    total = 0
+    try:
+        while True:
+            users = await db.purge_inactive_users(cutoff, after_user_id, PURGE_CHUNK_SIZE)
+            if not users:
+                break
+            for _, character_name in users:
+                nicknames.discard(character_name)
+            total += len(users)
+            after_user_id = users[-1][0]
+            await db.set_meta(PURGE_META_KEY, f"{cutoff}:{after_user_id}")
+            logger.info(f"Purged {len(users)} inactive accounts (up to user {after_user_id})")
+            # Коротка пауза між порціями, щоб не тримати базу заблокованою
+            await asyncio.sleep(0.05)
+        await db.delete_meta(PURGE_META_KEY)
+        logger.info(f"Inactive accounts purge finished, deleted {total}")
+        if notify_id:
+            await bot.send_message(notify_id, f"Чистку завершено. Видалено акаунтів: {total}.")
+    except StorageError as e:
+        logger.error(f"Database error purging inactive accounts after user {after_user_id}: {e}")
+        if notify_id:
+            await bot.send_message(notify_id, f"Чистку перервано через помилку бази. Видалено: {total}. Повтори /purge_inactive, щоб продовжити.")
+
+def start_purge(cutoff, after_user_id=0, notify_id=None):
+    global purge_task
+    purge_task = asyncio.create_task(purge_inactive_accounts(cutoff, after_user_id, notify_id))
+
+# Продовження перерваної чистки після перезапуску
+async def resume_purge():
+    if SHARD_ID != 0:
+        return
+    try:
+        saved = await db.get_meta(PURGE_META_KEY)
+    except StorageError as e:
+        logger.error(f"Database error reading purge state: {e}")
+        return
+    if saved:
+        cutoff, after_user_id = saved.split(":")
+        logger.info(f"Resuming inactive accounts purge after user {after_user_id}")
+        start_purge(float(cutoff), int(after_user_id))
+
+dp.startup.register(resume_purge)
+
+# Команда /purge_inactive <днів>
+@dp.message(Command("purge_inactive"))
+async def purge_inactive(message: types.Message, state: FSMContext):
+    logger.debug(f"Received /purge_inactive from user {message.from_user.id}")
+    await reset_state(message, state)
+    if message.from_user.id not in ADMIN_IDS:
+        await message.reply("Ця команда доступна лише адмінам.")
+        return
+    if purge_task and not purge_task.done():
+        await message.reply("Чистка вже триває.")
+        return
+
+    args = message.text.split()
+    try:
+        saved = await db.get_meta(PURGE_META_KEY)
+    except StorageError as e:
+        await message.reply("Помилка бази даних. Спробуй ще раз.")
+        logger.error(f"Database error reading purge state: {e}")
+        return
+    if len(args) == 1 and saved:
+        cutoff, after_user_id = saved.split(":")
+        start_purge(float(cutoff), int(after_user_id), message.from_user.id)
+        await message.reply(f"Продовжую перервану чистку з користувача {after_user_id}.")
+        return
+    if len(args) != 2 or not args[1].isdigit() or int(args[1]) < 1:
+        await message.reply("Вкажи кількість днів неактивності: /purge_inactive <днів>")
+        return
+
+    days = int(args[1])
+    start_purge(time.time() - days * 86400, 0, message.from_user.id)
+    await message.reply(f"Почато видалення акаунтів, неактивних понад {days} дн.")
+    logger.info(f"Admin {message.from_user.id} started purge of accounts inactive for {days} days")
+
+# Адмін-панель: усі показники беруться з лічильників у пам’яті (metrics.py)
+drain_task = None
+
+def render_dashboard():
+    uptime = int(metrics.uptime())
+    lines = [
+        "Адмін-панель" + (f" (шард {SHARD_ID} з {SHARD_COUNT})" if SHARD_COUNT > 1 else ""),
+        f"Режим: {'технічні роботи' if maintenance_mode else 'звичайний'}",
+        f"Активні бої: {len(match_tables)}",
+        f"У черзі пошуку: {len(searching_users)}",
+        f"Раундів/с (за {metrics.WINDOW} с): {metrics.rounds.rate():.2f}, усього: {metrics.rounds.total}",
+        f"Кімнат чекає на суперника: {metrics.rooms_waiting(rules.current.room_ttl)}",
+        f"Помилок за {metrics.WINDOW} с: {metrics.errors.count()}, усього: {metrics.errors.total}",
+        f"Відхилено оновлень (дублікати, флуд): {throttling.rejected}",
+        f"Черги (бої/пошук/інше): {'/'.join(map(str, scheduler.queued()))}, відкинуто: {'/'.join(map(str, scheduler.shed))}",
+        f"Глядачів: {len(broadcast.watching)}",
+        f"Таймерів бою: {len(fight_clock)}",
+        f"Діалогів FSM: {len(storage.records)} (~{storage.footprint() // 1024} КБ), забуто: {storage.evicted}",
+        "Затримка циклу p50/p95/p99: {:.1f}/{:.1f}/{:.1f} мс, макс.: {:.0f} мс, зависань: {}".format(
+            *loop_watchdog.percentiles().values(), loop_watchdog.max_lag(), loop_watchdog.stalls
+        ),
+        f"Аптайм: {uptime // 3600} год {uptime % 3600 // 60} хв",
+    ]
+    if draining:
+        lines.append(f"Зупинка бота: чекаємо {len(match_tables)} боїв, решту буде збережено у знімок.")
+    elif maintenance_mode:
+        lines.append(f"Очікуємо завершення боїв: {len(match_tables)}" if match_tables else "Усі бої завершено, можна зупиняти бота.")
+    return "\n".join(lines)
+
+def get_dashboard_keyboard():
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Оновити", callback_data="admin_refresh")]])
+
+# Сповіщення адміна, коли після ввімкнення техробіт завершиться останній бій
+async def watch_drain(admin_id):
+    while maintenance_mode and match_tables:
+        await asyncio.sleep(5)
+    if maintenance_mode:
+        await bot.send_message(admin_id, "Усі бої завершено, можна зупиняти бота.")
+        logger.info("Maintenance drain finished, no active matches left")
+
+# Команда /admin_setting
+@dp.message(Command("admin_setting"))
+async def admin_setting(message: types.Message, state: FSMContext):
+    logger.debug(f"Received /admin_setting from user {message.from_user.id}")
+    await reset_state(message, state)
+    if message.from_user.id not in ADMIN_IDS:
+        await message.reply("Ця команда доступна лише адмінам.")
+        return
+    await message.reply(render_dashboard(), reply_markup=get_dashboard_keyboard())
+
+@dp.callback_query(lambda c: c.data == "admin_refresh")
+async def refresh_dashboard(callback: types.CallbackQuery):
+    if callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("Ця кнопка доступна лише адмінам.")
+        return
+    try:
+        await callback.message.edit_text(render_dashboard(), reply_markup=get_dashboard_keyboard())
+    except TelegramBadRequest as e:
+        # "message is not modified", якщо нічого не змінилось
+        logger.debug(f"Dashboard refresh skipped: {e}")
+    await callback.answer()
+
+# Команда /backup_now - позачерговий бекап бази
+@dp.message(Command("backup_now"))
+async def backup_now(message: types.Message, state: FSMContext):
+    logger.debug(f"Received /backup_now from user {message.from_user.id}")
+    await reset_state(message, state)
+    if message.from_user.id not in ADMIN_IDS:
+        await message.reply("Ця команда доступна лише адмінам.")
+        return
+    if not db.supports_backup:
+        await message.reply("Файлові бекапи доступні лише для SQLite. Для PostgreSQL використовуй pg_dump.")
+        return
+    if backup_lock.locked():
+        await message.reply("Бекап уже виконується, зачекай.")
+        return
+    await message.reply("Створюю резервну копію бази...")
+    try:
+        path, size = await run_backup()
+    except (StorageError, OSError) as e:
+        await message.reply("Не вдалося створити бекап. Подробиці в логах.")
+        logger.error(f"Manual backup failed: {e}")
+        return
+    await message.reply(f"Бекап готовий: {path} ({size / 1024 / 1024:.1f} МБ).")
+
+# Команда /profile [секунди] - семплювальний профайлер (див. profiler.py).
+# Стеки збираються у фоні, результат приходить документом .folded
+PROFILE_DEFAULT_SECONDS = 10
+
+async def run_profile(chat_id, seconds):
+    try:
+        # get_ident тут - потік циклу подій, його й профілюємо
+        stacks = await asyncio.to_thread(profiler.sample, threading.get_ident(), seconds)
+    except RuntimeError as e:
+        await bot.send_message(chat_id, "Профайлер уже працює, дочекайся результату.")
+        logger.debug(f"Profile request rejected: {e}")
+        return
+    samples = sum(stacks.values())
+    if not samples:
+        await bot.send_message(chat_id, "Профайлер не зібрав жодного зразка.")
+        return
+    data = profiler.render(stacks)
+    try:
+        path = await asyncio.to_thread(profiler.save, data, profiler.PROFILE_DIR, f"profile_shard{SHARD_ID}")
+    except OSError as e:
+        logger.error(f"Failed to save profile: {e}")
+        path = f"profile_shard{SHARD_ID}.folded"
+    top = "\n".join(f"{name}: {count * 100 / samples:.1f}%" for name, count in profiler.top_functions(stacks))
+    try:
+        await bot.send_document(
+            chat_id,
+            BufferedInputFile(data.encode(), filename=os.path.basename(path)),
+            caption=f"Профіль за {seconds} с, зразків: {samples}. Найчастіше на вершині стека:\n{top}"
+        )
+        logger.info(f"Profile for {seconds}s sent to {chat_id} ({samples} samples, saved to {path})")
+    except TelegramBadRequest as e:
+        await bot.send_message(chat_id, f"Не вдалося надіслати профіль, він збережений у {path}.")
+        logger.error(f"Failed to send profile to {chat_id}: {e}")
+
+@dp.message(Command("profile"))
+async def profile_command(message: types.Message, state: FSMContext):
+    logger.debug(f"Received /profile from user {message.from_user.id}")
+    await reset_state(message, state)
+    if message.from_user.id not in ADMIN_IDS:
+        await message.reply("Ця команда доступна лише адмінам.")
+        return
+    args = message.text.split()
+    if len(args) > 1 and not (args[1].isdigit() and 1 <= int(args[1]) <= profiler.MAX_DURATION):
+        await message.reply(f"Використання: /profile [секунди], від 1 до {profiler.MAX_DURATION}.")
+        return
+    if profiler.is_running():
+        await message.reply("Профайлер уже працює, дочекайся результату.")
+        return
+    seconds = int(args[1]) if len(args) > 1 else PROFILE_DEFAULT_SECONDS
+    await message.reply(f"Профілювання {seconds} с" + (f" (шард {SHARD_ID})" if SHARD_COUNT > 1 else "") + "...")
+    run_in_background(run_profile(message.chat.id, seconds))
+
+# Команда /maintenance_on
+@dp.message(Command("maintenance_on"))
+async def maintenance_on(message: types.Message, state: FSMContext):
+    global maintenance_mode, drain_task
+    logger.debug(f"Received /maintenance_on from user {message.from_user.id}")
+    await reset_state(message, state)
+    if message.from_user.id not in ADMIN_IDS:
+        await message.reply("Ця команда доступна лише адмінам.")
+        return
+    maintenance_mode = True
+    logger.info(f"Maintenance mode enabled by admin {message.from_user.id}")
+    # Нові команди блокуються, а активні бої догравають до кінця
+    if drain_task is None or drain_task.done():
+        drain_task = run_in_background(watch_drain(message.from_user.id))
+    await message.reply(
+        f"Технічні роботи ввімкнено. Нові бої не починаються.\n{render_dashboard()}",
+        reply_markup=get_dashboard_keyboard()
+    )
+
+# Команда /maintenance_off
+@dp.message(Command("maintenance_off"))
+async def maintenance_off(message: types.Message, state: FSMContext):
+    global maintenance_mode
+    logger.debug(f"Received /maintenance_off from user {message.from_user.id}")
+    await reset_state(message, state)
+    if message.from_user.id not in ADMIN_IDS:
+        await message.reply("Ця команда доступна лише адмінам.")
+        return
+    maintenance_mode = False
+    logger.info(f"Maintenance mode disabled by admin {message.from_user.id}")
+    await message.reply("Технічні роботи вимкнено.")
+
+# Зупинка без втрати боїв: нові бої не починаються, активні догравають,
+# а ті, що не встигли за DRAIN_TIMEOUT, зберігаються у знімок і
+# відновлюються при наступному старті. Потім процес завершується.
+DRAIN_TIMEOUT = int(os.getenv("DRAIN_TIMEOUT", 600))
+DRAIN_REPORT_INTERVAL = 30
+DRAIN_SNAPSHOT = os.getenv("DRAIN_SNAPSHOT", f"drain_snapshot_{SHARD_ID}.json")
+# Встановлюється, коли процес можна зупиняти (чекає sharding.run_worker)
+shutdown_event = asyncio.Event()
+# Матчі, відновлені зі знімка
+resumed_matches = set()
+
+async def report_drain(admin_ids, text):
+    logger.info(f"Drain: {text}")
+    for admin_id in admin_ids:
+        try:
+            await bot.send_message(admin_id, text)
+        except TelegramBadRequest as e:
+            logger.error(f"Failed to send drain report to {admin_id}: {e}")
+
+def write_snapshot(path, snapshot):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+async def snapshot_matches():
+    matches = []
+    for match_id in list(match_tables):
+        try:
+            match = await db.get_match(match_id)
+        except StorageError as e:
+            logger.error(f"Database error reading match {match_id} for snapshot: {e}")
+            continue
+        if match and match["status"] == "active":
+            matches.append(match)
+    if matches:
+        # flush_progress пропускає гравців цих боїв, тож їхній незбережений
+        # досвід їде у знімок і повертається в буфер після рестарту
+        await flush_progress()
+        progress = {str(user_id): xp for user_id, xp in progression.take_ready(()).items()}
+        await asyncio.to_thread(
+            write_snapshot, DRAIN_SNAPSHOT, {"saved_at": time.time(), "matches": matches, "progress": progress}
+        )
+    return matches
+
+async def drain(admin_ids):
+    global maintenance_mode, draining
+    if draining:
+        return
+    maintenance_mode = draining = True
+    deadline = time.time() + DRAIN_TIMEOUT
+    await report_drain(admin_ids, f"Зупинка бота: активних боїв {len(match_tables)}, чекаємо до {DRAIN_TIMEOUT} с.")
+    next_report = time.time() + DRAIN_REPORT_INTERVAL
+    while match_tables and time.time() < deadline:
+        await asyncio.sleep(1)
+        if time.time() >= next_report and match_tables:
+            await report_drain(admin_ids, f"Зупинка бота: лишилось боїв {len(match_tables)}, глядачів {len(broadcast.watching)}.")
+            next_report = time.time() + DRAIN_REPORT_INTERVAL
+    saved = await snapshot_matches() if match_tables else []
+    if saved:
+        for match in saved:
+            for user_id in (match["player1_id"], match["player2_id"]):
+                await send_to_player(user_id, "Бот перезапускається. Бій буде продовжено одразу після старту.")
+        await report_drain(admin_ids, f"Зупинка бота: {len(saved)} боїв збережено у {DRAIN_SNAPSHOT}. Завершуємо роботу.")
+    else:
+        await report_drain(admin_ids, "Зупинка бота: усі бої завершено. Завершуємо роботу.")
+    await flush_round_events()
+    await flush_progress()
+    shutdown_event.set()
+
+# SIGTERM (деплой) запускає drain замість миттєвого завершення
+async def install_drain_signal():
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, lambda: run_in_background(drain(ADMIN_IDS)))
+    except (NotImplementedError, RuntimeError) as e:
+        logger.error(f"Cannot install SIGTERM handler: {e}")
+
+dp.startup.register(install_drain_signal)
+
+# Відновлення боїв зі знімка попередньої зупинки
+async def resume_drained_matches():
+    if not os.path.exists(DRAIN_SNAPSHOT):
+        return
+    try:
+        with open(DRAIN_SNAPSHOT) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Cannot read drain snapshot {DRAIN_SNAPSHOT}: {e}")
+        return
+    # Час простою не зараховується в ліміт тривалості бою
+    downtime = time.time() - snapshot["saved_at"]
+    for match in snapshot["matches"]:
+        match["start_time"] += downtime
+        match["phase"] = match.get("phase") or "fight"
+        if match.get("round_ends_at"):
+            match["round_ends_at"] += downtime
+        # Інакше таймер дії спрацював би одразу за старим дедлайном
+        if match.get("action_deadline"):
+            match["action_deadline"] += downtime
+        try:
+            await db.restore_match(match)
+        except StorageError as e:
+            logger.error(f"Database error restoring match {match['match_id']}: {e}")
+            continue
+        resumed_matches.add(match["match_id"])
+        if match["phase"] == "rest":
+            # Перерва продовжиться з того ж місця, таймер поставить get_match_table
+            run_in_background(get_match_table(match))
+        else:
+            run_in_background(send_fight_message(match["match_id"]))
+    # Ключі JSON - рядки
+    progression.restore({int(user_id): xp for user_id, xp in snapshot.get("progress", {}).items()})
+    os.remove(DRAIN_SNAPSHOT)
+    logger.info(f"Resumed {len(resumed_matches)} matches from drain snapshot")
+
+dp.startup.register(resume_drained_matches)
+
+# Команда /drain - плавна зупинка бота
+@dp.message(Command("drain"))
+async def drain_command(message: types.Message, state: FSMContext):
+    logger.debug(f"Received /drain from user {message.from_user.id}")
+    await reset_state(message, state)
+    if message.from_user.id not in ADMIN_IDS:
+        await message.reply("Ця команда доступна лише адмінам.")
+        return
+    if draining:
+        await message.reply(render_dashboard())
+        return
+    if SHARD_COUNT > 1:
+        # Зупинка одного шарду - це лише його перезапуск фронтом, тому
+        # команда йде шляхом деплою: SIGTERM фронту, який зупиняє всі шарди
+        if not FRONT_PID:
+            await message.reply("У багатопроцесному режимі зупиняй бота через SIGTERM процесу sharding.py.")
+            return
+        try:
+            os.kill(FRONT_PID, signal.SIGTERM)
+        except OSError as e:
+            await message.reply("Не вдалося зупинити бота, надішли SIGTERM процесу sharding.py.")
+            logger.error(f"Failed to signal front process {FRONT_PID}: {e}")
+            return
+        logger.info(f"Drain of all {SHARD_COUNT} shards requested by admin {message.from_user.id}")
+        await message.reply(f"Зупинка всіх {SHARD_COUNT} шардів: звіти прийдуть від кожного шарду.")
+        return
+    run_in_background(drain([message.from_user.id]))
+
+# Гаряче перезавантаження правил: нові матчі беруть нові правила, а активні
+# догравають за тими, що збережені в їхніх MatchTable
+def apply_new_rules():
+    new_rules = rules.reload_rules()
+    if AI_SPARRING:
+        # Старі політики лишаються в грі, доки нові не побудовані
+        run_in_background(asyncio.to_thread(build_all_policies))
+    return new_rules
+
+def reload_rules_on_signal():
+    try:
+        apply_new_rules()
+    except RulesError as e:
+        logger.error(f"Rules reload failed, keeping previous rules: {e}")
+
+async def install_reload_signal():
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_rules_on_signal)
+    except (NotImplementedError, RuntimeError, AttributeError) as e:
+        logger.error(f"Cannot install SIGHUP handler: {e}")
+
+dp.startup.register(install_reload_signal)
+
+# Команда /reload_rules
+@dp.message(Command("reload_rules"))
+async def reload_rules_command(message: types.Message, state: FSMContext):
+    logger.debug(f"Received /reload_rules from user {message.from_user.id}")
+    await reset_state(message, state)
+    if message.from_user.id not in ADMIN_IDS:
+        await message.reply("Ця команда доступна лише адмінам.")
+        return
+    try:
+        new_rules = apply_new_rules()
+    except RulesError as e:
+        await message.reply(f"Правила не змінено, файл містить помилку:\n{e}")
+        logger.error(f"Rules reload failed, keeping previous rules: {e}")
+        return
+    await message.reply(
+        f"Правила версії {new_rules.version} завантажено. Активних боїв за старими правилами: {len(match_tables)}."
+        + ("\nУ багатопроцесному режимі інші шарди оновлюються через SIGHUP фронту." if SHARD_COUNT > 1 else "")
+    )
 
 # Команда /create_room
 @dp.message(Command("create_room"))
@@ -404,47 +982,37 @@ async def create_room(message: types.Message, state: FSMContext):
     if not await check_maintenance(message):
         return
     user_id = message.from_user.id
-    
-    conn = sqlite3.connect("bot.db")
+
     try:
-        c = conn.cursor()
-        c.execute("SELECT user_id, character_name FROM users WHERE user_id = ?", (user_id,))
-        user = c.fetchone()
+        user = await db.get_user(user_id)
         if not user:
             await message.reply("Спочатку створи акаунт за допомогою /create_account!")
             logger.debug(f"No account for user {user_id} for /create_room")
             return
-        
-        c.execute("SELECT match_id FROM matches WHERE (player1_id = ? OR player2_id = ?) AND status = 'active'", (user_id, user_id))
-        if c.fetchone():
+
+        if await db.get_active_match_id(user_id):
             await message.reply("Ти вже в матчі! Закінчи поточний бій.")
             logger.debug(f"User {user_id} already in active match")
             return
-        
-        c.execute("SELECT token FROM rooms WHERE creator_id = ? AND status = 'waiting'", (user_id,))
-        if c.fetchone():
+
+        if await db.get_creator_room(user_id, "waiting"):
             await message.reply("Ти вже створив кімнату! Зачекай, поки хтось приєднається, або видали акаунт.")
             logger.debug(f"User {user_id} already has a waiting room")
             return
-        
+
         token = generate_room_token()
-        room = {'token': token, 'creator_id': user_id, 'created_at': time.time(), 'status': 'waiting', 'votes_for': 0}
-        c.execute(
-            "INSERT INTO rooms (token, creator_id, created_at, status, votes_for) VALUES (?, ?, ?, ?, ?)",
-            (room['token'], room['creator_id'], room['created_at'], room['status'], room['votes_for'])
-        )
-        conn.commit()
+        created_at = time.time()
+        await db.create_room(token, user_id, created_at)
+        metrics.room_opened(token, created_at)
         await message.reply(
             f"Кімната створена! Токен: <code>{token}</code>\nПоділись ним із суперником. "
             f"Коли суперник приєднається, використовуй /start_fight, щоб почати бій.",
             parse_mode="HTML"
         )
         logger.debug(f"Created room with token {token} for user {user_id}")
-    except sqlite3.Error as e:
+    except StorageError as e:
         await message.reply("Помилка при створенні кімнати. Спробуй ще раз.")
         logger.error(f"Database error creating room for user {user_id}: {e}")
-    finally:
-        conn.close()
 
 # Команда /join_room
 @dp.message(Command("join_room"))
@@ -454,79 +1022,73 @@ async def join_room(message: types.Message, state: FSMContext):
     if not await check_maintenance(message):
         return
     user_id = message.from_user.id
-    
-    conn = sqlite3.connect("bot.db")
+    token = None
+
     try:
-        c = conn.cursor()
-        c.execute("SELECT user_id, character_name FROM users WHERE user_id = ?", (user_id,))
-        user = c.fetchone()
+        user = await db.get_user(user_id)
         if not user:
             await message.reply("Спочатку створи акаунт за допомогою /create_account!")
             logger.debug(f"No account for user {user_id} for /join_room")
             return
-        
-        c.execute("SELECT match_id FROM matches WHERE (player1_id = ? OR player2_id = ?) AND status = 'active'", (user_id, user_id))
-        if c.fetchone():
+
+        if await db.get_active_match_id(user_id):
             await message.reply("Ти вже в матчі! Закінчи поточний бій.")
             logger.debug(f"User {user_id} already in active match")
             return
-        
+
         args = message.text.split()
         if len(args) != 2:
             await message.reply("Вкажи токен кімнати: /join_room <token>")
             logger.debug(f"Invalid /join_room command from user {user_id}")
             return
-        
+
         token = args[1].strip()
-        c.execute("SELECT creator_id, created_at, opponent_id, status FROM rooms WHERE token = ?", (token,))
-        room = c.fetchone()
+        room = await db.get_room(token)
         if not room:
             await message.reply("Кімната не знайдена або прострочена!")
             logger.debug(f"Room with token {token} not found")
             return
-        
-        creator_id, created_at, opponent_id, status = room
+
+        creator_id = room["creator_id"]
         if creator_id == user_id:
             await message.reply("Ти не можеш приєднатися до власної кімнати!")
             logger.debug(f"User {user_id} tried to join own room {token}")
             return
-        
-        if status != 'waiting':
+
+        if room["status"] != 'waiting':
             await message.reply("Кімната вже закрита або бій розпочато!")
             logger.debug(f"Room {token} is not in waiting status")
             return
-        
-        if opponent_id is not None:
+
+        if room["opponent_id"] is not None:
             await message.reply("Кімната вже заповнена! Максимум 2 гравці.")
             logger.debug(f"Room {token} already has 2 players")
             return
-        
-        if time.time() - created_at > 300:
-            c.execute("DELETE FROM rooms WHERE token = ?", (token,))
-            conn.commit()
+
+        if time.time() - room["created_at"] > rules.current.room_ttl:
+            await db.delete_room(token)
+            metrics.room_closed(token)
             await message.reply("Кімната прострочена!")
             logger.debug(f"Room {token} expired")
             return
-        
-        c.execute(
-            "UPDATE rooms SET opponent_id = ?, status = 'ready' WHERE token = ?",
-            (user_id, token)
-        )
-        conn.commit()
+
+        if not await db.join_room(token, user_id):
+            await message.reply("Кімната вже заповнена! Максимум 2 гравці.")
+            logger.debug(f"Room {token} was taken concurrently")
+            return
+        metrics.room_closed(token)
         await message.reply(
             f"Ти приєднався до кімнати {token}! Чекай, поки творець розпочне бій (/start_fight)."
         )
         await bot.send_message(
             creator_id,
-            f"Гравець {user[1]} приєднався до твоєї кімнати {token}! "
+            f"Гравець {user['character_name']} приєднався до твоєї кімнати {token}! "
             f"Використай /start_fight, щоб почати бій."
         )
         logger.debug(f"User {user_id} joined room {token}")
-    except sqlite3.Error as e:
+    except StorageError as e:
         await message.reply("Помилка при приєднанні до кімнати. Спробуй ще раз.")
         logger.error(f"Database error joining room {token}: {e}")
-    finally:
-        conn.close()
 
 # Команда /start_fight
 @dp.message(Command("start_fight"))
@@ -536,72 +1098,62 @@ async def start_fight(message: types.Message, state: FSMContext):
     if not await check_maintenance(message):
         return
     user_id = message.from_user.id
-    
-    conn = sqlite3.connect("bot.db")
+    token = None
+
     try:
-        c = conn.cursor()
-        c.execute("SELECT token, opponent_id, status FROM rooms WHERE creator_id = ? AND status = 'ready'", (user_id,))
-        room = c.fetchone()
+        room = await db.get_creator_room(user_id, "ready")
         if not room:
             await message.reply("Ти не створив кімнату, або ще немає суперника!")
             logger.debug(f"No ready room found for creator {user_id}")
             return
-        
-        token, opponent_id, status = room
+
+        token, opponent_id = room["token"], room["opponent_id"]
         if opponent_id is None:
             await message.reply("Суперник ще не приєднався! Зачекай.")
             logger.debug(f"No opponent in room {token}")
             return
-        
-        c.execute("SELECT user_id, character_name, fighter_type FROM users WHERE user_id = ?", (user_id,))
-        creator = c.fetchone()
-        c.execute("SELECT user_id, character_name, fighter_type FROM users WHERE user_id = ?", (opponent_id,))
-        opponent = c.fetchone()
-        
+
+        creator = await db.get_user(user_id)
+        opponent = await db.get_user(opponent_id)
+
         if not creator or not opponent:
             await message.reply("Помилка: дані гравців не знайдено.")
             logger.error(f"User data missing for creator {user_id} or opponent {opponent_id}")
             return
-        
-        c.execute("SELECT health, stamina FROM fighter_stats WHERE user_id = ?", (user_id,))
-        creator_stats = c.fetchone()
-        c.execute("SELECT health, stamina FROM fighter_stats WHERE user_id = ?", (opponent_id,))
-        opponent_stats = c.fetchone()
-        
+
+        creator_stats = await db.get_fighter_stats(user_id)
+        opponent_stats = await db.get_fighter_stats(opponent_id)
+
         if not creator_stats or not opponent_stats:
             await message.reply("Помилка: не вдалося знайти статистику бійця. Спробуй видалити акаунт і створити новий.")
             logger.error(f"Missing stats for user {user_id} or opponent {opponent_id}")
             return
-        
-        action_deadline = time.time() + 30
-        c.execute(
-            """INSERT INTO matches (player1_id, player2_id, status, start_time, current_round, player1_health, player1_stamina, player2_health, player2_stamina, action_deadline, distance)
-            VALUES (?, ?, 'active', ?, 1, ?, ?, ?, ?, ?, 'far')""",
-            (user_id, opponent_id, time.time(), creator_stats[0], creator_stats[1], opponent_stats[0], opponent_stats[1], action_deadline)
+
+        action_deadline = time.time() + rules.current.action_window
+        match_id = await db.create_match(
+            user_id, opponent_id,
+            creator_stats["health"], creator_stats["stamina"], opponent_stats["health"], opponent_stats["stamina"],
+            action_deadline, time.time() + rules.current.round_length
         )
-        conn.commit()
-        match_id = c.lastrowid
-        c.execute("UPDATE rooms SET status = 'active' WHERE token = ?", (token,))
-        conn.commit()
-        
+        await db.set_room_status(token, "active")
+        register_match_table(match_id, creator, creator_stats, opponent, opponent_stats)
+
         keyboard = get_fight_keyboard(match_id, "far", False)
         await message.reply(
-            f"Матч розпочато! Ти ({creator[1]}, {creator[2].capitalize()}) проти {opponent[1]} ({opponent[2].capitalize()}). "
-            f"Бій триває 3 раунди по 3 хвилини. Дистанція: Далеко. Обери дію (30 секунд):",
+            f"Матч розпочато! Ти ({creator['character_name']}, {creator['fighter_type'].capitalize()}) проти {opponent['character_name']} ({opponent['fighter_type'].capitalize()}). "
+            f"Бій №{match_id}: {bout_text()}. Дистанція: Далеко. Обери дію ({rules.current.action_window} секунд):",
             reply_markup=keyboard
         )
         await bot.send_message(
             opponent_id,
-            f"Матч розпочато! Ти ({opponent[1]}, {opponent[2].capitalize()}) проти {creator[1]} ({creator[2].capitalize()}). "
-            f"Бій триває 3 раунди по 3 хвилини. Дистанція: Далеко. Обери дію (30 секунд):",
+            f"Матч розпочато! Ти ({opponent['character_name']}, {opponent['fighter_type'].capitalize()}) проти {creator['character_name']} ({creator['fighter_type'].capitalize()}). "
+            f"Бій №{match_id}: {bout_text()}. Дистанція: Далеко. Обери дію ({rules.current.action_window} секунд):",
             reply_markup=keyboard
         )
         logger.debug(f"Started match {match_id} for user {user_id} vs {opponent_id}")
-    except sqlite3.Error as e:
+    except StorageError as e:
         await message.reply("Помилка при створенні матчу. Спробуй ще раз.")
         logger.error(f"Database error starting match for room {token}: {e}")
-    finally:
-        conn.close()
 
 # Команда /start_match
 @dp.message(Command("start_match"))
@@ -611,90 +1163,564 @@ async def start_match(message: types.Message, state: FSMContext):
     if not await check_maintenance(message):
         return
     user_id = message.from_user.id
-    
-    conn = sqlite3.connect("bot.db")
+
     try:
-        c = conn.cursor()
-        c.execute("SELECT user_id, character_name, fighter_type FROM users WHERE user_id = ?", (user_id,))
-        user = c.fetchone()
+        user = await db.get_user(user_id)
         if not user:
             await message.reply("Спочатку створи акаунт за допомогою /create_account!")
             logger.debug(f"No account for user {user_id} for /start_match")
             return
-        
-        c.execute("SELECT match_id FROM matches WHERE (player1_id = ? OR player2_id = ?) AND status = 'active'", (user_id, user_id))
-        if c.fetchone():
+
+        if await db.get_active_match_id(user_id):
             await message.reply("Ти вже в матчі! Закінчи поточний бій.")
             logger.debug(f"User {user_id} already in active match")
             return
-        
+
         if user_id in searching_users:
             await message.reply("Ти вже шукаєш суперника! Зачекай.")
             logger.debug(f"User {user_id} already in searching_users")
             return
-        
+
         searching_users.append(user_id)
         logger.debug(f"User {user_id} added to searching_users: {searching_users}")
-        await message.reply("Пошук суперника... (макс. 30 секунд)")
-        
+        search_timeout = rules.current.search_timeout
+        await message.reply(f"Пошук суперника... (макс. {search_timeout} секунд)")
+
         start_time = time.time()
-        while time.time() - start_time < 30:
+        while time.time() - start_time < search_timeout and not draining:
+            if user_id not in searching_users:
+                # Пару вже створив обробник суперника, повідомлення надіслав він
+                logger.debug(f"User {user_id} was matched by another searcher")
+                return
             if len(searching_users) >= 2:
                 for opponent_id in searching_users:
                     if opponent_id != user_id:
                         searching_users.remove(user_id)
                         searching_users.remove(opponent_id)
                         logger.debug(f"Match found: {user_id} vs {opponent_id}")
-                        
-                        c.execute("SELECT user_id, character_name, fighter_type FROM users WHERE user_id = ?", (opponent_id,))
-                        opponent = c.fetchone()
+
+                        opponent = await db.get_user(opponent_id)
                         if not opponent:
                             await message.reply("Помилка: суперник не знайдений. Спробуй ще раз.")
                             logger.error(f"Opponent {opponent_id} not found in users")
                             return
-                        
-                        c.execute("SELECT health, stamina FROM fighter_stats WHERE user_id = ?", (user_id,))
-                        player_stats = c.fetchone()
-                        c.execute("SELECT health, stamina FROM fighter_stats WHERE user_id = ?", (opponent_id,))
-                        opponent_stats = c.fetchone()
-                        
+
+                        player_stats = await db.get_fighter_stats(user_id)
+                        opponent_stats = await db.get_fighter_stats(opponent_id)
+
                         if not player_stats or not opponent_stats:
                             await message.reply("Помилка: не вдалося знайти статистику бійця. Спробуй видалити акаунт і створити новий.")
                             logger.error(f"Missing stats for user {user_id} or opponent {opponent_id}")
                             return
-                        
-                        action_deadline = time.time() + 30
-                        c.execute(
-                            """INSERT INTO matches (player1_id, player2_id, status, start_time, current_round, player1_health, player1_stamina, player2_health, player2_stamina, action_deadline, distance)
-                            VALUES (?, ?, 'active', ?, 1, ?, ?, ?, ?, ?, 'far')""",
-                            (user_id, opponent_id, time.time(), player_stats[0], player_stats[1], opponent_stats[0], opponent_stats[1], action_deadline)
+
+                        action_deadline = time.time() + rules.current.action_window
+                        match_id = await db.create_match(
+                            user_id, opponent_id,
+                            player_stats["health"], player_stats["stamina"], opponent_stats["health"], opponent_stats["stamina"],
+                            action_deadline, time.time() + rules.current.round_length
                         )
-                        conn.commit()
-                        match_id = c.lastrowid
-                        
+                        register_match_table(match_id, user, player_stats, opponent, opponent_stats)
+
                         keyboard = get_fight_keyboard(match_id, "far", False)
                         await message.reply(
-                            f"Матч розпочато! Ти ({user[1]}, {user[2].capitalize()}) проти {opponent[1]} ({opponent[2].capitalize()}). Бій триває 3 раунди по 3 хвилини. Дистанція: Далеко. Обери дію (30 секунд):",
+                            f"Матч розпочато! Ти ({user['character_name']}, {user['fighter_type'].capitalize()}) проти {opponent['character_name']} ({opponent['fighter_type'].capitalize()}). Бій №{match_id}: {bout_text()}. Дистанція: Далеко. Обери дію ({rules.current.action_window} секунд):",
                             reply_markup=keyboard
                         )
                         await bot.send_message(
                             chat_id=opponent_id,
-                            text=f"Матч розпочато! Ти ({opponent[1]}, {opponent[2].capitalize()}) проти {user[1]} ({user[2].capitalize()}). Бій триває 3 раунди по 3 хвилини. Дистанція: Далеко. Обери дію (30 секунд):",
+                            text=f"Матч розпочато! Ти ({opponent['character_name']}, {opponent['fighter_type'].capitalize()}) проти {user['character_name']} ({user['fighter_type'].capitalize()}). Бій №{match_id}: {bout_text()}. Дистанція: Далеко. Обери дію ({rules.current.action_window} секунд):",
                             reply_markup=keyboard
                         )
                         logger.debug(f"Started match {match_id} for user {user_id} vs {opponent_id}")
                         return
             await asyncio.sleep(1)
-        
-        if user_id in searching_users:
-            searching_users.remove(user_id)
+
+        if user_id not in searching_users:
+            logger.debug(f"User {user_id} was matched by another searcher")
+            return
+        searching_users.remove(user_id)
+        if draining:
+            await message.reply("Бот перезапускається, пошук скасовано. Спробуй за кілька хвилин.")
+            return
+        if AI_SPARRING:
+            await start_ai_match(message, user)
+            return
         await message.reply("Суперник не знайдений. Спробуй ще раз.")
         logger.debug(f"Search timeout for user {user_id}")
-    except sqlite3.Error as e:
+    except StorageError as e:
         await message.reply("Помилка при пошуку суперника. Спробуй ще раз.")
         logger.error(f"Database error starting match for user {user_id}: {e}")
-    finally:
-        conn.close()
+
+STAT_LABELS = {
+    "stamina": "Витривалість",
+    "strength": "Сила",
+    "reaction": "Реакція",
+    "health": "Здоров’я",
+    "punch_speed": "Швидкість удару",
+    "will": "Воля",
+    "footwork": "Робота ніг",
+}
+
+# Команда /fighter
+@dp.message(Command("fighter"))
+async def fighter_info(message: types.Message, state: FSMContext):
+    logger.debug(f"Received /fighter from user {message.from_user.id}")
+    await reset_state(message, state)
+    user_id = message.from_user.id
+    try:
+        user = await db.get_user(user_id)
+        stats = await db.get_fighter_stats(user_id) if user else None
+    except StorageError as e:
+        await message.reply("Помилка при завантаженні бійця. Спробуй ще раз.")
+        logger.error(f"Database error loading fighter for user {user_id}: {e}")
+        return
+    if not stats:
+        await message.reply("Спочатку створи акаунт за допомогою /create_account!")
+        return
+    current = rules.current
+    level = stats["level"]
+    if level < current.max_level:
+        progress = f"Досвід: {stats['xp']}/{progression.xp_for_level(level + 1, current)}"
+    else:
+        progress = f"Досвід: {stats['xp']} (максимальний рівень)"
+    lines = [f"{user['character_name']} ({stats['fighter_type'].capitalize()}), рівень {level}", progress]
+    pending_xp = progression.pending.get(user_id)
+    if pending_xp:
+        lines.append(f"Ще не зараховано: +{pending_xp} (після завершення бою)")
+    lines += [f"{label}: {stats[name]:.2f}" for name, label in STAT_LABELS.items()]
+    await message.reply("\n".join(lines))
+
+# Глядачі (див. broadcast.py)
+async def send_spectator(chat_id, text):
+    await bot.send_message(chat_id, text)
+
+# Команда /watch <match_id>
+@dp.message(Command("watch"))
+async def watch_match(message: types.Message, state: FSMContext):
+    logger.debug(f"Received /watch from user {message.from_user.id}")
+    await reset_state(message, state)
+    user_id = message.from_user.id
+    args = message.text.split()
+    if len(args) != 2 or not args[1].isdigit():
+        await message.reply("Вкажи номер бою: /watch <match_id>")
+        return
+    match_id = int(args[1])
+    try:
+        match = await db.get_match(match_id)
+    except StorageError as e:
+        await message.reply("Помилка бази даних. Спробуй ще раз.")
+        logger.error(f"Database error for watch user {user_id}: {e}")
+        return
+    if not match or match["status"] != "active":
+        await message.reply("Бій не знайдено або він уже завершився!")
+        return
+    if user_id in (match["player1_id"], match["player2_id"]):
+        await message.reply("Ти береш участь у цьому бою!")
+        return
+    if not broadcast.subscribe(match_id, message.chat.id, send_spectator):
+        await message.reply("Забагато глядачів, спробуй пізніше.")
+        return
+    table = await get_match_table(match)
+    p1, p2 = table.fighters
+    await message.reply(
+        f"Ти дивишся бій {match_id}: {p1.name} ({p1.fighter_type.capitalize()}) vs "
+        f"{p2.name} ({p2.fighter_type.capitalize()}), раунд {match['current_round']}.\n"
+        f"{p1.name}: {match['player1_health']:.1f} hp, {p2.name}: {match['player2_health']:.1f} hp\n"
+        f"Глядачів: {broadcast.watcher_count(match_id)}. Вийти - /unwatch."
+    )
+    logger.debug(f"User {user_id} is watching match {match_id}")
+
+# Команда /unwatch
+@dp.message(Command("unwatch"))
+async def unwatch_match(message: types.Message, state: FSMContext):
+    logger.debug(f"Received /unwatch from user {message.from_user.id}")
+    await reset_state(message, state)
+    match_id = broadcast.unsubscribe(message.chat.id)
+    if match_id is None:
+        await message.reply("Ти зараз не дивишся жоден бій.")
+        return
+    await message.reply(f"Ти більше не дивишся бій {match_id}.")
+
+# Турніри на вибування (див. tournament.py)
+async def save_bracket(bracket):
+    try:
+        await db.save_tournament(bracket.token, bracket.status, json.dumps(bracket.to_dict()))
+    except StorageError as e:
+        logger.error(f"Database error saving tournament {bracket.token}: {e}")
+
+async def notify_bracket(bracket, text):
+    await asyncio.gather(
+        *(send_to_player(user_id, text) for user_id in bracket.participants),
+        return_exceptions=True
+    )
+
+# Після старту сітку змінює шард, де завершився матч (див. tournament.py):
+# стан читається з бази і записується, лише якщо його ніхто не змінив.
+# change(bracket) змінює сітку і повертає результат для викликача
+TOURNAMENT_UPDATE_ATTEMPTS = 10
+
+async def update_bracket(token, change):
+    for _ in range(TOURNAMENT_UPDATE_ATTEMPTS):
+        state = await db.get_tournament(token)
+        if state is None:
+            return None, None
+        bracket = Bracket(**json.loads(state))
+        result = change(bracket)
+        if await db.update_tournament(token, bracket.status, json.dumps(bracket.to_dict()), state):
+            return bracket, result
+    raise StorageError(f"Tournament {token} was changed concurrently {TOURNAMENT_UPDATE_ATTEMPTS} times")
+
+# Результат слоту; повертає пари, що стали готовими
+async def record_bracket_result(token, round_num, slot_num, winner_id):
+    bracket, ready = await update_bracket(token, lambda b: b.record_result(round_num, slot_num, winner_id))
+    if bracket is None:
+        return []
+    if bracket.status == "finished":
+        await finish_bracket(bracket)
+    return ready
+
+# Старт одного матчу сітки; повертає пари, що стали готовими (при неявці)
+async def start_tournament_match(token, round_num, slot_num, player1_id, player2_id):
+    if draining:
+        # Пара лишається в сітці і стартує після перезапуску (restore_tournaments)
+        return []
+    player1, player2 = await db.get_user(player1_id), await db.get_user(player2_id)
+    player1_stats = await db.get_fighter_stats(player1_id) if player1 else None
+    player2_stats = await db.get_fighter_stats(player2_id) if player2 else None
+    if not player1_stats or not player2_stats:
+        # Акаунт видалено - суперник проходить далі без бою
+        winner_id = player2_id if not player1_stats else player1_id
+        logger.debug(f"Tournament {token}: walkover for {winner_id} in round {round_num}")
+        return await record_bracket_result(token, round_num, slot_num, winner_id)
+
+    match_id = await db.create_match(
+        player1_id, player2_id,
+        player1_stats["health"], player1_stats["stamina"], player2_stats["health"], player2_stats["stamina"],
+        time.time() + rules.current.action_window, time.time() + rules.current.round_length
+    )
+    await db.add_tournament_match(match_id, token, round_num, slot_num)
+    bracket, _ = await update_bracket(token, lambda b: b.assign_match(round_num, slot_num, match_id))
+    if bracket is None:
+        logger.error(f"Tournament {token} disappeared while starting match {match_id}")
+        return []
+    register_match_table(match_id, player1, player1_stats, player2, player2_stats)
+    keyboard = get_fight_keyboard(match_id, "far", False)
+    stage = bracket.round_name(round_num)
+    for me, opponent in ((player1, player2), (player2, player1)):
+        await send_to_player(
+            me["user_id"],
+            f"Турнір {token}, {stage}, бій №{match_id}! Ти ({me['character_name']}) проти {opponent['character_name']} "
+            f"({opponent['fighter_type'].capitalize()}). Дистанція: Далеко. Обери дію ({rules.current.action_window} секунд):",
+            reply_markup=keyboard
+        )
+    logger.debug(f"Tournament {token}: started match {match_id} ({stage})")
+    return []
+
+# Матчі сітки стартують паралельно; неявки одразу просувають сітку далі
+async def launch_pairs(token, pairs):
+    while pairs:
+        results = await asyncio.gather(
+            *(start_tournament_match(token, *pair) for pair in pairs),
+            return_exceptions=True
+        )
+        pairs = []
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Error starting tournament {token} match: {result}")
+            else:
+                pairs.extend(result)
+
+async def finish_bracket(bracket):
+    champion = await db.get_user(bracket.champion) if bracket.champion else None
+    name = champion["character_name"] if champion else "невідомий"
+    await notify_bracket(bracket, f"Турнір {bracket.token} завершено! Переможець: {name} 🏆")
+    close_bracket(bracket)
+    logger.info(f"Tournament {bracket.token} finished, champion {bracket.champion}")
+
+# Викликається для кожного завершеного матчу; звичайний бій коштує один
+# пошук за первинним ключем у tournament_matches
+async def advance_tournament(match_id, winner_id, player_ids):
+    slot = await db.get_tournament_match(match_id)
+    if slot is None:
+        return
+    token = slot["token"]
+    # Нічия в турнірі вирішується жеребом
+    ready = await record_bracket_result(token, slot["round_num"], slot["slot_num"], winner_id or random.choice(player_ids))
+    await db.delete_tournament_match(match_id)
+    await launch_pairs(token, ready)
+
+# Сітка гравця з копії шарду 0. Запущену сітку міг завершити інший шард,
+# тож вона звіряється з базою (див. tournament.refresh)
+async def get_user_bracket(user_id):
+    bracket = find_user_bracket(user_id)
+    if bracket is None or bracket.status != "running":
+        return bracket
+    state = await db.get_tournament(bracket.token)
+    return tournament.refresh(bracket, json.loads(state) if state else None)
+
+# Відновлення турнірів після перезапуску. Перерваний матч сітки грається
+# заново шардом-власником, якщо матч не відновився зі знімка; пару, для якої
+# матч ще не створювали, стартує шард 0
+async def restore_tournaments():
+    try:
+        states = await db.load_tournaments()
+    except StorageError as e:
+        logger.error(f"Database error loading tournaments: {e}")
+        return
+    for state in states:
+        data = json.loads(state)
+        bracket = Bracket.from_dict(data) if SHARD_ID == 0 else Bracket(**data)
+        if SHARD_ID == 0:
+            active_brackets[bracket.token] = bracket
+        if bracket.status != "running":
+            continue
+        pairs = []
+        for pair in bracket.pending_pairs():
+            match_id = bracket.rounds[pair[0]][pair[1]][2]
+            if match_id is None:
+                if SHARD_ID == 0:
+                    pairs.append(pair)
+                continue
+            if not owns_match(match_id):
+                continue
+            try:
+                match = await db.get_match(match_id)
+                if match and match["status"] == "active":
+                    # Матч, відновлений зі знімка бази старішої версії, ще без запису
+                    await db.add_tournament_match(match_id, bracket.token, pair[0], pair[1])
+            except StorageError as e:
+                logger.error(f"Database error checking tournament match {match_id}: {e}")
+                continue
+            if not match or match["status"] != "active":
+                pairs.append(pair)
+        if pairs:
+            run_in_background(launch_pairs(bracket.token, pairs))
+    if states:
+        logger.info(f"Restored {len(states)} tournaments")
+
+dp.startup.register(restore_tournaments)
+
+# Команда /create_tournament [кількість учасників]
+@dp.message(Command("create_tournament"))
+async def create_tournament(message: types.Message, state: FSMContext):
+    logger.debug(f"Received /create_tournament from user {message.from_user.id}")
+    await reset_state(message, state)
+    if not await check_maintenance(message):
+        return
+    user_id = message.from_user.id
+    args = message.text.split()
+    capacity = int(args[1]) if len(args) == 2 and args[1].isdigit() else 8
+    if not MIN_PARTICIPANTS <= capacity <= MAX_PARTICIPANTS:
+        await message.reply(f"Кількість учасників має бути від {MIN_PARTICIPANTS} до {MAX_PARTICIPANTS}.")
+        return
+    try:
+        if not await db.get_user(user_id):
+            await message.reply("Спочатку створи акаунт за допомогою /create_account!")
+            return
+        current = await get_user_bracket(user_id)
+    except StorageError as e:
+        await message.reply("Помилка бази даних. Спробуй ще раз.")
+        logger.error(f"Database error for create_tournament user {user_id}: {e}")
+        return
+    if current:
+        await message.reply("Ти вже береш участь у турнірі!")
+        return
+
+    token = generate_room_token()
+    while token in active_brackets:
+        token = generate_room_token()
+    bracket = Bracket(token, user_id, capacity)
+    bracket.add(user_id)
+    active_brackets[token] = bracket
+    await save_bracket(bracket)
+    await message.reply(
+        f"Турнір створено! Токен: <code>{token}</code>, місць: {capacity}.\n"
+        f"Учасники приєднуються через /join_tournament {token}, старт - /start_tournament.",
+        parse_mode="HTML"
+    )
+    logger.debug(f"Created tournament {token} for {capacity} fighters by user {user_id}")
+
+# Команда /join_tournament <token>
+@dp.message(Command("join_tournament"))
+async def join_tournament(message: types.Message, state: FSMContext):
+    logger.debug(f"Received /join_tournament from user {message.from_user.id}")
+    await reset_state(message, state)
+    if not await check_maintenance(message):
+        return
+    user_id = message.from_user.id
+    args = message.text.split()
+    if len(args) != 2:
+        await message.reply("Вкажи токен турніру: /join_tournament <token>")
+        return
+    # Сітки, що набирають учасників, змінює лише шард 0, тож копія актуальна
+    bracket = active_brackets.get(args[1].strip().upper())
+    if not bracket or bracket.status != "gathering":
+        await message.reply("Турнір не знайдено або він уже почався!")
+        return
+    try:
+        user = await db.get_user(user_id)
+        if not user or not user["fighter_type"]:
+            await message.reply("Спочатку створи акаунт за допомогою /create_account!")
+            return
+        current = await get_user_bracket(user_id)
+    except StorageError as e:
+        await message.reply("Помилка бази даних. Спробуй ще раз.")
+        logger.error(f"Database error for join_tournament user {user_id}: {e}")
+        return
+    if current:
+        await message.reply("Ти вже береш участь у турнірі!")
+        return
+    if not bracket.add(user_id):
+        await message.reply("Турнір уже заповнений!")
+        return
+    await save_bracket(bracket)
+    await message.reply(f"Ти в турнірі {bracket.token}! Учасників: {len(bracket.participants)}/{bracket.capacity}.")
+    await send_to_player(
+        bracket.creator_id,
+        f"{user['character_name']} приєднався до турніру {bracket.token} ({len(bracket.participants)}/{bracket.capacity})."
+    )
+    logger.debug(f"User {user_id} joined tournament {bracket.token}")
+
+# Команда /start_tournament
+@dp.message(Command("start_tournament"))
+async def start_tournament(message: types.Message, state: FSMContext):
+    logger.debug(f"Received /start_tournament from user {message.from_user.id}")
+    await reset_state(message, state)
+    if not await check_maintenance(message):
+        return
+    user_id = message.from_user.id
+    # Сітку, що набирає учасників, змінює лише шард 0 - база тут не потрібна
+    bracket = find_user_bracket(user_id)
+    if not bracket or bracket.creator_id != user_id or bracket.status != "gathering":
+        await message.reply("Ти не створював турнір, або він уже почався!")
+        return
+    if len(bracket.participants) < MIN_PARTICIPANTS:
+        await message.reply("Замало учасників для старту турніру!")
+        return
+    pairs = bracket.start()
+    # Далі сітку змінюють через базу (update_bracket), тож спершу - запис
+    await save_bracket(bracket)
+    await notify_bracket(
+        bracket,
+        f"Турнір {bracket.token} почався! Учасників: {len(bracket.participants)}, кіл: {len(bracket.rounds)}."
+    )
+    await launch_pairs(bracket.token, pairs)
+    logger.info(f"Tournament {bracket.token} started with {len(bracket.participants)} fighters")
+
+# Спаринг із ботом, якщо живого суперника не знайдено
+AI_SPARRING = os.getenv("AI_SPARRING", "1") == "1"
+
+async def prepare_ai_fighters():
+    if not AI_SPARRING:
+        return
+    try:
+        for fighter_type, (ai_id, ai_name) in AI_FIGHTERS.items():
+            # Тип бійця могли прибрати з rules.json (як у ai_opponent.build_all_policies)
+            if fighter_type not in rules.current.fighters:
+                logger.warning(f"AI fighter {ai_name} skipped: fighter type {fighter_type} is not in the rules")
+                continue
+            if not await db.get_user(ai_id):
+                await db.create_user(ai_id, None, ai_name)
+                nicknames.add(ai_name)
+                await db.set_fighter(ai_id, fighter_type, rules.current.fighters[fighter_type].stats())
+                logger.info(f"Created AI fighter {ai_name}")
+    except StorageError as e:
+        logger.error(f"Database error creating AI fighters: {e}")
+    # Політики рахуються в окремому потоці, щоб не блокувати цикл подій
+    run_in_background(asyncio.to_thread(build_all_policies))
+
+dp.startup.register(prepare_ai_fighters)
+
+async def start_ai_match(message: types.Message, user):
+    user_id = user["user_id"]
+    if await db.get_active_match_id(user_id):
+        await message.reply("Ти вже в матчі! Закінчи поточний бій.")
+        logger.debug(f"User {user_id} already in active match, AI sparring skipped")
+        return
+    fighter_type = random.choice(list(AI_FIGHTERS))
+    ai_id, ai_name = AI_FIGHTERS[fighter_type]
+    ai_user = await db.get_user(ai_id)
+    player_stats = await db.get_fighter_stats(user_id)
+    ai_stats = await db.get_fighter_stats(ai_id)
+    if not ai_user or not player_stats or not ai_stats:
+        await message.reply("Суперник не знайдений. Спробуй ще раз.")
+        logger.error(f"Missing data for AI match of user {user_id} vs {ai_id}")
+        return
+
+    match_id = await db.create_match(
+        user_id, ai_id,
+        player_stats["health"], player_stats["stamina"], ai_stats["health"], ai_stats["stamina"],
+        time.time() + rules.current.action_window, time.time() + rules.current.round_length
+    )
+    register_match_table(match_id, user, player_stats, ai_user, ai_stats)
+    await message.reply(
+        f"Суперник не знайдений, тому проведемо спаринг з ботом! Ти ({user['character_name']}, {user['fighter_type'].capitalize()}) "
+        f"проти {ai_name} ({fighter_type.capitalize()}). Дистанція: Далеко. Обери дію ({rules.current.action_window} секунд):",
+        reply_markup=get_fight_keyboard(match_id, "far", False)
+    )
+    logger.debug(f"Started AI match {match_id} for user {user_id} vs {ai_name}")
+
+# Дія бота у відповідь на дію гравця
+async def make_ai_move(match, player_num):
+    table = await get_match_table(match)
+    me, opponent = table.fighters[player_num - 1], table.fighters[2 - player_num]
+    policy = get_policy(me.fighter_type, opponent.fighter_type)
+    action = choose_action(
+        policy, match["distance"], player_num,
+        match[f"player{player_num}_health"], me.max_health, match[f"player{player_num}_stamina"]
+    )
+    return await db.set_player_action(match["match_id"], player_num, action)
+
+# Повідомлення гравцю; боту нічого не надсилаємо
+async def send_to_player(user_id, text, **kwargs):
+    if is_ai_player(user_id):
+        return
+    await bot.send_message(user_id, text, **kwargs)
+
+# Передраховані таблиці ймовірностей активних матчів цього шарду (див. fight_engine.py)
+match_tables = {}
+# user_id -> match_id гравців, що зараз б’ються (їхній досвід чекає кінця бою)
+active_players = {}
+
+# match - рядок з бази, якщо матч відновлюється, а не починається.
+# Чужий матч (див. owns_match) не запам’ятовується: його завершить власник,
+# а тут запис лишився б назавжди і потрапив би у знімок зупинки
+def register_match_table(match_id, player1, player1_stats, player2, player2_stats, match=None):
+    table = MatchTable(player1["character_name"], player1_stats, player2["character_name"], player2_stats)
+    if not owns_match(match_id):
+        return table
+    match_tables[match_id] = table
+    active_players[player1["user_id"]] = active_players[player2["user_id"]] = match_id
+    schedule_match_clock(match_id, table, match)
+    return table
+
+# Новий матч стартує з першого раунду; для відновленого терміни беруться з бази
+def schedule_match_clock(match_id, table, match=None):
+    now = time.time()
+    if match is None:
+        fight_clock.schedule(match_id, ACTION, now + table.rules.action_window)
+        fight_clock.schedule(match_id, ROUND_END, now + table.rules.round_length)
+    elif match["phase"] == "rest":
+        fight_clock.schedule(match_id, REST_END, match["round_ends_at"] or now)
+    else:
+        fight_clock.schedule(match_id, ACTION, match["action_deadline"] or now + table.rules.action_window)
+        fight_clock.schedule(match_id, ROUND_END, match["round_ends_at"] or now + table.rules.round_length)
+
+# Опис формату бою для повідомлень про старт
+def bout_text():
+    current = rules.current
+    return f"{current.rounds} раунди по {current.round_length} с, перерва {current.rest_interval} с"
+
+# Таблиця будується при старті матчу; тут - шлях для матчів, створених
+# іншим шардом, і після перезапуску
+async def get_match_table(match):
+    table = match_tables.get(match["match_id"])
+    if table is None:
+        player1, player2 = await db.get_user(match["player1_id"]), await db.get_user(match["player2_id"])
+        player1_stats = await db.get_fighter_stats(match["player1_id"])
+        player2_stats = await db.get_fighter_stats(match["player2_id"])
+        table = register_match_table(match["match_id"], player1, player1_stats, player2, player2_stats, match)
+    return table
 
 # Клавіатура для бою
 def get_fight_keyboard(match_id, distance, is_cornered):
@@ -738,29 +1764,24 @@ def get_fight_keyboard(match_id, distance, is_cornered):
 async def handle_fight_action(callback: types.CallbackQuery):
     logger.debug(f"Received fight action from user {callback.from_user.id}: {callback.data}")
     user_id = callback.from_user.id
-    callback_data = callback.data.split("_")
+    callback_data = callback.data.split("_", 2)
     match_id, action = int(callback_data[1]), callback_data[2]
-    
-    conn = sqlite3.connect("bot.db")
+
     try:
-        c = conn.cursor()
-        c.execute("SELECT player1_id, player2_id, player1_action, player2_action, status, action_deadline, distance FROM matches WHERE match_id = ?", (match_id,))
-        match = c.fetchone()
-        if not match or match[4] != "active":
+        match = await db.get_match(match_id)
+        if not match or match["status"] != "active":
             await callback.message.reply("Матч завершено або не існує.")
             logger.debug(f"Match {match_id} not active or does not exist")
             await callback.answer()
             return
-        
-        player1_id, player2_id, player1_action, player2_action, status, action_deadline, distance = match
-        
-        if time.time() > action_deadline:
-            await callback.message.reply("Час для дії минув! Раунд завершено автоматично.")
-            await process_round(match_id, timed_out=True)
-            logger.debug(f"Match {match_id} round timed out")
-            await callback.answer()
+
+        player1_id, player2_id, distance = match["player1_id"], match["player2_id"], match["distance"]
+
+        # Дедлайни відстежує fight_clock, тут лише перерва між раундами
+        if match["phase"] == "rest":
+            await callback.answer("Перерва між раундами! Зачекай на наступний раунд.")
             return
-        
+
         # Перевірка доступності дії залежно від дистанції
         if distance != "close" and action in ["uppercut", "hook"]:
             await callback.message.reply("На далекій дистанції доступний лише Джеб!")
@@ -782,93 +1803,80 @@ async def handle_fight_action(callback: types.CallbackQuery):
             logger.debug(f"Invalid action escape_corner for non-cornered state in match {match_id}")
             await callback.answer()
             return
-        
+
         # Збереження дії
         if user_id == player1_id:
-            c.execute("UPDATE matches SET player1_action = ? WHERE match_id = ?", (action, match_id))
+            actions = await db.set_player_action(match_id, 1, action)
         elif user_id == player2_id:
-            c.execute("UPDATE matches SET player2_action = ? WHERE match_id = ?", (action, match_id))
+            actions = await db.set_player_action(match_id, 2, action)
         else:
             await callback.message.reply("Ти не учасник цього матчу!")
             logger.debug(f"User {user_id} not in match {match_id}")
             await callback.answer()
             return
-        
-        conn.commit()
-        
-        c.execute("SELECT player1_action, player2_action FROM matches WHERE match_id = ?", (match_id,))
-        actions = c.fetchone()
-        if actions[0] and actions[1]:
+
+        ai_num = 2 if is_ai_player(player2_id) else 1 if is_ai_player(player1_id) else None
+        if ai_num and actions and not actions[f"player{ai_num}_action"]:
+            actions = await make_ai_move(match, ai_num)
+
+        if actions and actions["player1_action"] and actions["player2_action"]:
             await process_round(match_id)
-        
+
         await callback.answer()
         logger.debug(f"Processed fight action {action} for match {match_id} by user {user_id}")
-    except sqlite3.Error as e:
+    except StorageError as e:
         await callback.message.reply("Помилка обробки дії. Спробуй ще раз.")
         logger.error(f"Database error processing fight action for match {match_id}: {e}")
         await callback.answer()
-    finally:
-        conn.close()
 
 # Надсилання повідомлення про бій
 async def send_fight_message(match_id):
-    conn = sqlite3.connect("bot.db")
     try:
-        c = conn.cursor()
-        c.execute(
-            """SELECT player1_id, player2_id, player1_health, player1_stamina, player2_health, player2_stamina, current_round, distance
-            FROM matches WHERE match_id = ?""",
-            (match_id,)
-        )
-        match = c.fetchone()
+        match = await db.get_match(match_id)
         if not match:
             logger.debug(f"Match {match_id} not found for send_fight_message")
             return
-        
-        player1_id, player2_id, p1_health, p1_stamina, p2_health, p2_stamina, round_num, distance = match
-        c.execute("SELECT character_name, fighter_type FROM users WHERE user_id = ?", (player1_id,))
-        p1_name, p1_type = c.fetchone()
-        c.execute("SELECT character_name, fighter_type FROM users WHERE user_id = ?", (player2_id,))
-        p2_name, p2_type = c.fetchone()
-        c.execute("SELECT health FROM fighter_stats WHERE user_id = ?", (player1_id,))
-        p1_max_health = c.fetchone()[0]
-        c.execute("SELECT health FROM fighter_stats WHERE user_id = ?", (player2_id,))
-        p2_max_health = c.fetchone()[0]
-        
-        p1_status_text = get_status_text(p1_name, p1_type, p1_health, p1_stamina, p1_max_health)
-        p2_status_text = get_status_text(p2_name, p2_type, p2_health, p2_stamina, p2_max_health)
-        
+
+        player1_id, player2_id = match["player1_id"], match["player2_id"]
+        round_num, distance = match["current_round"], match["distance"]
+        table = await get_match_table(match)
+        p1, p2 = table.fighters
+        action_window = table.rules.action_window
+        p1_name, p1_type, p1_max_health = p1.name, p1.fighter_type, p1.max_health
+        p2_name, p2_type, p2_max_health = p2.name, p2.fighter_type, p2.max_health
+
+        p1_status_text = get_status_text(p1_name, p1_type, match["player1_health"], match["player1_stamina"], p1_max_health)
+        p2_status_text = get_status_text(p2_name, p2_type, match["player2_health"], match["player2_stamina"], p2_max_health)
+
         distance_text = {
             "far": "Далеко",
             "close": "Близько",
             "cornered_p1": f"{p1_name} у куті!",
             "cornered_p2": f"{p2_name} у куті!"
         }[distance]
-        
+
         is_p1_cornered = distance == "cornered_p1"
         is_p2_cornered = distance == "cornered_p2"
-        
+
         p1_keyboard = get_fight_keyboard(match_id, distance, is_p1_cornered)
         p2_keyboard = get_fight_keyboard(match_id, distance, is_p2_cornered)
-        
-        action_deadline = time.time() + 30
-        c.execute("UPDATE matches SET action_deadline = ?, player1_action = NULL, player2_action = NULL WHERE match_id = ?", (action_deadline, match_id))
-        conn.commit()
-        
-        await bot.send_message(
+
+        action_deadline = time.time() + action_window
+        await db.update_match(match_id, action_deadline=action_deadline, player1_action=None, player2_action=None)
+        fight_clock.schedule(match_id, ACTION, action_deadline)
+
+        await send_to_player(
             player1_id,
-            f"Раунд {round_num}\nДистанція: {distance_text}\n{p1_status_text}\n{p2_status_text}\nОбери дію (30 секунд):",
+            f"Раунд {round_num}\nДистанція: {distance_text}\n{p1_status_text}\n{p2_status_text}\nОбери дію ({action_window} секунд):",
             reply_markup=p1_keyboard
         )
-        await bot.send_message(
+        await send_to_player(
             player2_id,
-            f"Раунд {round_num}\nДистанція: {distance_text}\n{p2_status_text}\n{p1_status_text}\nОбери дію (30 секунд):",
+            f"Раунд {round_num}\nДистанція: {distance_text}\n{p2_status_text}\n{p1_status_text}\nОбери дію ({action_window} секунд):",
             reply_markup=p2_keyboard
         )
-    except (sqlite3.Error, TelegramBadRequest) as e:
+    except (StorageError, TelegramBadRequest) as e:
         logger.error(f"Error sending fight message for match {match_id}: {e}")
-    finally:
-        conn.close()
 
 # Формування тексту стану гравця
 def get_status_text(name, fighter_type, health, stamina, max_health):
@@ -876,21 +1884,18 @@ def get_status_text(name, fighter_type, health, stamina, max_health):
 
 # Завершення матчу
 async def end_match(match_id, loser_id, winner_id, p1_health, p2_health):
-    conn = sqlite3.connect("bot.db")
+    knockout = loser_id is not None
     try:
-        c = conn.cursor()
-        c.execute("SELECT player1_id, player2_id FROM matches WHERE match_id = ?", (match_id,))
-        match = c.fetchone()
+        match = await db.get_match(match_id)
         if not match:
+            forget_match(match_id)
             logger.error(f"Match {match_id} not found for end_match")
             return
-        
-        player1_id, player2_id = match
-        c.execute("SELECT character_name FROM users WHERE user_id = ?", (player1_id,))
-        p1_name = c.fetchone()[0]
-        c.execute("SELECT character_name FROM users WHERE user_id = ?", (player2_id,))
-        p2_name = c.fetchone()[0]
-        
+
+        player1_id, player2_id = match["player1_id"], match["player2_id"]
+        p1_name = (await db.get_user(player1_id))["character_name"]
+        p2_name = (await db.get_user(player2_id))["character_name"]
+
         if loser_id is None:  # Нічия за очками
             if p1_health > p2_health:
                 winner_id, loser_id = player1_id, player2_id
@@ -901,394 +1906,389 @@ async def end_match(match_id, loser_id, winner_id, p1_health, p2_health):
             else:
                 winner_id, loser_id = None, None
                 winner_name, loser_name = None, None
-                await bot.send_message(player1_id, "Матч закінчено! Нічия за очками.")
-                await bot.send_message(player2_id, "Матч закінчено! Нічия за очками.")
-                logger.debug(f"Match {match_id} ended in a draw")
         else:
             winner_name = p2_name if loser_id == player1_id else p1_name
             loser_name = p1_name if loser_id == player1_id else p2_name
-            await bot.send_message(winner_id, f"Вітаємо, {winner_name}! Ти переміг нокаутом!")
-            await bot.send_message(loser_id, f"{loser_name}, ти програв нокаутом.")
+
+        # Результат оголошує лише той, хто справді завершив матч у базі
+        finished = await db.finish_match(match_id, player1_id, player2_id)
+        forget_match(match_id)
+        if not finished:
+            logger.debug(f"Match {match_id} was already finished elsewhere")
+            return
+
+        if knockout:
+            await send_to_player(winner_id, f"Вітаємо, {winner_name}! Ти переміг нокаутом!")
+            await send_to_player(loser_id, f"{loser_name}, ти програв нокаутом.")
             logger.debug(f"Match {match_id} ended: {winner_name} defeated {loser_name} by knockout")
-        
-        c.execute("UPDATE matches SET status = 'finished' WHERE match_id = ?", (match_id,))
-        c.execute("DELETE FROM knockdowns WHERE match_id = ?", (match_id,))
-        c.execute("UPDATE rooms SET status = 'finished' WHERE creator_id = ? OR opponent_id = ?", (player1_id, player2_id))
-        conn.commit()
-    except (sqlite3.Error, TelegramBadRequest) as e:
+        elif winner_id is None:
+            await send_to_player(player1_id, "Матч закінчено! Нічия за очками.")
+            await send_to_player(player2_id, "Матч закінчено! Нічия за очками.")
+            logger.debug(f"Match {match_id} ended in a draw")
+        else:
+            await send_to_player(winner_id, f"Матч закінчено! Вітаємо, {winner_name}! Ти переміг за очками!")
+            await send_to_player(loser_id, f"Матч закінчено! {loser_name}, ти програв за очками.")
+            logger.debug(f"Match {match_id} ended: {winner_name} defeated {loser_name} on points")
+        await award_match_xp(player1_id, player2_id, winner_id, knockout)
+        if winner_name:
+            broadcast.finish(match_id, f"Бій {p1_name} vs {p2_name} завершено! Переміг {winner_name}.")
+        else:
+            broadcast.finish(match_id, f"Бій {p1_name} vs {p2_name} завершено! Нічия.")
+        await advance_tournament(match_id, winner_id, (player1_id, player2_id))
+    except (StorageError, TelegramBadRequest) as e:
         logger.error(f"Error ending match {match_id}: {e}")
-    finally:
-        conn.close()
+
+# Прибирання локального стану матчу, що завершився або зник з бази
+# (каскадне видалення акаунта) - інакше досвід гравців не зберігся б ніколи
+def forget_match(match_id):
+    match_tables.pop(match_id, None)
+    for player_id in [player_id for player_id, active_id in active_players.items() if active_id == match_id]:
+        del active_players[player_id]
+    fight_clock.cancel(match_id)
+    round_locks.pop(match_id, None)
+
+# Досвід за бій (див. progression.py): у базу потрапляє пачкою з flush_progress
+async def award_match_xp(player1_id, player2_id, winner_id, knockout):
+    players = [player_id for player_id in (player1_id, player2_id) if not is_ai_player(player_id)]
+    for player_id, xp in progression.match_awards(players, winner_id, knockout, rules.current).items():
+        progression.award(player_id, xp)
+        await send_to_player(player_id, f"Досвід за бій: +{xp}.")
 
 # Обробка нокдауну
 async def handle_knockdown(match_id, player_id, opponent_id, player_name, opponent_name):
     logger.debug(f"Player {player_name} in knockdown for match {match_id}")
-    conn = sqlite3.connect("bot.db")
+    p1_health, p2_health = 0, 0
     try:
-        c = conn.cursor()
-        c.execute("SELECT will FROM fighter_stats WHERE user_id = ?", (player_id,))
-        will = c.fetchone()[0]
-        c.execute("SELECT health FROM fighter_stats WHERE user_id = ?", (player_id,))
-        max_health = c.fetchone()[0]
-        c.execute("SELECT player1_id, player1_health, player1_stamina, player2_id, player2_health, player2_stamina FROM matches WHERE match_id = ?", (match_id,))
-        match = c.fetchone()
-        p1_id, p1_health, p1_stamina, p2_id, p2_health, p2_stamina = match
-        
-        await bot.send_message(player_id, f"Ти впав! Чи зможеш встати?")
-        await bot.send_message(opponent_id, f"{player_name} впав! Чи встане він?")
-        
+        match = await db.get_match(match_id)
+        p1_id = match["player1_id"]
+        # Характеристики з таблиці матчу: вони не змінюються до кінця бою
+        fighter = (await get_match_table(match)).fighters[0 if player_id == p1_id else 1]
+        will, max_health = fighter.will, fighter.max_health
+        p1_health, p1_stamina = match["player1_health"], match["player1_stamina"]
+        p2_health, p2_stamina = match["player2_health"], match["player2_stamina"]
+
+        await send_to_player(player_id, f"Ти впав! Чи зможеш встати?")
+        await send_to_player(opponent_id, f"{player_name} впав! Чи встане він?")
+        broadcast.publish(match_id, f"{player_name} впав! Чи встане він?")
+
         # Формула шансу вставання: 0.4 * will
         stand_chance = min(0.8, 0.4 * will)
         if random.random() < stand_chance:
             if player_id == p1_id:
                 p1_health = max(0.2 * max_health, p1_health)
                 p1_stamina = min(p1_stamina + 40, 100)
-                c.execute(
-                    "UPDATE matches SET player1_health = ?, player1_stamina = ? WHERE match_id = ?",
-                    (p1_health, p1_stamina, match_id)
-                )
+                await db.update_match(match_id, player1_health=p1_health, player1_stamina=p1_stamina)
             else:
                 p2_health = max(0.2 * max_health, p2_health)
                 p2_stamina = min(p2_stamina + 40, 100)
-                c.execute(
-                    "UPDATE matches SET player2_health = ?, player2_stamina = ? WHERE match_id = ?",
-                    (p2_health, p2_stamina, match_id)
-                )
-            c.execute("DELETE FROM knockdowns WHERE match_id = ? AND player_id = ?", (match_id, player_id))
-            conn.commit()
-            await bot.send_message(
+                await db.update_match(match_id, player2_health=p2_health, player2_stamina=p2_stamina)
+            await db.delete_knockdown(match_id, player_id)
+            await send_to_player(
                 player_id,
                 f"Ти встав після нокдауну! Здоров’я: {p1_health if player_id == p1_id else p2_health:.1f}, Енергія: {p1_stamina if player_id == p1_id else p2_stamina:.1f}"
             )
-            await bot.send_message(
+            await send_to_player(
                 opponent_id,
                 f"{player_name} встав після нокдауну! Продовжуємо бій!"
             )
+            broadcast.publish(match_id, f"{player_name} встав після нокдауну! Продовжуємо бій!")
             await send_fight_message(match_id)
             logger.debug(f"Player {player_name} stood up after knockdown in match {match_id}")
             return
-        
-        c.execute("DELETE FROM knockdowns WHERE match_id = ? AND player_id = ?", (match_id, player_id))
-        conn.commit()
+
+        await db.delete_knockdown(match_id, player_id)
         await end_match(match_id, player_id, opponent_id, p1_health, p2_health)
         logger.debug(f"Player {player_name} failed to stand up, match {match_id} ended")
-    except (sqlite3.Error, TelegramBadRequest) as e:
+    except (StorageError, TelegramBadRequest) as e:
         logger.error(f"Error handling knockdown for match {match_id}: {e}")
-        await bot.send_message(player_id, "Помилка обробки нокдауну. Матч завершено.")
-        await bot.send_message(opponent_id, "Помилка обробки нокдауну. Матч завершено.")
+        await send_to_player(player_id, "Помилка обробки нокдауну. Матч завершено.")
+        await send_to_player(opponent_id, "Помилка обробки нокдауну. Матч завершено.")
         await end_match(match_id, None, None, p1_health, p2_health)
-    finally:
-        conn.close()
-        # Обробка раунду
+
+# Обробка раунду. У режимі FIGHT_ENGINE_MODE=tick обміни не рахуються одразу,
+# а збираються в pending_rounds і розв’язуються пачкою (див. resolve_pending_rounds)
+FIGHT_ENGINE_MODE = os.getenv("FIGHT_ENGINE_MODE", "inline")
+ROUND_TICK_INTERVAL = 0.1
+# match_id -> timed_out
+pending_rounds = {}
+
 async def process_round(match_id, timed_out=False):
-    conn = sqlite3.connect("bot.db")
+    if FIGHT_ENGINE_MODE == "tick":
+        pending_rounds[match_id] = pending_rounds.get(match_id, False) or timed_out
+        return
+    async with match_lock(match_id):
+        await resolve_match_round(match_id, timed_out)
+
+def round_is_due(match, timed_out):
+    if not match or match["status"] != "active" or match["phase"] != "fight":
+        return False
+    if timed_out and match["action_deadline"] > time.time():
+        # Дедлайн уже перенесено, поки таймер чекав на блокування
+        return False
+    return timed_out or bool(match["player1_action"] and match["player2_action"])
+
+# Розрахунок обміну без звернень до бази: повертає результат, текст і дії
+def compute_round(match, table, timed_out):
+    p1_action, p2_action = match["player1_action"], match["player2_action"]
+    p1_health, p2_health = match["player1_health"], match["player2_health"]
+    round_num = match["current_round"]
+    p1_name, p2_name = table.fighters[0].name, table.fighters[1].name
+
+    result_text = f"Раунд {round_num}\n"
+
+    if timed_out:
+        if not p1_action and not p2_action:
+            result_text += "Час минув! Обидва гравці відпочивають.\n"
+        else:
+            late_name = p2_name if p1_action else p1_name
+            result_text += f"Час минув! {late_name} не встиг обрати дію і відпочиває.\n"
+        p1_action = p1_action or "rest"
+        p2_action = p2_action or "rest"
+
+    logger.debug(f"Before round {round_num} for match {match['match_id']}: {p1_name} {p1_health:.1f} hp, {p1_action}; {p2_name} {p2_health:.1f} hp, {p2_action}")
+    result = resolve_round(
+        table, match["distance"],
+        (p1_health, p2_health), (match["player1_stamina"], match["player2_stamina"]),
+        (p1_action, p2_action)
+    )
+    result_text += "\n".join(result.text)
+    logger.debug(f"After round {round_num} for match {match['match_id']}: {p1_name} {result.health[0]:.1f} hp, {p2_name} {result.health[1]:.1f} hp")
+    return result, result_text, (p1_action, p2_action)
+
+# Рядок для round_events (порядок storage.ROUND_EVENT_COLUMNS)
+def round_event(match, actions, result):
+    (p1_health, p2_health), (p1_stamina, p2_stamina) = result.health, result.stamina
+    return (
+        match["match_id"], match["current_round"], time.time(), match["distance"], *actions,
+        p1_health, p1_stamina, p2_health, p2_stamina
+    )
+
+async def announce_round(match, table, result, result_text):
+    match_id = match["match_id"]
+    player1_id, player2_id = match["player1_id"], match["player2_id"]
+    p1_name, p2_name = table.fighters[0].name, table.fighters[1].name
+    p1_health, p2_health = result.health
+
+    p1_action_result, p2_action_result = result.action_results
+    await send_to_player(player1_id, f"{result_text}\n{p1_action_result}".rstrip())
+    await send_to_player(player2_id, f"{result_text}\n{p2_action_result}".rstrip())
+    broadcast.publish(
+        match_id,
+        f"{p1_name} vs {p2_name}. {result_text}\n"
+        f"{p1_name}: {max(0, p1_health):.1f} hp, {p2_name}: {max(0, p2_health):.1f} hp"
+    )
+
+    # Нокдаун, якщо здоров’я закінчилось
+    if p1_health <= 0:
+        await db.add_knockdown(match_id, player1_id, time.time() + table.rules.knockdown_count)
+        await handle_knockdown(match_id, player1_id, player2_id, p1_name, p2_name)
+        return
+    if p2_health <= 0:
+        await db.add_knockdown(match_id, player2_id, time.time() + table.rules.knockdown_count)
+        await handle_knockdown(match_id, player2_id, player1_id, p2_name, p1_name)
+        return
+
+    await send_fight_message(match_id)
+
+async def resolve_match_round(match_id, timed_out):
     try:
-        c = conn.cursor()
-        c.execute(
-            """SELECT player1_id, player2_id, player1_action, player2_action, player1_health, player1_stamina,
-            player2_health, player2_stamina, current_round, start_time, distance FROM matches WHERE match_id = ?""",
-            (match_id,)
-        )
-        match = c.fetchone()
-        if not match:
-            logger.error(f"Match {match_id} not found for process_round")
+        match = await db.get_match(match_id)
+        if not round_is_due(match, timed_out):
+            logger.debug(f"Match {match_id} has no round to resolve, skipping process_round")
             return
-    except sqlite3.Error as e:
-        logger.error(f"Database error processing round for match {match_id}: {e}")
+        table = await get_match_table(match)
+        result, result_text, actions = compute_round(match, table, timed_out)
+        (p1_health, p2_health), (p1_stamina, p2_stamina) = result.health, result.stamina
+        await db.update_match(
+            match_id,
+            player1_health=p1_health, player1_stamina=p1_stamina,
+            player2_health=p2_health, player2_stamina=p2_stamina,
+            distance=result.distance, player1_action=None, player2_action=None
+        )
+        metrics.rounds.add()
+        round_events.append(round_event(match, actions, result))
+        await announce_round(match, table, result, result_text)
+    except (StorageError, TelegramBadRequest) as e:
+        logger.error(f"Error processing round for match {match_id}: {e}")
+
+# Пакетний режим: раз на ROUND_TICK_INTERVAL усі готові матчі читаються одним
+# запитом, рахуються підряд і записуються (разом з round_events) однією
+# транзакцією. Повідомлення гравцям розсилаються вже після коміту.
+async def resolve_pending_rounds():
+    global pending_rounds
+    batch, pending_rounds = pending_rounds, {}
+    # Матч, зайнятий кінцем раунду чи нокдауном, чекає наступного тіку
+    locks = []
+    for match_id in list(batch):
+        lock = match_lock(match_id)
+        if lock.locked():
+            pending_rounds[match_id] = batch.pop(match_id)
+            continue
+        await lock.acquire()
+        locks.append(lock)
+    resolved = []
+    try:
+        matches = await db.get_matches(list(batch))
+        updates, events = [], []
+        for match in matches:
+            timed_out = batch[match["match_id"]]
+            if not round_is_due(match, timed_out):
+                continue
+            table = await get_match_table(match)
+            result, result_text, actions = compute_round(match, table, timed_out)
+            (p1_health, p2_health), (p1_stamina, p2_stamina) = result.health, result.stamina
+            updates.append((p1_health, p1_stamina, p2_health, p2_stamina, result.distance, match["match_id"]))
+            events.append(round_event(match, actions, result))
+            resolved.append((match, table, result, result_text))
+        if updates:
+            await db.save_round_results(updates, events)
+            metrics.rounds.add(len(updates))
+    except StorageError as e:
+        # Дії гравців лишились у базі, тож пачка повториться на наступному тіку
+        logger.error(f"Database error resolving {len(batch)} rounds: {e}")
+        for match_id, timed_out in batch.items():
+            pending_rounds[match_id] = pending_rounds.get(match_id, False) or timed_out
+        resolved = []
     finally:
-        conn.close()    
-        player1_id, player2_id, p1_action, p2_action, p1_health, p1_stamina, p2_health, p2_stamina, round_num, start_time, distance = match
-        
-        c.execute("SELECT character_name, fighter_type FROM users WHERE user_id = ?", (player1_id,))
-        p1_name, p1_type = c.fetchone()
-        c.execute("SELECT character_name, fighter_type FROM users WHERE user_id = ?", (player2_id,))
-        p2_name, p2_type = c.fetchone()
-        
-        c.execute("SELECT strength, reaction, punch_speed, stamina, health, will, footwork FROM fighter_stats WHERE user_id = ?", (player1_id,))
-        p1_stats = c.fetchone()
-        p1_strength, p1_reaction, p1_punch_speed, p1_stamina_stat, p1_max_health, p1_will, p1_footwork = p1_stats
-        c.execute("SELECT strength, reaction, punch_speed, stamina, health, will, footwork FROM fighter_stats WHERE user_id = ?", (player2_id,))
-        p2_stats = c.fetchone()
-        p2_strength, p2_reaction, p2_punch_speed, p2_stamina_stat, p2_max_health, p2_will, p2_footwork = p2_stats
-        
-        if time.time() > start_time + 180:
-            await end_match(match_id, None, None, p1_health, p2_health)
-            logger.debug(f"Match {match_id} ended due to time limit")
-            return
-        
-        result_text = f"Раунд {round_num}\n"
-        
-        if timed_out:
-            p1_action = "rest"
-            p2_action = "rest"
-            result_text += "Час минув! Обидва гравці відпочивають.\n"
-        
-        attack_params = {
-            "jab": {"base_damage": 10, "stamina_cost": 6, "base_hit_chance": 0.9},
-            "uppercut": {"base_damage": 25, "stamina_cost": 19, "base_hit_chance": 0.6},
-            "hook": {"base_damage": 19, "stamina_cost": 15, "base_hit_chance": 0.75}
-        }
-        
-        p1_action_result = ""
-        p2_action_result = ""
-        new_distance = distance
-        
-        logger.debug(f"Before round {round_num} for match {match_id}:")
-        logger.debug(f"Player 1 ({p1_name}) health: {p1_health:.1f}/{p1_max_health:.1f}, stamina: {p1_stamina:.1f}, action: {p1_action}")
-        logger.debug(f"Player 2 ({p2_name}) health: {p2_health:.1f}/{p2_max_health:.1f}, stamina: {p2_stamina:.1f}, action: {p2_action}")
-        
-        # Обробка дій руху
-        if p1_action == "move_closer" and random.random() < 0.4 * p1_footwork:
-            new_distance = "close"
-            result_text += f"{p1_name} наближається до {p2_name}!\n"
-            p1_action_result = "Ти наблизився!"
-            p1_stamina -= 5
-        elif p1_action == "move_away":
-            if random.random() < 0.1:
-                new_distance = "cornered_p1"
-                result_text += f"{p1_name} відступає, але потрапляє в кут!\n"
-                p1_action_result = "Ти потрапив у кут!"
-            elif random.random() < 0.4 * p1_footwork:
-                new_distance = "far"
-                result_text += f"{p1_name} відступає від {p2_name}!\n"
-                p1_action_result = "Ти відступив!"
-            else:
-                result_text += f"{p1_name} не вдалося відступити!\n"
-                p1_action_result = "Відступ не вдався!"
-            p1_stamina -= 5
-        elif p1_action == "escape_corner" and distance == "cornered_p1":
-            escape_chance = (p1_health / p1_max_health * p1_footwork) / 3
-            logger.debug(f"Player 1 escape chance: {escape_chance:.2f}")
-            if random.random() < escape_chance:
-                new_distance = "far"
-                result_text += f"{p1_name} виходить із кута!\n"
-                p1_action_result = "Ти вийшов із кута!"
-            else:
-                result_text += f"{p1_name} не зміг вийти з кута!\n"
-                p1_action_result = "Не вдалося вийти з кута!"
-            p1_stamina -= 10
-        
-        if p2_action == "move_closer" and random.random() < 0.4 * p2_footwork:
-            new_distance = "close"
-            result_text += f"{p2_name} наближається до {p1_name}!\n"
-            p2_action_result = "Ти наблизився!"
-            p2_stamina -= 5
-        elif p2_action == "move_away":
-            if random.random() < 0.1:
-                new_distance = "cornered_p2"
-                result_text += f"{p2_name} відступає, але потрапляє в кут!\n"
-                p2_action_result = "Ти потрапив у кут!"
-            elif random.random() < 0.4 * p2_footwork:
-                new_distance = "far"
-                result_text += f"{p2_name} відступає від {p1_name}!\n"
-                p2_action_result = "Ти відступив!"
-            else:
-                result_text += f"{p2_name} не вдалося відступити!\n"
-                p2_action_result = "Відступ не вдався!"
-            p2_stamina -= 5
-        elif p2_action == "escape_corner" and distance == "cornered_p2":
-            escape_chance = (p2_health / p2_max_health * p2_footwork) / 3
-            logger.debug(f"Player 2 escape chance: {escape_chance:.2f}")
-            if random.random() < escape_chance:
-                new_distance = "far"
-                result_text += f"{p2_name} виходить із кута!\n"
-                p2_action_result = "Ти вийшов із кута!"
-            else:
-                result_text += f"{p2_name} не зміг вийти з кута!\n"
-                p2_action_result = "Не вдалося вийти з кута!"
-            p2_stamina -= 10
-        
-        # Обробка дії Гравця 1
-        if p1_action in attack_params:
-            params = attack_params[p1_action]
-            if p1_action == "jab":
-                hit_chance = min(0.95, (0.75 * p1_reaction * p1_punch_speed) / 1.7)
-            else:  # hook або uppercut
-                hit_chance = min(0.95, (params["base_hit_chance"] * p1_punch_speed * p1_strength) / 1.7)
-            if new_distance == "cornered_p2":
-                hit_chance *= 1.1
-            p1_stamina -= params["stamina_cost"]
-            if p2_action not in ["dodge", "block"] and random.random() < hit_chance:
-                if p1_action == "jab":
-                    damage = params["base_damage"] * p1_punch_speed
-                    logger.debug(f"Calculating jab damage for {p1_name}: {params['base_damage']} * {p1_punch_speed} = {damage}")
-                elif p1_action == "uppercut" and p2_action == "rest":
-                    damage = 2 * params["base_damage"] * p1_strength
-                    logger.debug(f"Calculating uppercut damage for {p1_name} (rest): 2 * {params['base_damage']} * {p1_strength} = {damage}")
-                else:
-                    damage = params["base_damage"] * p1_strength
-                    logger.debug(f"Calculating {p1_action} damage for {p1_name}: {params['base_damage']} * {p1_strength} = {damage}")
-                if new_distance == "cornered_p2":
-                    damage *= 1.5
-                    logger.debug(f"Cornered bonus for {p1_name}: {damage} * 1.5 = {damage}")
-                if p2_action == "move_away":
-                    damage /= 4
-                    result_text += f"{p1_name} завдає {p1_action} по {p2_name}, але той відступає! Урон: {damage:.1f}\n"
-                else:
-                    result_text += f"{p1_name} завдає {p1_action} по {p2_name}! Урон: {damage:.1f}\n"
-                p2_health -= damage
-                p2_stamina -= damage / 10
-                p1_action_result = "Ти влучив!"
-                logger.debug(f"Player 1 dealt {damage:.1f} damage to Player 2 with {p1_action}, reduced stamina by {damage/10:.1f}")
-            elif p2_action == "block":
-                block_success_chance = min(0.8, (0.4 * p2_strength) * (p2_health / p2_max_health))
-                p2_stamina -= 5
-                if p1_action == "hook":
-                    damage_multiplier = 1.5
-                    logger.debug(f"Hook bonus against block for {p1_name}: damage * {damage_multiplier}")
-                else:
-                    damage_multiplier = 1
-                if random.random() < block_success_chance:
-                    damage = 0.05 * params["base_damage"] * p1_strength * damage_multiplier
-                    result_text += f"{p1_name} завдає {p1_action}, але {p2_name} успішно блокує! Урон: {damage:.1f}\n"
-                    p1_action_result = "Ти влучив, але суперник успішно заблокував!"
-                    p2_action_result = "Ти успішно заблокував!"
-                    p2_health -= damage
-                    p2_stamina -= damage / 10
-                    logger.debug(f"Player 2 blocked, reduced damage: {damage:.1f}, stamina: {damage/10:.1f}")
-                else:
-                    damage = 0.5 * params["base_damage"] * p1_strength * damage_multiplier
-                    if p1_action == "uppercut":
-                        damage *= 2
-                        logger.debug(f"Uppercut bonus for {p1_name} (failed block): {damage} * 2 = {damage}")
-                    if new_distance == "cornered_p2":
-                        damage *= 1.5
-                        logger.debug(f"Cornered bonus for {p1_name}: {damage} * 1.5 = {damage}")
-                    result_text += f"{p1_name} завдає {p1_action}, але {p2_name} невдало блокує! Урон: {damage:.1f}\n"
-                    p1_action_result = "Ти влучив, суперник невдало заблокував!"
-                    p2_action_result = "Твій блок провалився!"
-                    p2_health -= damage
-                    p2_stamina -= damage / 10
-                    logger.debug(f"Player 2 failed block, damage: {damage:.1f}, stamina: {damage/10:.1f}")
-            elif p2_action == "dodge":
-                dodge_chance = min(0.8, 0.4 * p2_reaction * p2_punch_speed)
-                p2_stamina -= 10
-                if random.random() < dodge_chance:
-                    result_text += f"{p1_name} завдає {p1_action}, але {p2_name} ухилився!\n"
-                    p1_action_result = "Ти промахнувся!"
-                    p2_action_result = "Ти ухилився!"
-                    logger.debug(f"Player 2 dodged Player 1's {p1_action}")
-                else:
-                    if p1_action == "jab":
-                        damage = params["base_damage"] * p1_punch_speed
-                        logger.debug(f"Calculating jab damage for {p1_name} (failed dodge): {params['base_damage']} * {p1_punch_speed} = {damage}")
-                    elif p1_action == "uppercut":
-                        damage = 2 * params["base_damage"] * p1_strength
-                        logger.debug(f"Calculating uppercut damage for {p1_name} (failed dodge): 2 * {params['base_damage']} * {p1_strength} = {damage}")
-                    else:
-                        damage = params["base_damage"] * p1_strength
-                        logger.debug(f"Calculating {p1_action} damage for {p1_name} (failed dodge): {params['base_damage']} * {p1_strength} = {damage}")
-                    if new_distance == "cornered_p2":
-                        damage *= 1.5
-                        logger.debug(f"Cornered bonus for {p1_name}: {damage} * 1.5 = {damage}")
-                    p2_health -= damage
-                    p2_stamina -= damage / 10
-                    result_text += f"{p1_name} завдає {p1_action} по {p2_name}! Ухилення не вдалося. Урон: {damage:.1f}\n"
-                    p1_action_result = "Ти влучив!"
-                    p2_action_result = "Ухилення не вдалося!"
-                    logger.debug(f"Player 2 failed dodge, damage: {damage:.1f}, stamina: {damage/10:.1f}")
-        elif p1_action == "dodge":
-            p1_stamina -= 10
-            result_text += f"{p1_name} намагається ухилитися.\n"
-            p1_action_result = "Ти намагався ухилитися."
-            logger.debug(f"Player 1 attempted dodge")
-        elif p1_action == "block":
-            p1_stamina -= 5
-            result_text += f"{p1_name} блокує.\n"
-            p1_action_result = "Ти блокуєш."
-            logger.debug(f"Player 1 blocked")
-        elif p1_action == "rest":
-            p1_stamina = min(p1_stamina + 30 * p1_stamina_stat, 100)
-            result_text += f"{p1_name} відпочиває.\n"
-            p1_action_result = "Ти відпочиваєш."
-            logger.debug(f"Player 1 rested, stamina: {p1_stamina:.1f}")
-        
-        # Обробка дії Гравця 2
-        if p2_action in attack_params:
-            params = attack_params[p2_action]
-            if p2_action == "jab":
-                hit_chance = min(0.95, (0.75 * p2_reaction * p2_punch_speed) / 1.7)
-            else:  # hook або uppercut
-                hit_chance = min(0.95, (params["base_hit_chance"] * p2_punch_speed * p2_strength) / 1.7)
-            if new_distance == "cornered_p1":
-                hit_chance *= 1.1
-            p2_stamina -= params["stamina_cost"]
-            if p1_action not in ["dodge", "block"] and random.random() < hit_chance:
-                if p2_action == "jab":
-                    damage = params["base_damage"] * p2_punch_speed
-                    logger.debug(f"Calculating jab damage for {p2_name}: {params['base_damage']} * {p2_punch_speed} = {damage}")
-                elif p2_action == "uppercut" and p1_action == "rest":
-                    damage = 2 * params["base_damage"] * p2_strength
-                    logger.debug(f"Calculating uppercut damage for {p2_name} (rest): 2 * {params['base_damage']} * {p2_strength} = {damage}")
-                else:
-                    damage = params["base_damage"] * p2_strength
-                    logger.debug(f"Calculating {p2_action} damage for {p2_name}: {params['base_damage']} * {p2_strength} = {damage}")
-                if new_distance == "cornered_p1":
-                    damage *= 1.5
-                    logger.debug(f"Cornered bonus for {p2_name}: {damage} * 1.5 = {damage}")
-                if p1_action == "move_away":
-                    damage /= 4
-                    result_text += f"{p2_name} завдає {p2_action} по {p1_name}, але той відступає! Урон: {damage:.1f}\n"
-                else:
-                    result_text += f"{p2_name} завдає {p2_action} по {p1_name}! Урон: {damage:.1f}\n"
-                p1_health -= damage
-                p1_stamina -= damage / 10
-                p2_action_result = "Ти влучив!"
-                logger.debug(f"Player 2 dealt {damage:.1f} damage to Player 1 with {p2_action}, reduced stamina by {damage/10:.1f}")
-            elif p1_action == "block":
-                block_success_chance = min(0.8, (0.4 * p1_strength) * (p1_health / p1_max_health))
-                p1_stamina -= 5
-                if p2_action == "hook":
-                    damage_multiplier = 1.5
-                    logger.debug(f"Hook bonus against block for {p2_name}: damage * {damage_multiplier}")
-                else:
-                    damage_multiplier = 1
-                if random.random() < block_success_chance:
-                    damage = 0.05 * params["base_damage"] * p2_strength * damage_multiplier
-                    result_text += f"{p2_name} завдає {p2_action}, але {p1_name} успішно блокує! Урон: {damage:.1f}\n"
-                    p2_action_result = "Ти влучив, але суперник успішно заблокував!"
-                    p1_action_result = "Ти успішно заблокував!"
-                    p1_health -= damage
-                    p1_stamina -= damage / 10
-                    logger.debug(f"Player 1 blocked, reduced damage: {damage:.1f}, stamina: {damage/10:.1f}")
-                else:
-                    damage = 0.5 * params["base_damage"] * p2_strength * damage_multiplier
-                    if p2_action == "uppercut":
-                        damage *= 2
-                        logger.debug(f"Uppercut bonus for {p2_name} (failed block): {damage} * 2 = {damage}")
-                    if new_distance == "cornered_p1":
-                        damage *= 1.5
-                        logger.debug(f"Cornered bonus for {p2_name}: {damage} * 1.5 = {damage}")
-                    result_text += f"{p2_name} завдає {p2_action}, але {p1_name} невдало блокує! Урон: {damage:.1f}\n"
-                    p2_action_result = "Ти влучив, суперник невдало заблокував!"
-                    p1_action_result = "Твій блок провалився!"
-                    p1_health -= damage
-                    p1_stamina -= damage / 10
-                    logger.debug(f"Player 1 failed block, damage: {damage:.1f}, stamina: {damage/10:.1f}")
-            elif p1_action == "dodge":
-                dodge_chance = min(0.8, 0.4 * p1_reaction * p1_punch_speed)
-                p1_stamina -= 10
-                if random.random() < dodge_chance:
-                    result_text += f"{p2_name} завдає {p2_action}, але {p1_name} ухилився!\n"
-                    p2_action_result = "Ти промахнувся!"
-                    p1_action_result = "Ти ухилився!"
-                    logger.debug(f"Player 1 dodged Player 2's {p2_action}")
-                else:
-                    if p2_action == "jab":
-                        damage = params["base_damage"] * p2_punch_speed
-                        logger.debug(f"Calculating jab damage for {p2_name} (failed dodge): {params['base_damage']} * {p2_punch_speed} = {damage}")
-                    elif p2_action == "uppercut":
-                        damage = 2 * params["base_damage"] * p2_strength
-                        logger.debug(f"Calculating uppercut damage for {p2_name} (failed dodge): 2 * {params['base_damage']} * {p2_strength} = {damage}")
-                    else:
-                        damage = params["base_damage"] * p2_strength
-                        logger.debug(f"Calculating {p2_action} damage for {p2_name} (failed dodge): {params['base_damage']} * {p2_strength} = {damage}")
-                    if new_distance == "cornered_p1":
-                        damage *= 1.5
-                        logger.debug(f"Cornered bonus for {p2_name}: {damage} * 1.5 = {damage}")
-                    p1_health -= damage
-                    p1_stamina -= damage / 10
-                    result_text += f"{p2_name} завдає {p2_action} по {p1_name}! Ухилення не вдалося. Урон: {damage:.1f}\n"
-                    p2_action_result = "Ти влучив!"
-                    p1_action_result = "Ухилення не вдалося!"
-                    logger.debug(f"Player 1 failed dodge, damage: {damage:.1f}, stamina: {damage/10:.1f}")
\ No newline at end of file
+        for lock in locks:
+            lock.release()
+    for match, table, result, result_text in resolved:
+        run_in_background(announce_round_locked(match, table, result, result_text))
+
+async def announce_round_locked(match, table, result, result_text):
+    async with match_lock(match["match_id"]):
+        try:
+            await announce_round(match, table, result, result_text)
+        except (StorageError, TelegramBadRequest) as e:
+            logger.error(f"Error announcing round for match {match['match_id']}: {e}")
+
+async def round_tick_loop():
+    while True:
+        await asyncio.sleep(ROUND_TICK_INTERVAL)
+        if pending_rounds:
+            await resolve_pending_rounds()
+
+async def start_round_ticker():
+    if FIGHT_ENGINE_MODE == "tick":
+        logger.info(f"Fight engine resolves rounds every {ROUND_TICK_INTERVAL}s")
+        run_in_background(round_tick_loop())
+
+dp.startup.register(start_round_ticker)
+
+# Раунди і перерви (див. fight_clock.py). Усі зміни стану матчу, які
+# ініціюють гравці або таймер, проходять під блокуванням матчу.
+round_locks = {}
+
+def match_lock(match_id):
+    lock = round_locks.get(match_id)
+    if lock is None:
+        lock = round_locks[match_id] = asyncio.Lock()
+    return lock
+
+async def on_clock(match_id, kind):
+    if kind == ACTION:
+        await process_round(match_id, timed_out=True)
+    elif kind == ROUND_END:
+        await end_round(match_id)
+    elif kind == REST_END:
+        await start_next_round(match_id)
+
+async def end_round(match_id):
+    async with match_lock(match_id):
+        try:
+            match = await db.get_match(match_id)
+            if not match or match["status"] != "active":
+                forget_match(match_id)
+                return
+            if match["phase"] != "fight":
+                return
+            table = await get_match_table(match)
+            round_num = match["current_round"]
+            if round_num >= table.rules.rounds:
+                await end_match(match_id, None, None, match["player1_health"], match["player2_health"])
+                logger.debug(f"Match {match_id} ended after the last round")
+                return
+
+            rest_ends_at = time.time() + table.rules.rest_interval
+            # Під час перерви round_ends_at зберігає її кінець
+            await db.update_match(
+                match_id, phase="rest", round_ends_at=rest_ends_at, player1_action=None, player2_action=None
+            )
+            fight_clock.cancel(match_id, ACTION)
+            fight_clock.schedule(match_id, REST_END, rest_ends_at)
+            text = f"Раунд {round_num} завершено! Перерва {table.rules.rest_interval} секунд, бійці відновлюють сили."
+            await send_to_player(match["player1_id"], text)
+            await send_to_player(match["player2_id"], text)
+            broadcast.publish(match_id, text)
+            logger.debug(f"Match {match_id}: round {round_num} finished, resting")
+        except (StorageError, TelegramBadRequest) as e:
+            logger.error(f"Error ending round for match {match_id}: {e}")
+
+async def start_next_round(match_id):
+    async with match_lock(match_id):
+        try:
+            match = await db.get_match(match_id)
+            if not match or match["status"] != "active":
+                forget_match(match_id)
+                return
+            if match["phase"] != "rest":
+                return
+            table = await get_match_table(match)
+            recovery = table.rules.rest_recovery
+            round_ends_at = time.time() + table.rules.round_length
+            await db.update_match(
+                match_id,
+                phase="fight",
+                current_round=match["current_round"] + 1,
+                round_ends_at=round_ends_at,
+                player1_stamina=min(100, match["player1_stamina"] + recovery),
+                player2_stamina=min(100, match["player2_stamina"] + recovery)
+            )
+            fight_clock.schedule(match_id, ROUND_END, round_ends_at)
+            await send_fight_message(match_id)
+            logger.debug(f"Match {match_id}: round {match['current_round'] + 1} started")
+        except (StorageError, TelegramBadRequest) as e:
+            logger.error(f"Error starting next round for match {match_id}: {e}")
+
+fight_clock = FightClock(on_clock)
+
+async def start_fight_clock():
+    run_in_background(fight_clock.run())
+
+dp.startup.register(start_fight_clock)
+
+# У багатопроцесному режимі шард-власник знаходить у базі матчі, створені
+# іншими шардами, і ставить їм таймери з дедлайнів, записаних при створенні
+MATCH_DISCOVERY_INTERVAL = 1.0
+
+async def discover_matches():
+    for match_id in await db.get_active_match_ids(SHARD_ID, SHARD_COUNT):
+        if match_id in match_tables:
+            continue
+        async with match_lock(match_id):
+            match = await db.get_match(match_id)
+            if not match or match["status"] != "active":
+                round_locks.pop(match_id, None)
+            elif match_id not in match_tables:
+                await get_match_table(match)
+                logger.debug(f"Shard {SHARD_ID} took over match {match_id}")
+
+async def match_discovery_loop():
+    while True:
+        await asyncio.sleep(MATCH_DISCOVERY_INTERVAL)
+        try:
+            await discover_matches()
+        except StorageError as e:
+            logger.error(f"Database error discovering matches: {e}")
+
+async def start_match_discovery():
+    if SHARD_COUNT > 1:
+        run_in_background(match_discovery_loop())
+
+dp.startup.register(start_match_discovery)
+
+# Останній startup-хук: усе, що вище, вже виконано
+async def log_startup_time():
+    logger.info(f"Startup finished in {time.perf_counter() - startup_started:.3f}s")
+
+dp.startup.register(log_startup_time)
@@ -0,0 +1,80 @@
+# Оперативні показники для адмін-панелі (/admin_setting).
+# Усе оновлюється інкрементально в пам’яті процесу в місцях, де подія
+# відбувається, тому панель не робить жодних COUNT(*) по matches/rooms.
+# У багатопроцесному режимі кожен шард має власні лічильники.
+
+import logging
+import time
+
+# Ширина ковзного вікна для швидкостей, секунд
+WINDOW = 60
+
+started_at = time.time()
+
+
+# Кільцевий буфер посекундних кошиків: add - O(1), count - O(WINDOW)
+class RateCounter:
+    __slots__ = ("buckets", "stamps", "total")
+
+    def __init__(self, window=WINDOW):
+        self.buckets = [0] * window
+        self.stamps = [0] * window
+        self.total = 0
+
+    def add(self, amount=1):
+        second = int(time.time())
+        index = second % len(self.buckets)
+        if self.stamps[index] != second:
+            self.stamps[index] = second
+            self.buckets[index] = 0
+        self.buckets[index] += amount
+        self.total += amount
+
+    def count(self):
+        second = int(time.time())
+        window = len(self.buckets)
+        return sum(value for value, stamp in zip(self.buckets, self.stamps) if second - stamp < window)
+
+    def rate(self):
+        return self.count() / len(self.buckets)
+
+
+rounds = RateCounter()
+errors = RateCounter()
+# token -> created_at для кімнат, що чекають на суперника
+waiting_rooms = {}
+
+
+def room_opened(token, created_at):
+    waiting_rooms[token] = created_at
+
+
+def room_closed(token):
+    waiting_rooms.pop(token, None)
+
+
+def rooms_waiting(room_ttl):
+    # Прострочені кімнати ніхто явно не закриває, тому прибираємо їх тут
+    cutoff = time.time() - room_ttl
+    for token in [token for token, created_at in waiting_rooms.items() if created_at < cutoff]:
+        del waiting_rooms[token]
+    return len(waiting_rooms)
+
+
+# Рахує записи рівня ERROR і вище з усіх логерів
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+
+    def emit(self, record):
+        errors.add()
+
+
+def install_error_counter():
+    root = logging.getLogger()
+    if not any(isinstance(handler, ErrorCounter) for handler in root.handlers):
+        root.addHandler(ErrorCounter())
+
+
+def uptime():
+    return time.time() - started_at
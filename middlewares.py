@@ -0,0 +1,112 @@
+# Зовнішній middleware для dp.update: відсікає дублікати й надто часті
+# натискання ще до хендлерів і запитів до бази.
+# - update_id та id callback-запитів зберігаються в LRU (OrderedDict), тож
+#   повторна доставка того самого оновлення Telegram-ом ігнорується;
+# - для кожного користувача - token bucket: RATE_LIMIT оновлень за секунду
+#   з запасом RATE_BURST (змінні оточення RATE_LIMIT / RATE_BURST).
+
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT = 3
+RATE_BURST = 6
+SEEN_UPDATES_SIZE = 10000
+MAX_TRACKED_USERS = 50000
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated", "warned")
+
+    def __init__(self, burst):
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.warned = False
+
+    def take(self, rate, burst):
+        now = time.monotonic()
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.warned = False
+            return True
+        return False
+
+
+class LRUSet:
+    __slots__ = ("items", "size")
+
+    def __init__(self, size):
+        self.items = OrderedDict()
+        self.size = size
+
+    # Повертає True, якщо ключ уже був
+    def seen(self, key):
+        if key in self.items:
+            self.items.move_to_end(key)
+            return True
+        self.items[key] = None
+        if len(self.items) > self.size:
+            self.items.popitem(last=False)
+        return False
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, rate=None, burst=None, exempt_ids=()):
+        self.rate = rate or float(os.getenv("RATE_LIMIT", RATE_LIMIT))
+        self.burst = burst or float(os.getenv("RATE_BURST", RATE_BURST))
+        self.exempt_ids = set(exempt_ids)
+        self.buckets = OrderedDict()
+        self.seen_updates = LRUSet(SEEN_UPDATES_SIZE)
+        self.seen_callbacks = LRUSet(SEEN_UPDATES_SIZE)
+        self.rejected = 0
+
+    def _bucket(self, user_id):
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = TokenBucket(self.burst)
+            if len(self.buckets) > MAX_TRACKED_USERS:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(user_id)
+        return bucket
+
+    async def __call__(self, handler, event: Update, data):
+        if self.seen_updates.seen(event.update_id):
+            self.rejected += 1
+            logger.debug(f"Duplicate update {event.update_id} dropped")
+            return None
+        callback = event.callback_query
+        if callback and self.seen_callbacks.seen(callback.id):
+            self.rejected += 1
+            logger.debug(f"Duplicate callback {callback.id} dropped")
+            return None
+
+        user = data.get("event_from_user")
+        if user is None or user.id in self.exempt_ids:
+            return await handler(event, data)
+        bucket = self._bucket(user.id)
+        if bucket.take(self.rate, self.burst):
+            return await handler(event, data)
+
+        self.rejected += 1
+        logger.debug(f"Rate limit hit by user {user.id}")
+        # Попереджаємо один раз за серію, щоб не множити запити до API
+        if not bucket.warned:
+            bucket.warned = True
+            try:
+                if callback:
+                    await callback.answer("Занадто часто! Зачекай трохи.")
+                elif event.message:
+                    await event.message.answer("Занадто багато команд. Зачекай кілька секунд.")
+            except TelegramBadRequest as e:
+                logger.debug(f"Failed to warn throttled user {user.id}: {e}")
+        return None
@@ -0,0 +1,59 @@
+# Індекс зайнятих ніків у пам’яті процесу.
+# Ніки порівнюються без урахування регістру (casefold), тож "Vadym" і "vadym"
+# вважаються однаковими. Індекс завантажується на старті й оновлюється при
+# створенні та видаленні акаунтів, тому перевірка доступності і підбір
+# вільних варіантів не ходять у базу. Остаточне рішення все одно за базою:
+# Storage.reserve_character_name вставляє нік одним атомарним запитом.
+# У багатопроцесному режимі кожен шард має власний індекс; нік, зайнятий в
+# іншому шарді, потрапляє сюди після першої невдалої спроби резерву.
+
+import itertools
+import random
+import re
+
+MAX_LENGTH = 20
+NAME_PATTERN = re.compile(rf"^[a-zA-Z0-9_]{{1,{MAX_LENGTH}}}$")
+SUGGESTIONS = 3
+
+taken = set()
+
+
+def name_key(name):
+    return name.casefold()
+
+
+def load(names):
+    taken.clear()
+    taken.update(name_key(name) for name in names if name)
+
+
+def is_valid(name):
+    return NAME_PATTERN.match(name) is not None
+
+
+def is_available(name):
+    return name_key(name) not in taken
+
+
+def add(name):
+    if name:
+        taken.add(name_key(name))
+
+
+def discard(name):
+    if name:
+        taken.discard(name_key(name))
+
+
+# Вільні варіанти зайнятого ніка: спершу name_1..name_9, далі випадкові номери
+def suggest(name, count=SUGGESTIONS):
+    suggestions = []
+    numbers = itertools.chain(range(1, 10), (random.randint(10, 9999) for _ in range(100)))
+    for number in numbers:
+        suffix = f"_{number}"
+        candidate = name[:MAX_LENGTH - len(suffix)] + suffix
+        if is_available(candidate) and candidate not in suggestions:
+            suggestions.append(candidate)
+            if len(suggestions) == count:
+                break
+    return suggestions
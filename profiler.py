@@ -0,0 +1,73 @@
+# Семплювальний профайлер для живого бота (/profile <секунди>).
+# Окремий потік SAMPLE_RATE разів за секунду знімає стек потоку циклу подій
+# через sys._current_frames() і рахує однакові стеки. Код бота при цьому не
+# інструментується, тож накладні витрати малі. Результат - формат
+# "collapsed stacks" (кадри через ";" і кількість), який відкривають
+# flamegraph.pl, speedscope.app та інші.
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+SAMPLE_RATE = 200
+MAX_DURATION = 300
+PROFILE_DIR = "profiles"
+
+_lock = threading.Lock()
+
+
+def frame_name(frame):
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}"
+
+
+def collapse(frame):
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+# Блокує викликача на duration секунд: запускати через asyncio.to_thread
+def sample(thread_id, duration, rate=SAMPLE_RATE):
+    if not _lock.acquire(blocking=False):
+        raise RuntimeError("Profiler is already running")
+    try:
+        stacks = Counter()
+        interval = 1 / rate
+        deadline = time.monotonic() + min(duration, MAX_DURATION)
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stacks[collapse(frame)] += 1
+            del frame
+            time.sleep(interval)
+        return stacks
+    finally:
+        _lock.release()
+
+
+def is_running():
+    return _lock.locked()
+
+
+def render(stacks):
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+# Найчастіші функції на вершині стека (для підпису до файлу)
+def top_functions(stacks, limit=5):
+    leaves = Counter()
+    for stack, count in stacks.items():
+        leaves[stack.rsplit(";", 1)[-1]] += count
+    return leaves.most_common(limit)
+
+
+def save(data, directory=PROFILE_DIR, prefix="profile"):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{prefix}_{time.strftime('%Y%m%d_%H%M%S')}.folded")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(data)
+    return path
@@ -0,0 +1,57 @@
+# Досвід і рівні бійців.
+# end_match нараховує досвід (award) у буфер у пам’яті, а main.flush_progress
+# раз на кілька секунд застосовує його до бази однією транзакцією. Бійців,
+# які саме б’ються, flush пропускає: їхні характеристики в базі не змінюються
+# до кінця бою, тож MatchTable, нокдаун і відновлення після рестарту бачать
+# ті самі значення.
+# Рівень L потребує level_xp * L * (L - 1) / 2 досвіду; кожен рівень множить
+# характеристики на (1 + growth[стат]) з rules.json.
+
+from rules import FIGHTER_STATS
+
+# user_id -> ще не збережений досвід
+pending = {}
+
+
+def xp_for_level(level, rules):
+    return rules.level_xp * level * (level - 1) // 2
+
+
+def level_for_xp(xp, rules):
+    level = 1
+    while level < rules.max_level and xp >= xp_for_level(level + 1, rules):
+        level += 1
+    return level
+
+
+# Множники характеристик (у порядку FIGHTER_STATS) за levels нових рівнів
+def growth_factors(levels, rules):
+    return tuple((1 + rules.growth[name]) ** levels for name in FIGHTER_STATS)
+
+
+# Досвід учасникам матчу; winner_id=None - нічия
+def match_awards(player_ids, winner_id, knockout, rules):
+    if winner_id is None:
+        return {player_id: rules.draw_xp for player_id in player_ids}
+    return {
+        player_id: rules.win_xp + (rules.knockout_bonus_xp if knockout else 0) if player_id == winner_id else rules.loss_xp
+        for player_id in player_ids
+    }
+
+
+def award(user_id, xp):
+    pending[user_id] = pending.get(user_id, 0) + xp
+
+
+# Забирає з буфера досвід усіх, хто зараз не в бою
+def take_ready(busy_ids):
+    ready = {user_id: xp for user_id, xp in pending.items() if user_id not in busy_ids}
+    for user_id in ready:
+        del pending[user_id]
+    return ready
+
+
+# Повертає в буфер досвід, який не вдалося зберегти
+def restore(awards):
+    for user_id, xp in awards.items():
+        award(user_id, xp)
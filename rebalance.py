@@ -0,0 +1,237 @@
+# Офлайн-перевірка змін балансу на записаних боях:
+#   python rebalance.py candidate.json [інші.json ...] --db backups/bot.db --workers 8
+# Дії гравців з round_events (та сама таблиця, що вивантажує export_api.py)
+# програються заново через fight_engine під поточними правилами (--baseline)
+# і під кожним кандидатом.
+# Звіт - зміна відсотка перемог, нокаутів і довжини бою за типом бійця.
+#
+# Як саме програється матч:
+# - бійці беруть пресети свого типу з відповідних правил (рівні не
+#   враховуються), старт - як у create_match;
+# - усі набори правил отримують ті самі випадкові числа (seed + match_id),
+#   тож різниця між ними - від правил, а не від шуму;
+# - нокдаун і вставання - як у handle_knockdown, перерва між раундами
+#   відновлює rest_recovery енергії, після останньої записаної дії матч
+#   вирішується за очками;
+# - якщо бій пішов інакше і записана дія на новій дистанції недоступна,
+#   удар замінюється на jab, інша дія - на block (лічильник "замін").
+# Матчі діляться на шматки за діапазоном match_id (індекс round_events) і
+# рахуються в ProcessPoolExecutor; кожен процес читає свій діапазон з бази
+# сам, назад повертаються лише лічильники. Базу краще брати з бекапу
+# (backup.py, розпакувати .gz), але читання йде в режимі лише для читання.
+
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from fight_engine import MatchTable, legal_actions, resolve_round
+from rules import ATTACK_NAMES, FIGHTER_STATS, load_rules
+from storage import EXPORT_MATCHES_QUERY
+
+CHUNK_MATCHES = 2000
+
+EVENTS_QUERY = """SELECT match_id, round_num, distance, player1_action, player2_action
+    FROM round_events WHERE match_id BETWEEN ? AND ? ORDER BY match_id, event_id"""
+
+# Лічильники за типом бійця
+FIGHTS, WINS, DRAWS, KNOCKOUTS, EXCHANGES = range(5)
+
+# Стан процесу-обробника (див. init_worker)
+_conn = None
+_rule_sets = ()
+_tables = {}
+
+
+def connect(path):
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+
+def init_worker(db_path, rule_paths):
+    global _conn, _rule_sets
+    _conn = connect(db_path)
+    _rule_sets = tuple(load_rules(path) for path in rule_paths)
+
+
+# MatchTable залежить лише від типів бійців, тож кешується на пару типів
+# разом зі стартовою енергією (як у create_match - стат stamina)
+def match_table(index, types):
+    key = (index, types)
+    cached = _tables.get(key)
+    if cached is None:
+        rules = _rule_sets[index]
+        stats = [
+            {"fighter_type": fighter_type, **{name: getattr(rules.fighters[fighter_type], name) for name in FIGHTER_STATS}}
+            for fighter_type in types
+        ]
+        table = MatchTable("p1", stats[0], "p2", stats[1], rules)
+        cached = _tables[key] = (table, (stats[0]["stamina"], stats[1]["stamina"]))
+    return cached
+
+
+def legal_action(action, distance, player_num):
+    if action in legal_actions(distance, player_num):
+        return action, False
+    return ("jab" if action in ATTACK_NAMES else "block"), True
+
+
+# Повертає (переможець 0/1/None, нокаут, кількість обмінів, кількість замін)
+def replay(events, table, start_stamina, rng):
+    rules = table.rules
+    fighters = table.fighters
+    health = [fighters[0].max_health, fighters[1].max_health]
+    stamina = list(start_stamina)
+    distance = events[0][2]
+    round_num = events[0][1]
+    substitutions = 0
+    exchanges = 0
+    for _, event_round, _, p1_action, p2_action in events:
+        if event_round != round_num:
+            round_num = event_round
+            stamina = [min(100, value + rules.rest_recovery) for value in stamina]
+        p1_action, p1_changed = legal_action(p1_action, distance, 1)
+        p2_action, p2_changed = legal_action(p2_action, distance, 2)
+        substitutions += p1_changed + p2_changed
+        result = resolve_round(table, distance, health, stamina, (p1_action, p2_action), rng)
+        health, stamina, distance = list(result.health), list(result.stamina), result.distance
+        exchanges += 1
+        # Як announce_round: за обмін обробляється один нокдаун, гравець 1 першим
+        for i in (0, 1):
+            if health[i] <= 0:
+                if rng() < min(0.8, 0.4 * fighters[i].will):
+                    health[i] = max(0.2 * fighters[i].max_health, health[i])
+                    stamina[i] = min(stamina[i] + 40, 100)
+                    break
+                return 1 - i, True, exchanges, substitutions
+    if health[0] == health[1]:
+        return None, False, exchanges, substitutions
+    return (0 if health[0] > health[1] else 1), False, exchanges, substitutions
+
+
+# Один шматок матчів: {(індекс правил, тип бійця): лічильники}, {індекс: заміни}
+def replay_chunk(first_id, last_id, types, seed):
+    totals = {}
+    substitutions = {}
+    rows = _conn.execute(EVENTS_QUERY, (first_id, last_id))
+    for match_id, events in itertools.groupby(rows, key=lambda row: row[0]):
+        pair = types.get(match_id)
+        if pair is None:
+            continue
+        events = list(events)
+        for index, rules in enumerate(_rule_sets):
+            if pair[0] not in rules.fighters or pair[1] not in rules.fighters:
+                continue
+            rng = random.Random(seed * 1_000_003 + match_id).random
+            table, start_stamina = match_table(index, pair)
+            winner, knockout, exchanges, changed = replay(events, table, start_stamina, rng)
+            substitutions[index] = substitutions.get(index, 0) + changed
+            for i, fighter_type in enumerate(pair):
+                counters = totals.setdefault((index, fighter_type), [0, 0, 0, 0, 0])
+                counters[FIGHTS] += 1
+                counters[EXCHANGES] += exchanges
+                if winner is None:
+                    counters[DRAWS] += 1
+                elif winner == i:
+                    counters[WINS] += 1
+                    counters[KNOCKOUTS] += knockout
+    return totals, substitutions
+
+
+# Завершені матчі з відомими типами обох бійців, за зростанням match_id
+def load_matches(db_path):
+    with connect(db_path) as conn:
+        types = dict(conn.execute("SELECT user_id, fighter_type FROM fighter_stats"))
+        matches = []
+        for _, match_id, player1_id, player2_id, *_ in conn.execute(EXPORT_MATCHES_QUERY.format(after=0)):
+            if player1_id in types and player2_id in types:
+                matches.append((match_id, (types[player1_id], types[player2_id])))
+    # Вивантаження йде в порядку завершення, а шматки - за діапазоном match_id
+    matches.sort()
+    return matches
+
+
+def chunks(matches, size):
+    for start in range(0, len(matches), size):
+        part = matches[start:start + size]
+        yield part[0][0], part[-1][0], dict(part)
+
+
+def run(db_path, rule_paths, workers, seed, chunk_size=CHUNK_MATCHES):
+    matches = load_matches(db_path)
+    totals = {}
+    substitutions = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(db_path, rule_paths)) as pool:
+        futures = [
+            pool.submit(replay_chunk, first_id, last_id, types, seed)
+            for first_id, last_id, types in chunks(matches, chunk_size)
+        ]
+        for future in as_completed(futures):
+            chunk_totals, chunk_substitutions = future.result()
+            for key, counters in chunk_totals.items():
+                merged = totals.setdefault(key, [0, 0, 0, 0, 0])
+                for i, value in enumerate(counters):
+                    merged[i] += value
+            for index, value in chunk_substitutions.items():
+                substitutions[index] = substitutions.get(index, 0) + value
+    return len(matches), totals, substitutions
+
+
+def rates(counters):
+    fights = counters[FIGHTS] or 1
+    return (
+        100 * counters[WINS] / fights,
+        100 * counters[KNOCKOUTS] / fights,
+        counters[EXCHANGES] / fights,
+    )
+
+
+def report(rule_paths, totals, substitutions):
+    fighter_types = sorted({fighter_type for _, fighter_type in totals})
+    baseline = {fighter_type: totals.get((0, fighter_type)) for fighter_type in fighter_types}
+    print(f"Базові правила: {rule_paths[0]} (замін дій: {substitutions.get(0, 0)})")
+    for index, path in enumerate(rule_paths[1:], start=1):
+        print(f"\n{path} (замін дій: {substitutions.get(index, 0)})")
+        print(f"{'тип':<12}{'боїв':>9}{'перемоги %':>22}{'нокаути %':>22}{'обмінів':>22}")
+        for fighter_type in fighter_types:
+            before, after = baseline[fighter_type], totals.get((index, fighter_type))
+            if not before or not after:
+                print(f"{fighter_type:<12}{'-':>9}  немає в одному з наборів правил")
+                continue
+            columns = "".join(
+                f"{old:>8.1f} →{new:>6.1f} ({new - old:+5.1f})"
+                for old, new in zip(rates(before), rates(after))
+            )
+            print(f"{fighter_type:<12}{after[FIGHTS]:>9}{columns}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded fights under candidate rules and compare outcomes")
+    parser.add_argument("candidates", nargs="+", help="файли правил-кандидатів (формат rules.json)")
+    parser.add_argument("--db", default=os.getenv("DB_PATH", "bot.db"), help="база SQLite з round_events")
+    parser.add_argument("--baseline", default=None, help="правила для порівняння (за замовчуванням RULES_PATH або rules.json)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk", type=int, default=CHUNK_MATCHES, help="матчів на завдання")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    # Некоректний файл правил має впасти тут, а не в кожному процесі
+    baseline_path = args.baseline or os.getenv("RULES_PATH") or None
+    rule_paths = [baseline_path] + args.candidates
+    for path in rule_paths:
+        load_rules(path)
+
+    started = time.perf_counter()
+    matches, totals, substitutions = run(args.db, rule_paths, args.workers, args.seed, args.chunk)
+    exchanges = sum(counters[EXCHANGES] for (index, _), counters in totals.items() if index == 0) // 2
+    print(
+        f"Програно {matches} матчів ({exchanges} обмінів) x {len(rule_paths)} наборів правил "
+        f"за {time.perf_counter() - started:.1f} с, процесів: {args.workers}\n"
+    )
+    report([baseline_path or "rules.json"] + args.candidates, totals, substitutions)
+
+
+if __name__ == "__main__":
+    main()
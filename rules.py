@@ -0,0 +1,169 @@
+# Правила гри з rules.json (шлях можна змінити через RULES_PATH).
+# Файл перевіряється і компілюється в незмінні об’єкти зі __slots__, тож
+# гарячий шлях читає атрибути, а не розбирає словники. /reload_rules (або
+# SIGHUP) підміняє rules.current; матчі, що вже йдуть, тримають посилання на
+# правила, з якими почались (MatchTable.rules), і догравають за ними.
+
+import json
+import logging
+import os
+from types import MappingProxyType
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json")
+
+# Формули fight_engine написані під ці удари, тож набір фіксований
+ATTACK_NAMES = ("jab", "uppercut", "hook")
+FIGHTER_STATS = ("stamina", "strength", "reaction", "health", "punch_speed", "will", "footwork")
+TIMING_FIELDS = (
+    "action_window", "rounds", "round_length", "rest_interval", "rest_recovery",
+    "room_ttl", "search_timeout", "knockdown_count",
+)
+PROGRESSION_FIELDS = ("win_xp", "draw_xp", "loss_xp", "knockout_bonus_xp", "level_xp", "max_level")
+
+
+class RulesError(ValueError):
+    pass
+
+
+class _Frozen:
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def _set(self, **values):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+
+class Attack(_Frozen):
+    __slots__ = ("name", "base_damage", "stamina_cost", "base_hit_chance")
+
+    def __init__(self, name, base_damage, stamina_cost, base_hit_chance):
+        self._set(name=name, base_damage=base_damage, stamina_cost=stamina_cost, base_hit_chance=base_hit_chance)
+
+
+class FighterPreset(_Frozen):
+    __slots__ = ("fighter_type", "title", "description") + FIGHTER_STATS
+
+    def __init__(self, fighter_type, title, description, **stats):
+        self._set(fighter_type=fighter_type, title=title, description=description, **stats)
+
+    # Характеристики для fighter_stats (Storage.set_fighter)
+    def stats(self):
+        return {name: getattr(self, name) for name in FIGHTER_STATS}
+
+
+class Rules(_Frozen):
+    __slots__ = (
+        "version", "attacks", "attack_names", "fighters",
+        "cornered_hit_bonus", "cornered_damage_bonus", "growth",
+    ) + TIMING_FIELDS + PROGRESSION_FIELDS
+
+    def __init__(self, version, attacks, fighters, cornered_hit_bonus, cornered_damage_bonus, growth, **values):
+        self._set(
+            version=version,
+            attacks=attacks,
+            attack_names=frozenset(attack.name for attack in attacks),
+            fighters=MappingProxyType(fighters),
+            cornered_hit_bonus=cornered_hit_bonus,
+            cornered_damage_bonus=cornered_damage_bonus,
+            growth=MappingProxyType(growth),
+            **values
+        )
+
+
+# minimum виключний, якщо не передано inclusive=True
+def _number(section, data, name, minimum=0, maximum=None, integer=False, inclusive=False):
+    value = data.get(name)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or (integer and not isinstance(value, int)):
+        raise RulesError(f"{section}.{name}: expected {'an integer' if integer else 'a number'}, got {value!r}")
+    if value < minimum or (value == minimum and not inclusive) or (maximum is not None and value > maximum):
+        raise RulesError(f"{section}.{name}: {value} is out of range")
+    return value
+
+
+def _section(data, name):
+    section = data.get(name)
+    if not isinstance(section, dict):
+        raise RulesError(f"{name}: expected an object")
+    return section
+
+
+def compile_rules(data):
+    if not isinstance(data, dict):
+        raise RulesError("rules: expected an object")
+    timing_data = _section(data, "timing")
+    timing = {name: _number("timing", timing_data, name, integer=True) for name in TIMING_FIELDS}
+
+    # Досвід за матчі та приріст характеристик за рівень (див. progression.py)
+    progression_data = _section(data, "progression")
+    # Бонус за нокаут можна вимкнути нулем
+    progression = {
+        name: _number("progression", progression_data, name, integer=True, inclusive=name == "knockout_bonus_xp")
+        for name in PROGRESSION_FIELDS
+    }
+    growth_data = _section(progression_data, "growth")
+    # 0 - стат не росте з рівнем
+    growth = {name: _number("progression.growth", growth_data, name, maximum=1, inclusive=True) for name in FIGHTER_STATS}
+
+    cornered = _section(data, "cornered")
+    hit_bonus = _number("cornered", cornered, "hit_bonus")
+    damage_bonus = _number("cornered", cornered, "damage_bonus")
+
+    attacks_data = _section(data, "attacks")
+    if set(attacks_data) != set(ATTACK_NAMES):
+        raise RulesError(f"attacks: expected exactly {', '.join(ATTACK_NAMES)}")
+    attacks = tuple(
+        Attack(
+            name,
+            _number(f"attacks.{name}", attacks_data[name], "base_damage"),
+            _number(f"attacks.{name}", attacks_data[name], "stamina_cost"),
+            _number(f"attacks.{name}", attacks_data[name], "base_hit_chance", maximum=1),
+        )
+        for name in ATTACK_NAMES
+    )
+
+    fighters_data = _section(data, "fighters")
+    if not fighters_data:
+        raise RulesError("fighters: at least one fighter type is required")
+    fighters = {}
+    for fighter_type, preset in fighters_data.items():
+        if not isinstance(preset, dict):
+            raise RulesError(f"fighters.{fighter_type}: expected an object")
+        fighters[fighter_type] = FighterPreset(
+            fighter_type,
+            str(preset.get("title", fighter_type)),
+            str(preset.get("description", "")),
+            **{name: _number(f"fighters.{fighter_type}", preset, name) for name in FIGHTER_STATS}
+        )
+
+    return Rules(data.get("version", 1), attacks, fighters, hit_bonus, damage_bonus, growth, **timing, **progression)
+
+
+def load_rules(path=None):
+    path = path or os.getenv("RULES_PATH", DEFAULT_PATH)
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        raise RulesError(f"Cannot read rules from {path}: {e}") from e
+    return compile_rules(data)
+
+
+# Поточні правила для нових матчів
+current = load_rules()
+
+
+# Якщо новий файл некоректний, лишаються старі правила, а RulesError летить далі
+def reload_rules(path=None):
+    global current
+    current = load_rules(path)
+    logger.info(f"Loaded rules version {current.version}")
+    return current
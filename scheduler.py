@@ -0,0 +1,126 @@
+# Пріоритетний планувальник оновлень (зовнішній middleware для dp.update).
+# Одночасно обробляється не більше MAX_CONCURRENT_UPDATES оновлень; решта
+# чекає в черзі свого класу, і вільне місце завжди отримує найпріоритетніше:
+#   FIGHT       - кнопки бою (fight_*)
+#   MATCHMAKING - пошук суперника, кімнати, турніри
+#   OTHER       - усе інше (меню, акаунт, глядачі)
+# Нижчі класи можуть зайняти лише частку місць (CLASS_SHARE), тож навіть
+# /start_match, який чекає суперника до 30 секунд, не витіснить бої.
+# Черги обмежені: якщо черга класу повна або оновлення простояло в ній
+# довше за MAX_WAIT, воно відкидається з короткою відповіддю користувачу.
+
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+FIGHT, MATCHMAKING, OTHER = 0, 1, 2
+PRIORITY_NAMES = ("бої", "пошук і кімнати", "інше")
+
+MATCHMAKING_COMMANDS = (
+    "/start_match", "/create_room", "/join_room", "/start_fight",
+    "/create_tournament", "/join_tournament", "/start_tournament",
+)
+# Текстові відповіді в цих станах FSM - частина створення кімнати
+MATCHMAKING_STATES = ("RoomCreation:awaiting_room_token",)
+
+MAX_CONCURRENT_UPDATES = 64
+CLASS_SHARE = (1.0, 0.5, 0.25)
+QUEUE_LIMITS = (5000, 500, 200)
+# Скільки оновлення класу може чекати, перш ніж його відкинуть, секунд
+MAX_WAIT = (None, 10.0, 3.0)
+
+
+def classify(event, data):
+    callback = event.callback_query
+    if callback:
+        return FIGHT if (callback.data or "").startswith("fight_") else OTHER
+    message = event.message
+    if message and message.text:
+        command = message.text.split(maxsplit=1)[0].split("@")[0]
+        if command in MATCHMAKING_COMMANDS:
+            return MATCHMAKING
+        if data.get("raw_state") in MATCHMAKING_STATES:
+            return MATCHMAKING
+    return OTHER
+
+
+class UpdateScheduler(BaseMiddleware):
+    def __init__(self, concurrency=None, exempt_ids=()):
+        self.concurrency = concurrency or int(os.getenv("MAX_CONCURRENT_UPDATES", MAX_CONCURRENT_UPDATES))
+        self.caps = tuple(max(1, int(self.concurrency * share)) for share in CLASS_SHARE)
+        self.exempt_ids = set(exempt_ids)
+        # (час постановки, future): True - можна обробляти, False - відкинуто
+        self.queues = tuple(deque() for _ in QUEUE_LIMITS)
+        self.running = [0] * len(QUEUE_LIMITS)
+        self.shed = [0] * len(QUEUE_LIMITS)
+
+    def queued(self):
+        return [len(queue) for queue in self.queues]
+
+    # Видає вільні місця чергам у порядку пріоритету
+    def _dispatch(self):
+        now = time.monotonic()
+        while sum(self.running) < self.concurrency:
+            for priority, queue in enumerate(self.queues):
+                if queue and self.running[priority] < self.caps[priority]:
+                    break
+            else:
+                return
+            enqueued, admitted = queue.popleft()
+            if admitted.done():
+                continue
+            if MAX_WAIT[priority] is not None and now - enqueued > MAX_WAIT[priority]:
+                admitted.set_result(False)
+                continue
+            self.running[priority] += 1
+            admitted.set_result(True)
+
+    def _release(self, priority):
+        self.running[priority] -= 1
+        self._dispatch()
+
+    async def __call__(self, handler, event: Update, data):
+        user = data.get("event_from_user")
+        # Адміни не стоять у черзі, щоб панель працювала і під навантаженням
+        if user and user.id in self.exempt_ids:
+            return await handler(event, data)
+        priority = classify(event, data)
+        queue = self.queues[priority]
+        if len(queue) >= QUEUE_LIMITS[priority]:
+            await self._shed(priority, event)
+            return None
+        admitted = asyncio.get_running_loop().create_future()
+        queue.append((time.monotonic(), admitted))
+        self._dispatch()
+        try:
+            if not await admitted:
+                await self._shed(priority, event)
+                return None
+        except asyncio.CancelledError:
+            # Місце могли видати в ту ж ітерацію, коли задачу скасували
+            if admitted.done() and not admitted.cancelled() and admitted.result():
+                self._release(priority)
+            raise
+        try:
+            return await handler(event, data)
+        finally:
+            self._release(priority)
+
+    async def _shed(self, priority, event):
+        self.shed[priority] += 1
+        logger.debug(f"Shedding update {event.update_id} ({PRIORITY_NAMES[priority]}): bot is overloaded")
+        try:
+            if event.callback_query:
+                await event.callback_query.answer("Бот зараз перевантажений. Спробуй за хвилинку.")
+            elif event.message:
+                await event.message.answer("Бот зараз перевантажений, спробуй за хвилинку. Бої тривають у звичному режимі.")
+        except TelegramBadRequest as e:
+            logger.debug(f"Failed to notify about shed update {event.update_id}: {e}")
@@ -0,0 +1,279 @@
+# Багатопроцесний режим бота:
+#   python sharding.py --workers 4
+# Фронт-процес приймає webhook-оновлення від Telegram і розподіляє їх між
+# воркерами через локальні unix-сокети. Кожен воркер імпортує main.py і сам
+# обробляє свою частину матчів (шард визначається за match_id або user_id).
+# Пошук суперника (/start_match) завжди йде у шард 0, щоб черга була спільною.
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import tempfile
+
+from aiohttp import web, ClientSession
+from dotenv import load_dotenv
+
+from export_api import setup_export
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("PORT", 8080))
+
+# Команди, які мають оброблятися в одному процесі (спільна черга пошуку,
+# турнірні сітки в пам’яті шарду 0)
+COORDINATED_COMMANDS = ("/start_match", "/create_tournament", "/join_tournament", "/start_tournament")
+
+
+# Визначення шарду для оновлення
+def shard_for_update(update, shards):
+    if shards <= 1:
+        return 0
+
+    callback = update.get("callback_query")
+    if callback:
+        data = callback.get("data") or ""
+        if data.startswith("fight_"):
+            parts = data.split("_")
+            if len(parts) > 1 and parts[1].isdigit():
+                return int(parts[1]) % shards
+        return callback["from"]["id"] % shards
+
+    message = update.get("message") or update.get("edited_message")
+    if message:
+        text = message.get("text") or ""
+        command = text.split(maxsplit=1)[0].split("@")[0] if text else ""
+        if command in COORDINATED_COMMANDS:
+            return 0
+        # Глядач підписується в тому шарді, де рахуються раунди бою
+        if command == "/watch":
+            args = text.split()
+            if len(args) > 1 and args[1].isdigit():
+                return int(args[1]) % shards
+        user = message.get("from") or message.get("chat")
+        return user["id"] % shards
+
+    for value in update.values():
+        if isinstance(value, dict) and isinstance(value.get("from"), dict):
+            return value["from"]["id"] % shards
+    return 0
+
+
+def socket_path_for(shard_id):
+    return os.path.join(tempfile.gettempdir(), f"boxbot_shard_{os.getpid()}_{shard_id}.sock")
+
+
+# ---------- Воркер ----------
+
+def worker_entry(shard_id, shards, socket_path, cleanup, front_pid):
+    os.environ["SHARD_ID"] = str(shard_id)
+    os.environ["SHARD_COUNT"] = str(shards)
+    os.environ["DB_CLEANUP"] = "1" if cleanup else "0"
+    # /drain у воркері зупиняє всі шарди через SIGTERM фронту
+    os.environ["FRONT_PID"] = str(front_pid)
+    asyncio.run(run_worker(socket_path))
+
+
+async def run_worker(socket_path):
+    import main  # Імпортуємо тут, щоб фронт не тягнув aiogram і не чіпав базу
+
+    tasks = set()
+
+    async def handle_connection(reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                update = json.loads(line)
+            except ValueError as e:
+                main.logger.error(f"Shard {main.SHARD_ID}: bad update payload: {e}")
+                continue
+            task = asyncio.create_task(main.dp.feed_raw_update(main.bot, update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        writer.close()
+
+    # Сокет відкривається лише після startup: фронт чекає, поки шард 0
+    # почистить базу, і лише тоді запускає решту шардів
+    await main.dp.emit_startup(bot=main.bot, **main.dp.workflow_data)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = await asyncio.start_unix_server(handle_connection, path=socket_path)
+    main.logger.info(f"Shard {main.SHARD_ID} is ready on {socket_path}")
+    try:
+        async with server:
+            # SIGTERM або /drain: шард дограває бої і встановлює shutdown_event
+            await main.shutdown_event.wait()
+        main.logger.info(f"Shard {main.SHARD_ID} drained, exiting")
+    finally:
+        await main.dp.emit_shutdown(bot=main.bot, **main.dp.workflow_data)
+        await main.bot.session.close()
+
+
+# ---------- Фронт ----------
+
+class ShardLink:
+    def __init__(self, shard_id, shards):
+        self.shard_id = shard_id
+        self.shards = shards
+        self.socket_path = socket_path_for(shard_id)
+        self.process = None
+        self.writer = None
+        self.lock = asyncio.Lock()
+        self.stopping = False
+
+    def spawn(self, cleanup):
+        ctx = multiprocessing.get_context("spawn")
+        self.process = ctx.Process(
+            target=worker_entry,
+            args=(self.shard_id, self.shards, self.socket_path, cleanup, os.getpid()),
+            name=f"boxbot-shard-{self.shard_id}",
+            daemon=True,
+        )
+        self.process.start()
+        logger.info(f"Spawned shard {self.shard_id} (pid {self.process.pid})")
+
+    async def connect(self, timeout=60):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                _, self.writer = await asyncio.open_unix_connection(self.socket_path)
+                return
+            except (FileNotFoundError, ConnectionRefusedError):
+                if loop.time() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+    async def send(self, update):
+        payload = json.dumps(update, ensure_ascii=False).encode() + b"\n"
+        async with self.lock:
+            if self.writer is None or self.writer.is_closing():
+                await self.restart()
+            self.writer.write(payload)
+            await self.writer.drain()
+
+    async def restart(self):
+        if self.stopping:
+            raise ConnectionError(f"Shard {self.shard_id} is shutting down")
+        if self.process is None or not self.process.is_alive():
+            logger.error(f"Shard {self.shard_id} is down, restarting")
+            # При перезапуску не чистимо активні матчі інших шардів
+            self.spawn(cleanup=False)
+        await self.connect()
+
+
+async def set_webhook():
+    if not WEBHOOK_URL:
+        logger.info("WEBHOOK_URL is not set, skipping setWebhook")
+        return
+    params = {"url": WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH}
+    if WEBHOOK_SECRET:
+        params["secret_token"] = WEBHOOK_SECRET
+    async with ClientSession() as session:
+        async with session.post(f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/setWebhook", json=params) as resp:
+            logger.info(f"setWebhook: {resp.status} {await resp.text()}")
+
+
+def build_web_app(links):
+    app = web.Application()
+    app["shard_links"] = links
+
+    async def handle_update(request):
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=403)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        link = links[shard_for_update(update, len(links))]
+        try:
+            await link.send(update)
+        except (OSError, ConnectionError) as e:
+            logger.error(f"Failed to forward update to shard {link.shard_id}: {e}")
+            # 500 змушує Telegram повторити доставку
+            return web.Response(status=500)
+        return web.Response()
+
+    async def handle_health(request):
+        alive = [link.shard_id for link in links if link.process and link.process.is_alive()]
+        return web.json_response({"shards": len(links), "alive": alive})
+
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get("/health", handle_health)
+    setup_export(app)
+    return app
+
+
+def forward_signal(links, signum):
+    for link in links:
+        if link.process and link.process.is_alive():
+            os.kill(link.process.pid, signum)
+
+
+async def run_front(workers):
+    if not TELEGRAM_TOKEN:
+        logger.error("TELEGRAM_TOKEN is not set")
+        raise ValueError("TELEGRAM_TOKEN is required")
+
+    links = [ShardLink(shard_id, workers) for shard_id in range(workers)]
+    # Шард 0 стартує першим і єдиний чистить базу від незавершених матчів
+    links[0].spawn(cleanup=True)
+    await links[0].connect()
+    for link in links[1:]:
+        link.spawn(cleanup=False)
+    await asyncio.gather(*(link.connect() for link in links[1:]))
+
+    app = build_web_app(links)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEB_HOST, WEB_PORT)
+    await site.start()
+    logger.info(f"Front is listening on {WEB_HOST}:{WEB_PORT}{WEBHOOK_PATH} with {workers} shards")
+    await set_webhook()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    # SIGHUP фронту перечитує правила гри в усіх шардах
+    loop.add_signal_handler(signal.SIGHUP, lambda: forward_signal(links, signal.SIGHUP))
+    try:
+        await stop.wait()
+        # Воркери отримують SIGTERM і догравають бої; фронт тим часом
+        # продовжує пересилати їм оновлення
+        logger.info("SIGTERM received, draining shards")
+        for link in links:
+            link.stopping = True
+            if link.process and link.process.is_alive():
+                link.process.terminate()
+        while any(link.process and link.process.is_alive() for link in links):
+            await asyncio.sleep(1)
+        logger.info("All shards drained")
+    finally:
+        await runner.cleanup()
+        for link in links:
+            if link.process and link.process.is_alive():
+                link.process.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Box Manager bot: multi-process mode")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="кількість процесів-воркерів")
+    args = parser.parse_args()
+    asyncio.run(run_front(max(1, args.workers)))
+
+
+if __name__ == "__main__":
+    main()
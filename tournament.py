@@ -0,0 +1,145 @@
+# Турнірна сітка на вибування.
+# Стан сітки (to_dict) зберігається в таблиці tournaments. Набір учасників
+# і старт - команди шарду 0, який тримає копію сіток у пам’яті. Після старту
+# сітку змінює той шард, де завершився матч: main.update_bracket читає її з
+# бази і записує, лише якщо її ніхто не змінив після читання; слот матчу
+# береться з таблиці tournament_matches. Тому перед командою турніру шард 0
+# звіряє з базою запущену сітку гравця (refresh).
+# Наступний матч стартує, щойно відомі обидва його учасники, без очікування
+# решти кола.
+
+import random
+
+MIN_PARTICIPANTS = 2
+MAX_PARTICIPANTS = 128
+
+# token -> Bracket для незавершених турнірів (копія шарду 0)
+active_brackets = {}
+# user_id -> token незавершеного турніру гравця
+user_index = {}
+
+
+class Bracket:
+    __slots__ = ("token", "creator_id", "capacity", "participants", "status", "rounds", "champion")
+
+    def __init__(self, token, creator_id, capacity, participants=None, status="gathering", rounds=None, champion=None):
+        self.token = token
+        self.creator_id = creator_id
+        self.capacity = capacity
+        self.participants = participants or []
+        self.status = status
+        # rounds[коло][слот] = [гравець1, гравець2, match_id, переможець]
+        self.rounds = rounds or []
+        self.champion = champion
+
+    def add(self, user_id):
+        if self.status != "gathering" or user_id in self.participants or len(self.participants) >= self.capacity:
+            return False
+        self.participants.append(user_id)
+        user_index[user_id] = self.token
+        return True
+
+    # Повертає пари, готові до бою: (коло, слот, гравець1, гравець2)
+    def start(self, rng=random):
+        players = list(self.participants)
+        rng.shuffle(players)
+        size = 1
+        while size < len(players):
+            size *= 2
+        # Вільні місця (bye) розподіляються по одному на слот першого кола
+        byes = size - len(players)
+        first_round = []
+        for k in range(size // 2):
+            if k < byes:
+                first_round.append([players.pop(), None, None, None])
+            else:
+                first_round.append([players.pop(), players.pop(), None, None])
+        self.rounds = [first_round]
+        slots = size // 2
+        while slots > 1:
+            slots //= 2
+            self.rounds.append([[None, None, None, None] for _ in range(slots)])
+        self.status = "running"
+
+        ready = []
+        for k, slot in enumerate(first_round):
+            if slot[1] is None:
+                ready.extend(self._advance(0, k, slot[0]))
+            else:
+                ready.append((0, k, slot[0], slot[1]))
+        return ready
+
+    def assign_match(self, round_num, slot_num, match_id):
+        self.rounds[round_num][slot_num][2] = match_id
+
+    def record_result(self, round_num, slot_num, winner_id):
+        if self.rounds[round_num][slot_num][3] is not None:
+            return []
+        return self._advance(round_num, slot_num, winner_id)
+
+    def _advance(self, round_num, slot_num, winner_id):
+        self.rounds[round_num][slot_num][3] = winner_id
+        if round_num == len(self.rounds) - 1:
+            self.champion = winner_id
+            self.status = "finished"
+            return []
+        next_slot = self.rounds[round_num + 1][slot_num // 2]
+        next_slot[slot_num % 2] = winner_id
+        if next_slot[0] is not None and next_slot[1] is not None:
+            return [(round_num + 1, slot_num // 2, next_slot[0], next_slot[1])]
+        return []
+
+    # Матчі, які були в процесі під час перезапуску, треба почати знову
+    def pending_pairs(self):
+        return [
+            (r, k, slot[0], slot[1])
+            for r, round_slots in enumerate(self.rounds)
+            for k, slot in enumerate(round_slots)
+            if slot[0] is not None and slot[1] is not None and slot[3] is None
+        ]
+
+    def round_name(self, round_num):
+        remaining = len(self.rounds) - round_num
+        return {1: "Фінал", 2: "Півфінал", 3: "Чвертьфінал"}.get(remaining, f"Коло {round_num + 1}")
+
+    def to_dict(self):
+        return {
+            "token": self.token,
+            "creator_id": self.creator_id,
+            "capacity": self.capacity,
+            "participants": self.participants,
+            "status": self.status,
+            "rounds": self.rounds,
+            "champion": self.champion,
+        }
+
+    # Сітка для копії шарду 0 (з індексом учасників); для разової зміни
+    # в іншому шарді досить Bracket(**data)
+    @classmethod
+    def from_dict(cls, data):
+        bracket = cls(**data)
+        for user_id in bracket.participants:
+            user_index[user_id] = bracket.token
+        return bracket
+
+
+# Оновлення копії шарду 0 запущеної сітки зі стану в базі (data=None - сітки
+# там немає). Повертає актуальну сітку або None, якщо турнір завершився
+def refresh(bracket, data):
+    if data is None or data["status"] == "finished":
+        close_bracket(bracket)
+        return None
+    bracket = active_brackets[bracket.token] = Bracket.from_dict(data)
+    return bracket
+
+
+def find_user_bracket(user_id):
+    token = user_index.get(user_id)
+    return active_brackets.get(token) if token else None
+
+
+def close_bracket(bracket):
+    active_brackets.pop(bracket.token, None)
+    for user_id in bracket.participants:
+        if user_index.get(user_id) == bracket.token:
+            del user_index[user_id]